@@ -0,0 +1,554 @@
+"""Benchmarks for the BTC price bot
+
+Usage:
+    python benchmark.py split    # Message splitter micro-benchmark
+    python benchmark.py e2e      # Whole bot against local Telegram/CoinGecko stand-ins
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import telegram_btc_bot as bot
+
+
+# ============================================================================
+# Message Splitter Micro-benchmark
+# ============================================================================
+
+def legacy_split_message(message, max_length=4000):
+    """The original split_message, kept here for comparison"""
+    if len(message) <= max_length:
+        return [message]
+
+    messages = []
+    lines = message.split('\n')
+    current_message = ""
+
+    for line in lines:
+        test_message = current_message + line + '\n' if current_message else line + '\n'
+
+        if len(test_message) > max_length:
+            if current_message:
+                messages.append(current_message.strip())
+                current_message = ""
+
+            if len(line) > max_length:
+                words = line.split()
+                for word in words:
+                    test_word = current_message + word + ' ' if current_message else word + ' '
+                    if len(test_word) > max_length:
+                        if current_message:
+                            messages.append(current_message.strip())
+                            current_message = word + ' '
+                        else:
+                            messages.append(word[:max_length])
+                            current_message = word[max_length:] + ' '
+                    else:
+                        current_message = test_word
+            else:
+                current_message = line + '\n'
+        else:
+            current_message = test_message
+
+    if current_message:
+        messages.append(current_message.strip())
+
+    return messages
+
+def make_crypto_data(coin_count):
+    """Synthetic /coins/markets response with coin_count entries"""
+    return [
+        {
+            "id": f"coin-{rank}",
+            "symbol": f"c{rank}",
+            "name": f"Coin Number {rank}",
+            "current_price": 60000.0 / rank,
+            "price_change_percentage_24h": (rank % 7) - 3.5,
+            "market_cap_rank": rank,
+        }
+        for rank in range(1, coin_count + 1)
+    ]
+
+def count_unbalanced_parts(parts):
+    """Parts Telegram would reject because a <b>/<code> pair is cut"""
+    return sum(1 for part in parts
+               if part.count("<b>") != part.count("</b>") or part.count("<code>") != part.count("</code>"))
+
+def bench_split(repeat):
+    """Compare the linear splitter with the legacy implementation"""
+    cases = [(f"top {count} coins", bot.format_top_crypto_message(make_crypto_data(count), coin_count=count))
+             for count in (25, 100, 1000, 10000)]
+    long_line = "<b>" + " ".join(["Bitcoin&amp;Ethereum"] * 5000) + "</b>"
+    cases.append(("single 100 KB line", long_line))
+
+    print(f"{'case':<20} {'chars':>9} {'legacy ms':>10} {'new ms':>9} {'speed-up':>9} {'parts':>6} {'broken (legacy/new)':>20}")
+    for name, message in cases:
+        number = max(1, repeat // max(1, len(message) // 4000))
+        legacy_time = min(timeit.repeat(lambda: legacy_split_message(message), number=number, repeat=3)) / number
+        new_time = min(timeit.repeat(lambda: bot.split_message(message), number=number, repeat=3)) / number
+        new_parts = bot.split_message(message)
+        broken = f"{count_unbalanced_parts(legacy_split_message(message))}/{count_unbalanced_parts(new_parts)}"
+        print(f"{name:<20} {len(message):>9} {legacy_time * 1000:>10.3f} {new_time * 1000:>9.3f} "
+              f"{legacy_time / new_time:>8.1f}x {len(new_parts):>6} {broken:>20}")
+
+# ============================================================================
+# Local API Stand-ins
+# ============================================================================
+
+class FakeApiServer:
+    """Threaded keep-alive HTTP server that hands every request to route()"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self.dispatch()
+
+            def do_POST(self):
+                self.dispatch()
+
+            def dispatch(self):
+                parts = urlsplit(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else {}
+                query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+                # Requests are logged on arrival; the simulated latency delays the response
+                status, payload, headers = server.route(parts.path, body or query)
+                if server.latency:
+                    time.sleep(server.latency)
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def route(self, path, params):
+        raise NotImplementedError
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class FakeTelegram(FakeApiServer):
+    """Telegram Bot API stand-in: getUpdates or webhook pushes, sendMessage, getChat and friends"""
+
+    def __init__(self, latency=0.0, rate_limit_rate=0.0, failure_rate=0.0):
+        super().__init__(latency)
+        self.rate_limit_rate = rate_limit_rate
+        self.failure_rate = failure_rate
+        self.updates_ready = threading.Condition(self.lock)
+        self.pending_updates = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.sends = []  # (time, chat_id)
+        self.command_sent_at = {}  # chat_id -> time the latest command was injected
+        self.command_latencies = []
+        self.rate_limited = 0
+        self.failed = 0
+        self.polls = 0  # getUpdates requests
+        self.webhook = None  # (url, secret_token) while a webhook is registered
+
+    def inject_command(self, chat_id, user_id, text):
+        with self.lock:
+            update = {
+                "update_id": self.next_update_id,
+                "message": {"text": text, "chat": {"id": chat_id}, "from": {"id": user_id, "username": "bench"}},
+            }
+            self.next_update_id += 1
+            self.command_sent_at[chat_id] = time.monotonic()
+            if self.webhook is None:
+                self.pending_updates.append(update)
+                self.updates_ready.notify_all()
+                return
+            url, secret_token = self.webhook
+        threading.Thread(target=self.push_update, args=(url, secret_token, update), daemon=True).start()
+
+    def push_update(self, url, secret_token, update):
+        request = urllib.request.Request(url, data=json.dumps(update).encode("utf-8"), method="POST", headers={
+            "Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": secret_token})
+        with contextlib.suppress(OSError):
+            urllib.request.urlopen(request, timeout=5).close()
+
+    def release_pollers(self):
+        with self.lock:
+            self.updates_ready.notify_all()
+
+    def route(self, path, params):
+        method = path.rsplit("/", 1)[-1]
+        if method == "getUpdates":
+            with self.lock:
+                self.polls += 1
+                if self.webhook is not None:
+                    return 409, {"ok": False, "error_code": 409,
+                                 "description": "Conflict: can't use getUpdates method while webhook is active"}, {}
+                if not self.pending_updates:
+                    self.updates_ready.wait(timeout=min(float(params.get("timeout", 0)), 1.0))
+                offset = params.get("offset", 0)
+                updates = [update for update in self.pending_updates if update["update_id"] >= offset]
+                self.pending_updates = []
+            return 200, {"ok": True, "result": updates}, {}
+
+        if method in ("sendMessage", "editMessageText"):
+            roll = random.random()
+            if roll < self.rate_limit_rate:
+                with self.lock:
+                    self.rate_limited += 1
+                return 429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                             "parameters": {"retry_after": 1}}, {"Retry-After": "1"}
+            if roll < self.rate_limit_rate + self.failure_rate:
+                with self.lock:
+                    self.failed += 1
+                return 500, {"ok": False, "error_code": 500, "description": "Internal Server Error"}, {}
+            now = time.monotonic()
+            chat_id = params.get("chat_id")
+            with self.lock:
+                message_id = self.next_message_id
+                self.next_message_id += 1
+                if chat_id in self.command_sent_at:
+                    self.command_latencies.append(now - self.command_sent_at.pop(chat_id))
+                else:
+                    self.sends.append((now, chat_id))
+            return 200, {"ok": True, "result": {"message_id": params.get("message_id", message_id)}}, {}
+
+        if method == "setWebhook":
+            with self.lock:
+                self.webhook = (params["url"], params.get("secret_token", ""))
+            return 200, {"ok": True, "result": True, "description": "Webhook was set"}, {}
+        if method == "deleteWebhook":
+            with self.lock:
+                self.webhook = None
+            return 200, {"ok": True, "result": True, "description": "Webhook was deleted"}, {}
+        if method == "getMe":
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}}, {}
+        if method == "getChat":
+            return 200, {"ok": True, "result": {"id": -1001, "type": "channel", "title": f"Channel {params.get('chat_id')}"}}, {}
+        if method == "getChatMember":
+            return 200, {"ok": True, "result": {"status": "administrator", "can_post_messages": True}}, {}
+        return 200, {"ok": True, "result": True}, {}
+
+class FakeCoinGecko(FakeApiServer):
+    """CoinGecko stand-in: /coins/markets, /simple/price and /exchange_rates"""
+
+    def __init__(self, latency=0.0, failure_rate=0.0):
+        super().__init__(latency)
+        self.failure_rate = failure_rate
+        self.market_calls = []  # Request times
+
+    def route(self, path, params):
+        if random.random() < self.failure_rate:
+            return 503, {"error": "service unavailable"}, {}
+        if path.endswith("/coins/markets"):
+            per_page = int(params.get("per_page", 100))
+            page = int(params.get("page", 1))
+            with self.lock:
+                self.market_calls.append(time.monotonic())
+            start = (page - 1) * per_page + 1
+            data = make_crypto_data(start + per_page - 1)[start - 1:]
+            for crypto in data:
+                crypto["current_price"] *= random.uniform(0.99, 1.01)
+            return 200, data, {}
+        if path.endswith("/simple/price"):
+            return 200, {"bitcoin": {"usd": 60000.0, "usd_24h_change": 1.5}}, {}
+        if path.endswith("/exchange_rates"):
+            return 200, {"rates": {
+                "btc": {"name": "Bitcoin", "unit": "BTC", "value": 1.0, "type": "crypto"},
+                "usd": {"name": "US Dollar", "unit": "$", "value": 60000.0, "type": "fiat"},
+                "bdt": {"name": "Bangladeshi Taka", "unit": "৳", "value": 7320000.0, "type": "fiat"},
+                "eur": {"name": "Euro", "unit": "€", "value": 55200.0, "type": "fiat"},
+            }}, {}
+        return 404, {"error": "not found"}, {}
+
+class FakeCoinCap(FakeApiServer):
+    """CoinCap stand-in: /v2/assets, the first fallback market-data provider"""
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.calls = 0
+
+    def route(self, path, params):
+        if not path.endswith("/v2/assets"):
+            return 404, {"error": "not found"}, {}
+        with self.lock:
+            self.calls += 1
+        assets = [{
+            "id": crypto["id"],
+            "rank": str(crypto["market_cap_rank"]),
+            "symbol": crypto["symbol"].upper(),
+            "name": crypto["name"],
+            "priceUsd": str(crypto["current_price"] * random.uniform(0.99, 1.01)),
+            "marketCapUsd": None,
+            "volumeUsd24Hr": None,
+            "changePercent24Hr": str(crypto["price_change_percentage_24h"]),
+        } for crypto in make_crypto_data(int(params.get("limit", 100)))]
+        return 200, {"data": assets}, {}
+
+class FakePriceStream:
+    """WebSocket price-stream stand-in: pushes {coin id: price} ticks like CoinCap's /prices"""
+
+    def __init__(self, coin_count=100, interval=0.25, drop_after=None):
+        self.coin_count = coin_count
+        self.interval = interval
+        self.drop_after = drop_after  # Messages per connection before the server hangs up
+        self.connections = 0
+        self.messages = 0
+        self.closed = False
+        self.sock = socket.create_server(("127.0.0.1", 0))
+        self.url = f"ws://127.0.0.1:{self.sock.getsockname()[1]}/prices?assets=ALL"
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while not self.closed:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn):
+        with conn:
+            request = b""
+            while b"\r\n\r\n" not in request:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    return
+                request += chunk
+            headers = dict(line.split(": ", 1) for line in request.decode("latin-1").split("\r\n")[1:] if ": " in line)
+            accept = base64.b64encode(hashlib.sha1(
+                (headers["Sec-WebSocket-Key"] + bot.WEBSOCKET_GUID).encode("ascii")).digest()).decode("ascii")
+            conn.sendall(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                          f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode("ascii"))
+            self.connections += 1
+            sent = 0
+            while not self.closed and (self.drop_after is None or sent < self.drop_after):
+                prices = {f"coin-{rank}": str(60000.0 / rank * random.uniform(0.99, 1.01))
+                          for rank in range(1, self.coin_count + 1)}
+                payload = json.dumps(prices).encode("utf-8")
+                if len(payload) < 126:
+                    header = bytes([0x81, len(payload)])
+                elif len(payload) < 65536:
+                    header = bytes([0x81, 126]) + len(payload).to_bytes(2, "big")
+                else:
+                    header = bytes([0x81, 127]) + len(payload).to_bytes(8, "big")
+                try:
+                    conn.sendall(header + payload)
+                except OSError:
+                    return
+                sent += 1
+                self.messages += 1
+                time.sleep(self.interval)
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
+
+# ============================================================================
+# End-to-end Benchmark
+# ============================================================================
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def configure_bot(telegram, coingecko, coincap, stream, channel_count, args, workdir):
+    """Point the bot at the stand-ins and reset its module state"""
+    bot.TELEGRAM_API = f"{telegram.url}/botBENCH"
+    bot.COINGECKO_BASE = f"{coingecko.url}/api/v3"
+    bot.COINGECKO_API = f"{bot.COINGECKO_BASE}/simple/price"
+    bot.COINGECKO_TRENDING_API = f"{bot.COINGECKO_BASE}/coins/markets"
+    bot.COINGECKO_EXCHANGE_RATES_API = f"{bot.COINGECKO_BASE}/exchange_rates"
+    bot.COINCAP_API = f"{coincap.url}/v2/assets"
+    bot.MARKET_PROVIDERS = ["coingecko", "coincap"] if args.hedge else ["coingecko"]
+    bot.STREAM_URL = stream.url if stream else None
+    bot.live_prices.clear()
+    for provider in bot.market_providers.values():
+        provider.latencies.clear()
+    bot.STATE_DB_PATH = ":memory:"
+    bot.HISTORY_PATH = os.path.join(workdir, f"history-{channel_count}.bin")
+    if args.webhook:
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        bot.WEBHOOK_URL = f"http://127.0.0.1:{port}/telegram"
+        bot.WEBHOOK_HOST = "127.0.0.1"
+        bot.WEBHOOK_PORT = port
+    else:
+        bot.WEBHOOK_URL = None
+
+    bot.CHANNELS[:] = [f"@bench_channel_{i}" for i in range(channel_count)]
+    # Spread the requested quote currencies over the channels
+    currencies = args.currencies.split(",")
+    bot.channel_settings.clear()
+    for index, channel in enumerate(bot.CHANNELS):
+        if currencies[index % len(currencies)] != "usd":
+            bot.channel_settings[channel] = {"currency": currencies[index % len(currencies)]}
+    bot.fx_table.clear()
+    bot.bot_running = True
+    bot.post_interval = args.interval
+    bot.crypto_count = args.coins
+    bot.last_update_id = 0
+    bot.channel_posts.clear()
+    bot.chat_info_cache.clear()
+    bot.invalidate_replies()
+    bot.market_snapshots.clear()
+    bot.SNAPSHOT_TTL = 0  # Every tick fetches, like a cold cache would
+    bot.TELEGRAM_GLOBAL_RATE = args.global_rate
+    bot.global_send_bucket = bot.TokenBucket(args.global_rate, args.global_rate)
+    bot.WORKER_PROCESSES = args.workers
+    bot._chat_send_buckets.clear()
+    bot.coingecko_breaker = bot.CircuitBreaker("CoinGecko")
+    bot.coincap_breaker = bot.CircuitBreaker("CoinCap")
+    bot.telegram_breaker = bot.CircuitBreaker("Telegram")
+
+async def drive_bot(telegram, coingecko, channel_count, args):
+    """Run the bot until it has posted a few times; inject commands meanwhile"""
+    admin_id = bot.ADMIN_USER_IDS[0] if bot.ADMIN_USER_IDS else 1
+    started = time.monotonic()
+    task = asyncio.create_task(bot.run_bot_async())
+    # Long enough for at least two complete posts at the configured send rate
+    run_time = max(args.duration, 2 * channel_count / args.global_rate + args.interval)
+    deadline = started + run_time
+    try:
+        while time.monotonic() < deadline and not task.done():
+            telegram.inject_command(admin_id, admin_id, "/interval")
+            await asyncio.sleep(1)
+    finally:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+        telegram.release_pollers()
+    return started
+
+def summarize_run(telegram, coingecko, channel_count, started):
+    """Turn the stand-ins' request logs into per-tick latency and throughput"""
+    ticks = list(coingecko.market_calls)
+    sends = sorted(telegram.sends)
+    post_latencies = []
+    throughputs = []
+    first_post = None
+    for index, tick_start in enumerate(ticks):
+        tick_end = ticks[index + 1] if index + 1 < len(ticks) else float("inf")
+        tick_sends = [sent_at for sent_at, _ in sends if tick_start <= sent_at < tick_end]
+        if len(tick_sends) < channel_count:
+            continue  # Incomplete post (run ended mid fan-out or sends failed)
+        post_latencies.append(tick_sends[-1] - tick_start)
+        if len(tick_sends) > 1 and tick_sends[-1] > tick_sends[0]:
+            throughputs.append((len(tick_sends) - 1) / (tick_sends[-1] - tick_sends[0]))
+        if first_post is None:
+            first_post = tick_sends[-1] - started
+
+    commands = telegram.command_latencies
+    return {
+        "channels": channel_count,
+        "posts": len(post_latencies),
+        "first_post": first_post if first_post is not None else float("nan"),
+        "post_p50": percentile(post_latencies, 0.5),
+        "post_p95": percentile(post_latencies, 0.95),
+        "throughput": statistics.mean(throughputs) if throughputs else float("nan"),
+        "cmd_p50": percentile(commands, 0.5) * 1000,
+        "cmd_p95": percentile(commands, 0.95) * 1000,
+        "rate_limited": telegram.rate_limited,
+        "failed": telegram.failed,
+        "polls": telegram.polls,
+    }
+
+def bench_e2e(args):
+    """Drive run_bot against local stand-ins for growing channel counts"""
+    channel_counts = [int(count) for count in args.channels.split(",")]
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for channel_count in channel_counts:
+            telegram = FakeTelegram(args.telegram_latency, args.telegram_429_rate, args.telegram_failure_rate)
+            coingecko = FakeCoinGecko(args.coingecko_latency, args.coingecko_failure_rate)
+            coincap = FakeCoinCap(args.coincap_latency)
+            stream = FakePriceStream(coin_count=max(args.coins, 100)) if args.stream else None
+            configure_bot(telegram, coingecko, coincap, stream, channel_count, args, workdir)
+            bot_output = io.StringIO()
+            with contextlib.redirect_stdout(bot_output):
+                started = asyncio.run(drive_bot(telegram, coingecko, channel_count, args))
+            results.append(summarize_run(telegram, coingecko, channel_count, started))
+            telegram.close()
+            coingecko.close()
+            coincap.close()
+            if stream:
+                stream.close()
+            print(f"[INFO] {channel_count} channel(s) done", file=sys.stderr)
+
+    print(f"{'channels':>8} {'posts':>6} {'first post s':>12} {'post p50 s':>10} {'post p95 s':>10} "
+          f"{'msg/s':>8} {'cmd p50 ms':>10} {'cmd p95 ms':>10} {'429s':>5} {'5xx':>5} {'polls':>6}")
+    for result in results:
+        print(f"{result['channels']:>8} {result['posts']:>6} {result['first_post']:>12.2f} {result['post_p50']:>10.2f} "
+              f"{result['post_p95']:>10.2f} {result['throughput']:>8.1f} {result['cmd_p50']:>10.0f} "
+              f"{result['cmd_p95']:>10.0f} {result['rate_limited']:>5} {result['failed']:>5} {result['polls']:>6}")
+
+# ============================================================================
+# Main Entry Point
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    split_parser = subparsers.add_parser("split", help="message splitter micro-benchmark")
+    split_parser.add_argument("--repeat", type=int, default=200, help="iterations for the smallest case")
+
+    e2e_parser = subparsers.add_parser("e2e", help="end-to-end run against local API stand-ins")
+    e2e_parser.add_argument("--channels", default="1,10,100,1000", help="comma-separated channel counts")
+    e2e_parser.add_argument("--duration", type=float, default=30, help="minimum seconds per channel count")
+    e2e_parser.add_argument("--interval", type=int, default=10, help="bot post_interval in seconds")
+    e2e_parser.add_argument("--coins", type=int, default=25, help="coins per post")
+    e2e_parser.add_argument("--global-rate", type=float, default=bot.TELEGRAM_GLOBAL_RATE,
+                            help="global send limit in messages/s (Telegram allows about 30)")
+    e2e_parser.add_argument("--telegram-latency", type=float, default=0.05, help="seconds per Telegram request")
+    e2e_parser.add_argument("--telegram-429-rate", type=float, default=0.0, help="fraction of sends answered with 429")
+    e2e_parser.add_argument("--telegram-failure-rate", type=float, default=0.0, help="fraction of sends answered with 500")
+    e2e_parser.add_argument("--coingecko-latency", type=float, default=0.3, help="seconds per CoinGecko request")
+    e2e_parser.add_argument("--coingecko-failure-rate", type=float, default=0.0, help="fraction of 503 responses")
+    e2e_parser.add_argument("--hedge", action="store_true", help="use the CoinCap stand-in as hedge/failover provider")
+    e2e_parser.add_argument("--coincap-latency", type=float, default=0.1, help="seconds per CoinCap request")
+    e2e_parser.add_argument("--stream", action="store_true", help="feed live prices from a local WebSocket stand-in")
+    e2e_parser.add_argument("--currencies", default="usd", help="comma-separated quote currencies spread over the channels")
+    e2e_parser.add_argument("--workers", type=int, default=0, help="deliver from this many worker processes")
+    e2e_parser.add_argument("--webhook", action="store_true", help="receive commands through the webhook listener")
+    args = parser.parse_args()
+
+    if args.benchmark == "split":
+        bench_split(args.repeat)
+    elif args.benchmark == "e2e":
+        bench_e2e(args)
+    sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
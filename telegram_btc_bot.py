@@ -1,11 +1,40 @@
+import array
+import asyncio
+import base64
+import bisect
+import collections
+import hashlib
+import heapq
+import hmac
+import itertools
+import json
+import logging
+import math
+import mmap
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import random
+import re
 import requests
+import secrets
+import sqlite3
+import ssl
+import struct
+import threading
 import time
 import sys
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime
+from email.utils import parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import shared_memory
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
 
 # Fix encoding for Windows console
 if sys.platform == 'win32':
-    import os
     os.environ['PYTHONIOENCODING'] = 'utf-8'
     # Don't wrap stdout/stderr to avoid I/O errors
     # The environment variable should be enough
@@ -22,56 +51,953 @@ ADMIN_USER_IDS = [7127437250, 6393419765]  # Admin user IDs
 
 # API endpoints
 TELEGRAM_API = f"https://api.telegram.org/bot{BOT_TOKEN}"
-COINGECKO_API = "https://api.coingecko.com/api/v3/simple/price"
-COINGECKO_TRENDING_API = "https://api.coingecko.com/api/v3/coins/markets"
+COINGECKO_BASE = "https://api.coingecko.com/api/v3"
+COINGECKO_API = f"{COINGECKO_BASE}/simple/price"
+COINGECKO_TRENDING_API = f"{COINGECKO_BASE}/coins/markets"
+COINGECKO_EXCHANGE_RATES_API = f"{COINGECKO_BASE}/exchange_rates"
+COINCAP_API = "https://api.coincap.io/v2/assets"
+COINPAPRIKA_API = "https://api.coinpaprika.com/v1/tickers"
+
+# Market data providers - the first is primary, later ones are hedges and failover
+MARKET_PROVIDERS = ["coingecko", "coincap", "coinpaprika"]
+HEDGE_DEFAULT_DELAY = 2.0  # Hedge delay (seconds) until a provider has enough latency samples
+HEDGE_MIN_DELAY = 0.25  # Never hedge sooner than this, however fast the provider usually is
+PROVIDER_LATENCY_SAMPLES = 200  # Recent fetch latencies kept per provider for its p95
+
+# Streaming ticker - live prices between REST snapshots (CoinCap price stream format)
+STREAM_URL = None  # e.g. "wss://ws.coincap.io/prices?assets=ALL"; None disables streaming
+STREAM_MAX_AGE = 300  # Ticks older than this (seconds) are ignored
+STREAM_IDLE_TIMEOUT = 60  # Reconnect when the stream has been silent this long (seconds)
+STREAM_MAX_MESSAGE = 4 * 1024 * 1024  # Largest WebSocket frame accepted (bytes)
+
+# Price alerts - checked against every snapshot and stream tick
+ALERT_COOLDOWN = 15 * 60  # A fired alert stays quiet this long, even if the price crosses again (seconds)
+ALERT_REARM_MARGIN = 0.01  # The price must move back 1% past the threshold before the alert can fire again
+ALERT_MAX_PER_CHAT = 25
+
+# HTTP client settings - one keep-alive connection pool per upstream host
+HTTP_POOL_SIZES = {
+    "api.telegram.org": 32,  # Channel fan-out runs many sends in parallel
+    "api.coingecko.com": 4,
+}
+HTTP_DEFAULT_POOL_SIZE = 8
+HTTP_TIMEOUTS = {  # Default request timeout per host (seconds)
+    "api.telegram.org": 10,
+    "api.coingecko.com": 20,
+}
+HTTP_DEFAULT_TIMEOUT = 10
+
+# Logging - JSON lines written by a background thread
+LOG_LEVEL = "INFO"  # DEBUG also logs every per-channel send
+LOG_FORMAT = "json"  # "json" or "text"
+LOG_FILE = None  # None writes to stdout
+LOG_FLUSH_INTERVAL = 1.0  # Seconds between flushes of buffered log output
+
+# Metrics endpoint (Prometheus text format) - set METRICS_PORT to enable
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = None  # e.g. 9108 serves http://127.0.0.1:9108/metrics
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # Histogram buckets (seconds)
+
+# Telegram rate limits (messages per second)
+TELEGRAM_GLOBAL_RATE = 30  # Across all chats
+TELEGRAM_CHANNEL_RATE = 20 / 60  # Per channel/group: 20 messages per minute
+TELEGRAM_PRIVATE_CHAT_RATE = 1  # Per private chat
+TELEGRAM_CHAT_BURST = 3  # Messages a single chat may receive back-to-back
+SEND_CONCURRENCY = 16  # Channels delivered to in parallel
+
+# Delivery worker processes - each owns a shard of CHANNELS, this process fetches and renders
+WORKER_PROCESSES = 0  # 0 delivers from this process
+SHARED_SNAPSHOT_SIZE = 16 * 1024 * 1024  # Shared-memory block rendered posts are published in (bytes)
+WORKER_DELIVERY_TIMEOUT = 600  # Longest wait for the workers to deliver one post (seconds)
+
+# Outbox - every channel message is journaled in the state store; failed sends are retried from there
+OUTBOX_MAX_AGE = 600  # Undelivered messages older than this are dropped as stale (seconds)
+OUTBOX_BASE_DELAY = 5  # First retry delay, doubled per attempt unless Telegram's retry_after is longer (seconds)
+OUTBOX_MAX_DELAY = 120
+OUTBOX_POLL_INTERVAL = 1  # How often due outbox rows are looked for (seconds)
 
 # Global variables for bot control
 bot_running = True
 last_update_id = 0
 post_interval = 60  # Default: 60 seconds (1 minute)
 crypto_count = 25  # Default: 25 cryptocurrencies
+btc_post_interval = 0  # Seconds between standalone BTC price posts, 0 = off
+edit_in_place = False  # Edit one message per channel instead of posting a new one each tick
+channel_posts = {}  # channel -> {"message_ids": [...], "fingerprints": [...]} of the edited post
+channel_settings = {}  # channel -> overrides of {"coins", "interval", "template", "currency"}; missing keys use the globals
 last_successful_price = None  # Cache last successful price
 last_successful_change = None
 api_fail_count = 0  # Track consecutive API failures
 MAX_API_RETRIES = 3  # Maximum retries for API calls
+TELEGRAM_SEND_RETRIES = 2  # Maximum retries for a single Telegram send
+RETRY_BASE_DELAY = 1  # First back-off delay (seconds), doubled on each retry
+RETRY_MAX_DELAY = 30  # Longest back-off or Retry-After we are willing to wait
+BREAKER_FAILURE_THRESHOLD = 5  # Consecutive failures before a circuit opens
+BREAKER_RESET_TIMEOUT = 60  # Seconds an open circuit waits before probing again
+SNAPSHOT_TTL = 30  # Market snapshots younger than this are served as fresh (seconds)
+SNAPSHOT_STALE_TTL = 600  # Older snapshots are served while a background refresh runs
+MAX_COIN_COUNT = 1000  # Largest top-N list a channel may post
+MARKETS_PAGE_SIZE = 250  # CoinGecko's per_page maximum; longer lists are fetched page by page
+MARKETS_FETCH_CONCURRENCY = 4  # Pages fetched in parallel
+FX_TTL = 6 * 3600  # Exchange-rate table refresh interval; other currencies are converted from USD locally
+FX_RETRY_BASE_DELAY = 30  # Wait after a failed exchange-rate fetch, doubled per consecutive failure (seconds)
+FX_RETRY_MAX_DELAY = 1800
+CHAT_INFO_TTL = 3600  # getMe/getChat answers younger than this are served from the cache (seconds)
+CHAT_INFO_STALE_TTL = 7 * 86400  # Older answers are served while a background refresh runs
+CHAT_CHECK_CONCURRENCY = 16  # getChat lookups in flight at once (startup check and refreshes)
+outbound_queue = None  # asyncio.Queue of (deliveries, edit, kind, future) tuples, created by run_bot_async
+command_queue = None  # asyncio.Queue of Telegram updates waiting for the command worker
+COMMAND_CONCURRENCY = 8  # Commands handled at once; each chat's commands still run one after another
+POLL_TIMEOUT = 25  # getUpdates long-poll timeout (seconds)
+WEBHOOK_URL = None  # Public HTTPS URL Telegram pushes updates to, e.g. "https://bot.example.com/telegram"; None polls
+WEBHOOK_HOST = "0.0.0.0"  # Address the built-in webhook listener binds to (usually behind a TLS proxy)
+WEBHOOK_PORT = 8443
+WEBHOOK_SECRET = None  # X-Telegram-Bot-Api-Secret-Token value; None generates a fresh one on every start
+WEBHOOK_MAX_BODY = 1024 * 1024  # Largest update body accepted (bytes)
+STATE_DB_PATH = "bot_state.db"  # SQLite file holding settings, update offset and caches
+HISTORY_PATH = "price_history.bin"  # Memory-mapped per-minute price history
+HISTORY_MINUTES = 14 * 24 * 60  # Ring size per coin: two weeks of per-minute samples
+HISTORY_MAX_COINS = 100  # Coins tracked in the history file (~8 MB in total)
+
+# ============================================================================
+# Logging
+# ============================================================================
+
+logger = logging.getLogger("btc_price_bot")
+logger.propagate = False
+_log_queue = None  # queue.SimpleQueue feeding the writer thread
+_log_writer_thread = None
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line: time, level, message and the record's fields"""
+    
+    def format(self, record):
+        entry = {
+            "time": f"{self.formatTime(record, '%Y-%m-%dT%H:%M:%S')}.{int(record.msecs):03d}",
+            "level": record.levelname.lower(),
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextLogFormatter(logging.Formatter):
+    """Human-readable lines: time [LEVEL] message key=value ..."""
+    
+    def format(self, record):
+        line = f"{self.formatTime(record, '%Y-%m-%d %H:%M:%S')} [{record.levelname}] {record.getMessage()}"
+        fields = getattr(record, "fields", {})
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+class BufferedStreamHandler(logging.StreamHandler):
+    """StreamHandler that flushes on warnings or every LOG_FLUSH_INTERVAL, not per record"""
+    
+    def __init__(self, stream, flush_interval=LOG_FLUSH_INTERVAL):
+        super().__init__(stream)
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+    
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+            if record.levelno >= logging.WARNING or time.monotonic() - self.last_flush >= self.flush_interval:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+    
+    def flush(self):
+        super().flush()
+        self.last_flush = time.monotonic()
+
+class QueueLogHandler(logging.Handler):
+    """Hands records to the writer thread; callers never touch the stream"""
+    
+    def __init__(self, record_queue):
+        super().__init__()
+        self.record_queue = record_queue
+    
+    def emit(self, record):
+        self.record_queue.put(record)
+
+def _write_logs(record_queue, handler):
+    """Writer thread: format and write queued records, flushing when idle"""
+    while True:
+        try:
+            record = record_queue.get(timeout=handler.flush_interval)
+        except queue.Empty:
+            handler.flush()
+            continue
+        if record is None:
+            break
+        handler.handle(record)
+    handler.flush()
+
+def setup_logging():
+    """Route log records through a queue to a buffered writer thread"""
+    global _log_queue, _log_writer_thread
+    if _log_writer_thread is not None:
+        return
+    
+    if LOG_FILE:
+        stream = open(LOG_FILE, "a", encoding="utf-8", buffering=65536)
+    else:
+        stream = sys.stdout
+    handler = BufferedStreamHandler(stream, LOG_FLUSH_INTERVAL)
+    handler.setFormatter(JsonLogFormatter() if LOG_FORMAT == "json" else TextLogFormatter())
+    
+    _log_queue = queue.SimpleQueue()
+    logger.handlers[:] = [QueueLogHandler(_log_queue)]
+    logger.setLevel(LOG_LEVEL)
+    _log_writer_thread = threading.Thread(target=_write_logs, args=(_log_queue, handler), name="log-writer", daemon=True)
+    _log_writer_thread.start()
+
+def shutdown_logging():
+    """Write out everything still queued and stop the writer thread"""
+    global _log_queue, _log_writer_thread
+    if _log_writer_thread is None:
+        return
+    _log_queue.put(None)
+    _log_writer_thread.join(timeout=5)
+    logger.handlers[:] = []
+    _log_queue = None
+    _log_writer_thread = None
+
+def log_debug(message, **fields):
+    logger.debug(message, extra={"fields": fields})
+
+def log_info(message, **fields):
+    logger.info(message, extra={"fields": fields})
+
+def log_warning(message, **fields):
+    logger.warning(message, extra={"fields": fields})
+
+def log_error(message, **fields):
+    logger.error(message, extra={"fields": fields})
+
+# ============================================================================
+# Metrics
+# ============================================================================
+
+METRIC_HELP = {
+    "bot_upstream_request_duration_seconds": ("histogram", "Latency of Telegram and CoinGecko requests"),
+    "bot_upstream_request_errors_total": ("counter", "Upstream requests that failed or returned 5xx"),
+    "bot_upstream_retries_total": ("counter", "Retries scheduled by the retry engine"),
+    "bot_upstream_failures_total": ("counter", "Calls that failed after all retries"),
+    "bot_circuit_breaker_open": ("gauge", "1 while the upstream circuit breaker is open"),
+    "bot_channel_sends_total": ("counter", "Channel deliveries by result"),
+    "bot_posts_total": ("counter", "Scheduled posts by job and result"),
+    "bot_post_schedule_lag_seconds": ("histogram", "How late a scheduled post started after its boundary"),
+    "bot_getupdates_round_trip_seconds": ("histogram", "getUpdates round-trip time (includes long-poll wait)"),
+    "bot_webhook_requests_total": ("counter", "Webhook requests by result"),
+    "bot_market_requests_total": ("counter", "Market data requests by provider and reason (primary, hedge, failover)"),
+    "bot_market_wins_total": ("counter", "Market data requests answered first, by provider"),
+    "bot_price_stream_reconnects_total": ("counter", "Price stream reconnect attempts"),
+    "bot_outbox_total": ("counter", "Outbox rows by outcome (retry, retried, expired, superseded, rejected)"),
+    "bot_alerts_fired_total": ("counter", "Price alert triggers by result (sent, suppressed by cooldown)"),
+    "bot_command_duration_seconds": ("histogram", "Time spent handling a command, by command"),
+}
+
+class Histogram:
+    """Cumulative-bucket latency histogram"""
+    
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.total += value
+        self.count += 1
+
+_metrics_lock = threading.Lock()
+metric_values = {}  # (name, labels) -> number or Histogram; labels is a tuple of (key, value)
+
+def inc_counter(name, labels=(), amount=1):
+    """Add to a counter"""
+    with _metrics_lock:
+        metric_values[(name, labels)] = metric_values.get((name, labels), 0) + amount
+
+def set_gauge(name, labels=(), value=0):
+    """Set a gauge"""
+    with _metrics_lock:
+        metric_values[(name, labels)] = value
+
+def observe_histogram(name, labels=(), value=0.0):
+    """Record one observation in a histogram"""
+    with _metrics_lock:
+        histogram = metric_values.get((name, labels))
+        if histogram is None:
+            histogram = metric_values[(name, labels)] = Histogram()
+        histogram.observe(value)
+
+def format_labels(labels, extra=()):
+    """Render labels as {key="value",...} with Prometheus escaping"""
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    rendered = []
+    for key, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        rendered.append(f'{key}="{value}"')
+    return "{" + ",".join(rendered) + "}"
+
+def render_metrics():
+    """Render all metrics in the Prometheus text exposition format"""
+    with _metrics_lock:
+        items = sorted(metric_values.items(), key=lambda item: item[0])
+        lines = []
+        current_name = None
+        for (name, labels), value in items:
+            if name != current_name:
+                metric_type, help_text = METRIC_HELP.get(name, ("untyped", name))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                current_name = name
+            if isinstance(value, Histogram):
+                cumulative = 0
+                for bound, count in zip(value.buckets, value.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels, (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_bucket{format_labels(labels, (('le', '+Inf'),))} {value.count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {value.total}")
+                lines.append(f"{name}_count{format_labels(labels)} {value.count}")
+            else:
+                lines.append(f"{name}{format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves GET /metrics"""
+    
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(host=None, port=None):
+    """Serve /metrics from a background thread; returns the server or None"""
+    host = host or METRICS_HOST
+    port = port or METRICS_PORT
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        log_error("Cannot start metrics endpoint", host=host, port=port, error=str(e))
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    log_info("Metrics endpoint started", url=f"http://{host}:{server.server_port}/metrics")
+    return server
+
+# ============================================================================
+# HTTP Client
+# ============================================================================
+
+_http_sessions = {}  # host -> requests.Session with its own connection pool
+_http_lock = threading.Lock()
+http_stats = {}  # (upstream, endpoint) -> latency counters
+
+def get_http_session(host):
+    """Get (or create) the pooled keep-alive session for a host"""
+    session = _http_sessions.get(host)
+    if session is None:
+        with _http_lock:
+            session = _http_sessions.get(host)
+            if session is None:
+                pool_size = HTTP_POOL_SIZES.get(host, HTTP_DEFAULT_POOL_SIZE)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _http_sessions[host] = session
+    return session
+
+def get_http_endpoint(url):
+    """Return the (upstream, endpoint) label used for latency counters"""
+    if url.startswith(TELEGRAM_API + "/"):
+        # Never expose the bot token in counters
+        return "telegram", url[len(TELEGRAM_API) + 1:]
+    if url.startswith(COINGECKO_BASE + "/"):
+        return "coingecko", url[len(COINGECKO_BASE) + 1:]
+    parts = urlsplit(url)
+    return parts.netloc, parts.path
+
+def record_http_latency(endpoint, elapsed, failed):
+    """Update latency counters for an endpoint"""
+    with _http_lock:
+        stats = http_stats.get(endpoint)
+        if stats is None:
+            stats = {"count": 0, "errors": 0, "total_time": 0.0, "max_time": 0.0}
+            http_stats[endpoint] = stats
+        stats["count"] += 1
+        if failed:
+            stats["errors"] += 1
+        stats["total_time"] += elapsed
+        stats["max_time"] = max(stats["max_time"], elapsed)
+    
+    labels = (("upstream", endpoint[0]), ("endpoint", endpoint[1]))
+    observe_histogram("bot_upstream_request_duration_seconds", labels, elapsed)
+    if failed:
+        inc_counter("bot_upstream_request_errors_total", labels)
+
+def http_request(method, url, timeout=None, **kwargs):
+    """Send an HTTP request through the pooled session of the target host"""
+    host = urlsplit(url).netloc
+    if timeout is None:
+        timeout = HTTP_TIMEOUTS.get(host, HTTP_DEFAULT_TIMEOUT)
+    endpoint = get_http_endpoint(url)
+    started = time.monotonic()
+    failed = True
+    try:
+        response = get_http_session(host).request(method, url, timeout=timeout, **kwargs)
+        failed = response.status_code >= 500
+        return response
+    finally:
+        record_http_latency(endpoint, time.monotonic() - started, failed)
+
+def http_get(url, **kwargs):
+    """GET through the shared HTTP client"""
+    return http_request("GET", url, **kwargs)
+
+def http_post(url, **kwargs):
+    """POST through the shared HTTP client"""
+    return http_request("POST", url, **kwargs)
+
+def format_http_stats():
+    """Format per-endpoint latency counters for /status"""
+    with _http_lock:
+        items = sorted(http_stats.items())
+        snapshot = [(endpoint, dict(stats)) for endpoint, stats in items]
+    
+    lines = []
+    for (upstream, endpoint), stats in snapshot:
+        avg_ms = stats["total_time"] / stats["count"] * 1000 if stats["count"] else 0
+        lines.append(f"{upstream}/{endpoint}: {stats['count']} calls, avg {avg_ms:.0f} ms, max {stats['max_time'] * 1000:.0f} ms, {stats['errors']} errors")
+    return "\n".join(lines)
+
+# ============================================================================
+# Retries & Circuit Breakers
+# ============================================================================
+
+class RetryableError(Exception):
+    """A failed upstream call that may succeed if retried"""
+    
+    def __init__(self, message, retry_after=None, rate_limited=False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.rate_limited = rate_limited
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open"""
+
+class CircuitBreaker:
+    """Stops calling an upstream after repeated failures and probes it again later"""
+    
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+    
+    def allow(self):
+        """Return True if a call may go through right now"""
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Let exactly one probe through
+                self.state = "half-open"
+                set_gauge("bot_circuit_breaker_open", (("upstream", self.name),), 0)
+                return True
+            return False
+    
+    def record_success(self):
+        with self.lock:
+            if self.state != "closed":
+                set_gauge("bot_circuit_breaker_open", (("upstream", self.name),), 0)
+            self.state = "closed"
+            self.failures = 0
+    
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == "half-open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    log_warning("Circuit opened", upstream=self.name, failures=self.failures)
+                    set_gauge("bot_circuit_breaker_open", (("upstream", self.name),), 1)
+                self.state = "open"
+                self.opened_at = time.monotonic()
+    
+    def describe(self):
+        """Human-readable state for /status"""
+        with self.lock:
+            if self.state == "open":
+                remaining = max(0, self.reset_timeout - (time.monotonic() - self.opened_at))
+                return f"open (probing in {remaining:.0f}s)"
+            if self.state == "closed" and self.failures:
+                return f"closed ({self.failures} recent failure(s))"
+            return self.state
+
+coingecko_breaker = CircuitBreaker("CoinGecko")
+coincap_breaker = CircuitBreaker("CoinCap")
+coinpaprika_breaker = CircuitBreaker("CoinPaprika")
+telegram_breaker = CircuitBreaker("Telegram")
+
+def get_retry_after(response):
+    """Read the server's requested delay from Retry-After or Telegram's parameters.retry_after"""
+    try:
+        retry_after = response.json().get("parameters", {}).get("retry_after")
+        if retry_after is not None:
+            return float(retry_after)
+    except Exception:
+        pass
+    
+    header = response.headers.get("Retry-After")
+    if not header:
+        return None
+    try:
+        return max(0.0, float(header))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(header).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def raise_for_retryable_status(response):
+    """Raise RetryableError for rate limiting (429) and server errors (5xx)"""
+    if response.status_code == 429 or response.status_code >= 500:
+        raise RetryableError(f"HTTP {response.status_code}", retry_after=get_retry_after(response),
+                             rate_limited=response.status_code == 429)
+
+def call_with_retry(func, breaker, max_retries=MAX_API_RETRIES, description="API call"):
+    """Call func() with exponential back-off and full jitter behind a circuit breaker"""
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            raise CircuitOpenError(f"{breaker.name} circuit is open")
+        
+        try:
+            result = func()
+        except (RetryableError, requests.exceptions.RequestException) as e:
+            retry_after = getattr(e, "retry_after", None)
+            if not getattr(e, "rate_limited", False):
+                # Being rate limited is not a sign the upstream is down
+                breaker.record_failure()
+            
+            if attempt >= max_retries:
+                inc_counter("bot_upstream_failures_total", (("upstream", breaker.name),))
+                raise
+            if retry_after is not None and retry_after > RETRY_MAX_DELAY:
+                log_warning("Retry-After too long, giving up", call=description, retry_after=retry_after)
+                inc_counter("bot_upstream_failures_total", (("upstream", breaker.name),))
+                raise
+            inc_counter("bot_upstream_retries_total", (("upstream", breaker.name),))
+            
+            if retry_after is not None:
+                delay = retry_after
+            else:
+                delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+            log_warning("Call failed, retrying", call=description, error=f"{type(e).__name__}: {e}",
+                        attempt=attempt + 1, max_attempts=max_retries + 1, delay=round(delay, 2))
+            time.sleep(delay)
+            attempt += 1
+            continue
+        except Exception:
+            # The upstream answered, the call just cannot succeed - don't retry
+            breaker.record_success()
+            raise
+        
+        breaker.record_success()
+        return result
+
+# ============================================================================
+# Send Rate Limiting
+# ============================================================================
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter"""
+    
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def reserve(self):
+        """Take one token and return how long to wait before it may be used"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Tokens may go negative: later callers queue up behind earlier ones
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+    
+    def acquire(self):
+        """Block until a token is available"""
+        wait_time = self.reserve()
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+global_send_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+_chat_send_buckets = {}  # chat_id -> TokenBucket
+_chat_buckets_lock = threading.Lock()
+_send_executor = ThreadPoolExecutor(max_workers=SEND_CONCURRENCY, thread_name_prefix="send")
+
+def wait_for_send_slot(chat_id):
+    """Block until a message may be sent to chat_id without hitting Telegram's limits"""
+    with _chat_buckets_lock:
+        bucket = _chat_send_buckets.get(chat_id)
+        if bucket is None:
+            # Positive numeric IDs are private chats, everything else is a channel/group
+            is_private = isinstance(chat_id, int) and chat_id > 0
+            rate = TELEGRAM_PRIVATE_CHAT_RATE if is_private else TELEGRAM_CHANNEL_RATE
+            bucket = TokenBucket(rate, TELEGRAM_CHAT_BURST)
+            _chat_send_buckets[chat_id] = bucket
+    bucket.acquire()
+    global_send_bucket.acquire()
+
+# ============================================================================
+# Persistent State
+# ============================================================================
+
+_state_db = None  # sqlite3 connection, opened by open_state_db
+_state_lock = threading.Lock()
+
+def open_state_db(path=STATE_DB_PATH):
+    """Open (and create if needed) the SQLite state store"""
+    global _state_db
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS pending_updates (update_id INTEGER PRIMARY KEY, payload TEXT NOT NULL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS price_alerts (alert_id INTEGER PRIMARY KEY, payload TEXT NOT NULL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS outbox_messages (id INTEGER PRIMARY KEY, payload TEXT NOT NULL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY, channel TEXT NOT NULL, "
+                 "message_id INTEGER NOT NULL, kind TEXT, parts_sent INTEGER NOT NULL DEFAULT 0, "
+                 "attempts INTEGER NOT NULL DEFAULT 0, next_attempt REAL NOT NULL, expires_at REAL NOT NULL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS outbox_channel ON outbox (channel, kind)")
+    conn.execute("CREATE INDEX IF NOT EXISTS outbox_message ON outbox (message_id)")
+    # Rendered messages left behind by earlier versions, which only removed them on expiry
+    conn.execute("DELETE FROM outbox_messages WHERE id NOT IN (SELECT message_id FROM outbox)")
+    conn.execute("CREATE TABLE IF NOT EXISTS chat_info (key TEXT PRIMARY KEY, payload TEXT NOT NULL, saved_at REAL NOT NULL)")
+    _state_db = conn
+    return conn
+
+def save_settings(values):
+    """Write several settings in one transaction (no-op when no store is open)"""
+    if _state_db is None:
+        return
+    rows = [(key, json.dumps(value)) for key, value in values.items()]
+    with _state_lock:
+        try:
+            with _state_db:
+                _state_db.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", rows)
+        except sqlite3.Error as e:
+            log_error("Error saving bot state", error=str(e))
+
+def load_settings():
+    """Read all saved settings"""
+    if _state_db is None:
+        return {}
+    with _state_lock:
+        rows = _state_db.execute("SELECT key, value FROM settings").fetchall()
+    return {key: json.loads(value) for key, value in rows}
+
+def save_bot_settings():
+    """Persist the admin-controlled settings"""
+    save_settings({
+        "channels": CHANNELS,
+        "post_interval": post_interval,
+        "crypto_count": crypto_count,
+        "btc_post_interval": btc_post_interval,
+        "bot_running": bot_running,
+        "edit_in_place": edit_in_place,
+        "channel_settings": channel_settings,
+    })
+    invalidate_replies()
+
+_channel_posts_lock = threading.Lock()  # Send threads add and drop channel_posts entries while it is saved
+
+def save_channel_posts():
+    """Persist the message IDs used by edit-in-place mode"""
+    with _channel_posts_lock:
+        posts = {channel: {key: list(values) for key, values in post.items()} for channel, post in channel_posts.items()}
+    save_settings({"channel_posts": posts})
+
+def save_market_snapshot(key, data, fetched_at):
+    """Persist a market snapshot so a restart starts with a warm cache"""
+    save_settings({
+        "market_snapshot": {
+            "vs_currency": key[0],
+            "limit": key[1],
+            "data": data,
+            "saved_at": time.time() - (time.monotonic() - fetched_at),
+        },
+        "last_successful_price": [last_successful_price, last_successful_change],
+    })
+
+def save_fx_table(rates, fetched_at):
+    """Persist the exchange-rate table so a restart does not refetch it"""
+    save_settings({"fx_table": {"rates": rates, "saved_at": time.time() - (time.monotonic() - fetched_at)}})
+
+def save_price_alerts(alerts):
+    """Persist new or changed price alerts"""
+    if _state_db is None or not alerts:
+        return
+    rows = [(alert["id"], json.dumps(alert)) for alert in alerts]
+    with _state_lock:
+        try:
+            with _state_db:
+                _state_db.executemany("INSERT OR REPLACE INTO price_alerts (alert_id, payload) VALUES (?, ?)", rows)
+        except sqlite3.Error as e:
+            log_error("Error saving price alerts", error=str(e))
+
+def delete_price_alerts(alert_ids):
+    """Drop deleted price alerts from the store"""
+    if _state_db is None or not alert_ids:
+        return
+    with _state_lock:
+        try:
+            with _state_db:
+                _state_db.executemany("DELETE FROM price_alerts WHERE alert_id = ?", [(alert_id,) for alert_id in alert_ids])
+        except sqlite3.Error as e:
+            log_error("Error saving price alerts", error=str(e))
+
+def load_price_alerts():
+    """All saved price alerts"""
+    if _state_db is None:
+        return []
+    with _state_lock:
+        rows = _state_db.execute("SELECT payload FROM price_alerts ORDER BY alert_id").fetchall()
+    return [json.loads(payload) for (payload,) in rows]
+
+def save_chat_info(key, result, fetched_at):
+    """Persist a cached getMe/getChat answer"""
+    if _state_db is None:
+        return
+    with _state_lock:
+        try:
+            _state_db.execute("INSERT OR REPLACE INTO chat_info (key, payload, saved_at) VALUES (?, ?, ?)",
+                              (key, json.dumps(result), time.time() - (time.monotonic() - fetched_at)))
+        except sqlite3.Error as e:
+            log_error("Error saving chat info", error=str(e))
+
+def delete_chat_info(key):
+    if _state_db is None:
+        return
+    with _state_lock:
+        try:
+            _state_db.execute("DELETE FROM chat_info WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            log_error("Error saving chat info", error=str(e))
+
+def load_chat_info():
+    """Saved getMe/getChat answers as (key, result, saved_at) rows"""
+    if _state_db is None:
+        return []
+    with _state_lock:
+        rows = _state_db.execute("SELECT key, payload, saved_at FROM chat_info").fetchall()
+    return [(key, json.loads(payload), saved_at) for key, payload, saved_at in rows]
+
+def load_bot_state():
+    """Restore settings, update offset and caches; return True if an offset was restored"""
+    global post_interval, crypto_count, btc_post_interval, bot_running, last_update_id, edit_in_place
+    global last_successful_price, last_successful_change
+    
+    settings = load_settings()
+    if "channels" in settings:
+        CHANNELS[:] = settings["channels"]
+    post_interval = settings.get("post_interval", post_interval)
+    crypto_count = settings.get("crypto_count", crypto_count)
+    btc_post_interval = settings.get("btc_post_interval", btc_post_interval)
+    bot_running = settings.get("bot_running", bot_running)
+    edit_in_place = settings.get("edit_in_place", edit_in_place)
+    channel_posts.update(settings.get("channel_posts", {}))
+    channel_settings.update(settings.get("channel_settings", {}))
+    if "last_successful_price" in settings:
+        last_successful_price, last_successful_change = settings["last_successful_price"]
+    invalidate_replies()
+    
+    snapshot = settings.get("market_snapshot")
+    if snapshot:
+        age = max(0.0, time.time() - snapshot["saved_at"])
+        with _snapshot_lock:
+            market_snapshots[(snapshot["vs_currency"], snapshot["limit"])] = {
+                "data": snapshot["data"],
+                "fetched_at": time.monotonic() - age,
+            }
+    
+    saved_fx = settings.get("fx_table")
+    if saved_fx:
+        age = max(0.0, time.time() - saved_fx["saved_at"])
+        with _fx_lock:
+            fx_table.update({"rates": saved_fx["rates"], "fetched_at": time.monotonic() - age})
+    
+    restore_price_alerts(load_price_alerts())
+    
+    with _chat_info_lock:
+        for key, result, saved_at in load_chat_info():
+            chat_info_cache[key] = {"result": result, "fetched_at": time.monotonic() - max(0.0, time.time() - saved_at)}
+    
+    if "last_update_id" in settings:
+        last_update_id = settings["last_update_id"]
+        return True
+    return False
+
+def record_updates(updates):
+    """Journal received updates and the new offset before they are handled"""
+    if _state_db is None or not updates:
+        return
+    rows = [(update["update_id"], json.dumps(update)) for update in updates]
+    with _state_lock:
+        try:
+            with _state_db:
+                _state_db.executemany("INSERT OR REPLACE INTO pending_updates (update_id, payload) VALUES (?, ?)", rows)
+                _state_db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('last_update_id', ?)",
+                                  (json.dumps(last_update_id),))
+        except sqlite3.Error as e:
+            log_error("Error saving updates", error=str(e))
+
+def mark_update_handled(update):
+    """Drop a handled update from the journal"""
+    if _state_db is None or "update_id" not in update:
+        return
+    with _state_lock:
+        try:
+            _state_db.execute("DELETE FROM pending_updates WHERE update_id = ?", (update["update_id"],))
+        except sqlite3.Error as e:
+            log_error("Error saving update state", error=str(e))
+
+def load_pending_updates():
+    """Updates that were received but not handled before the last shutdown"""
+    if _state_db is None:
+        return []
+    with _state_lock:
+        rows = _state_db.execute("SELECT payload FROM pending_updates ORDER BY update_id").fetchall()
+    return [json.loads(payload) for (payload,) in rows]
 
 # ============================================================================
 # Bot Status & Info Functions
 # ============================================================================
 
+chat_info_cache = {}  # "getMe" or "getChat:<chat id>" -> {"result": {...}, "fetched_at": monotonic time}
+_chat_info_lock = threading.Lock()
+_chat_info_refreshes = set()  # Keys with a background refresh in flight
+_chat_info_executor = ThreadPoolExecutor(max_workers=CHAT_CHECK_CONCURRENCY, thread_name_prefix="chat-info")
+
+def refresh_telegram_lookup(key, fetch):
+    """Run fetch() -> (result, error) and cache a successful result; a refusal evicts the entry"""
+    result, error = fetch()
+    if result is not None:
+        fetched_at = time.monotonic()
+        with _chat_info_lock:
+            chat_info_cache[key] = {"result": result, "fetched_at": fetched_at}
+        save_chat_info(key, result, fetched_at)
+    else:
+        with _chat_info_lock:
+            evicted = chat_info_cache.pop(key, None)
+        if evicted:
+            delete_chat_info(key)
+    return result, error
+
+def refresh_telegram_lookup_in_background(key, fetch):
+    with _chat_info_lock:
+        if key in _chat_info_refreshes:
+            return
+        _chat_info_refreshes.add(key)
+    
+    def refresh():
+        try:
+            refresh_telegram_lookup(key, fetch)
+        except Exception as e:
+            log_warning("Background chat info refresh failed", key=key, error=str(e))
+        finally:
+            with _chat_info_lock:
+                _chat_info_refreshes.discard(key)
+    
+    _chat_info_executor.submit(refresh)
+
+def cached_telegram_lookup(key, fetch):
+    """fetch() -> (result, error description) through the chat info cache (TTL + stale-while-revalidate)
+    
+    Only successful answers are cached; transport errors propagate.
+    """
+    with _chat_info_lock:
+        entry = chat_info_cache.get(key)
+    if entry:
+        age = time.monotonic() - entry["fetched_at"]
+        if age < CHAT_INFO_TTL:
+            return entry["result"], None
+        if age < CHAT_INFO_STALE_TTL:
+            refresh_telegram_lookup_in_background(key, fetch)
+            return entry["result"], None
+    return refresh_telegram_lookup(key, fetch)
+
+def fetch_bot_info():
+    result = http_get(f"{TELEGRAM_API}/getMe").json()
+    if result.get("ok"):
+        return result["result"], None
+    return None, result.get("description", "Unknown error")
+
+def fetch_chat(chat_id):
+    result = http_post(f"{TELEGRAM_API}/getChat", json={"chat_id": chat_id}).json()
+    if result.get("ok"):
+        return result["result"], None
+    return None, result.get("description", "Unknown error")
+
+def get_chat(chat_id):
+    """Cached getChat: (chat, None) or (None, Telegram's error description); raises on transport errors"""
+    return cached_telegram_lookup(f"getChat:{chat_id}", lambda: fetch_chat(chat_id))
+
 def get_bot_info():
-    """Get bot information"""
+    """Get bot information (cached)"""
     try:
-        url = f"{TELEGRAM_API}/getMe"
-        response = requests.get(url, timeout=10)
-        bot_info = response.json()
-        if bot_info.get("ok"):
-            return bot_info["result"]
-        return None
+        return cached_telegram_lookup("getMe", fetch_bot_info)[0]
     except Exception as e:
-        print(f"[ERROR] Error getting bot info: {e}")
+        log_error("Error getting bot info", error=str(e))
         return None
 
 def get_channel_info(channel=None):
-    """Get channel information"""
-    import telegram_btc_bot as bot_module
+    """Get channel information (cached)"""
     if not channel:
-        channels = bot_module.CHANNELS
+        channels = CHANNELS
         if channels:
             channel = channels[0]  # Get first channel
         else:
             return None
     
     try:
-        url = f"{TELEGRAM_API}/getChat"
-        payload = {"chat_id": channel}
-        response = requests.post(url, json=payload, timeout=10)
-        result = response.json()
-        if result.get("ok"):
-            return result["result"]
-        return None
+        return get_chat(channel)[0]
     except Exception as e:
-        print(f"[ERROR] Error getting channel info: {e}")
+        log_error("Error getting channel info", channel=channel, error=str(e))
         return None
 
 def get_bot_member_status(channel=None):
@@ -92,278 +1018,1366 @@ def get_bot_member_status(channel=None):
             "chat_id": channel,
             "user_id": bot_info["id"]
         }
-        response = requests.post(url, json=payload, timeout=10)
+        response = http_post(url, json=payload)
         member_info = response.json()
         if member_info.get("ok"):
             return member_info["result"]
         return None
     except Exception as e:
-        print(f"[ERROR] Error getting member status: {e}")
+        log_error("Error getting member status", channel=channel, error=str(e))
         return None
 
 # ============================================================================
 # BTC Price Bot Functions
 # ============================================================================
 
-def get_top_crypto_prices(limit=25, retry_count=0):
-    """Fetch top cryptocurrency prices from CoinGecko API"""
-    global api_fail_count
+market_pages = {}  # (vs_currency, page) -> {"data": [...], "fetched_at": monotonic time} of multi-page fetches
+_market_pages_lock = threading.Lock()
+_markets_executor = ThreadPoolExecutor(max_workers=MARKETS_FETCH_CONCURRENCY, thread_name_prefix="markets")
+
+def fetch_markets_page(page, per_page, vs_currency):
+    """Fetch one /coins/markets page (raises when it cannot be fetched)"""
+    params = {
+        "vs_currency": vs_currency,
+        "order": "market_cap_desc",
+        "per_page": per_page,
+        "page": page,
+        "sparkline": False,
+        "price_change_percentage": "24h"
+    }
     
-    try:
-        params = {
-            "vs_currency": "usd",
-            "order": "market_cap_desc",
-            "per_page": limit,
-            "page": 1,
-            "sparkline": False,
-            "price_change_percentage": "24h"
-        }
-        response = requests.get(COINGECKO_TRENDING_API, params=params, timeout=20)
+    def fetch():
+        response = http_get(COINGECKO_TRENDING_API, params=params)
+        raise_for_retryable_status(response)
         data = response.json()
-        
-        if isinstance(data, list) and len(data) > 0:
-            api_fail_count = 0
+        if isinstance(data, list) and (data or page > 1):
             return data
+        raise RetryableError("empty markets response")
+    
+    return call_with_retry(fetch, coingecko_breaker, description=f"CoinGecko markets page {page}")
+
+def get_top_crypto_prices(limit=25, vs_currency="usd"):
+    """Fetch top cryptocurrency prices from CoinGecko API
+    
+    Lists longer than one page are fetched page by page in parallel. A page
+    that fails is replaced by its cached copy; without one the list is cut
+    short there rather than dropped.
+    """
+    global api_fail_count
+    
+    if limit <= MARKETS_PAGE_SIZE:
+        pages = [(1, limit)]
+    else:
+        pages = [(page, MARKETS_PAGE_SIZE) for page in range(1, math.ceil(limit / MARKETS_PAGE_SIZE) + 1)]
+    futures = [_markets_executor.submit(fetch_markets_page, page, per_page, vs_currency) for page, per_page in pages]
+    
+    merged = []
+    failed = False
+    for (page, per_page), future in zip(pages, futures):
+        data = None
+        try:
+            data = future.result()
+            if len(pages) > 1:
+                with _market_pages_lock:
+                    market_pages[(vs_currency, page)] = {"data": data, "fetched_at": time.monotonic()}
+        except CircuitOpenError as e:
+            log_warning("Circuit open, skipping crypto price fetch", error=str(e), page=page)
+        except (RetryableError, requests.exceptions.RequestException) as e:
+            failed = True
+            log_warning("API request error", error=f"{type(e).__name__}: {e}", page=page)
+        except Exception as e:
+            failed = True
+            log_error("Unexpected error fetching crypto prices", error=f"{type(e).__name__}: {e}", page=page)
         
-        if retry_count < MAX_API_RETRIES:
-            time.sleep(2)
-            return get_top_crypto_prices(limit, retry_count + 1)
-        
-        return None
-        
-    except requests.exceptions.Timeout:
-        api_fail_count += 1
-        print(f"[WARNING] API timeout (attempt {retry_count + 1}/{MAX_API_RETRIES})")
-        
-        if retry_count < MAX_API_RETRIES:
-            wait_time = (retry_count + 1) * 2
-            time.sleep(wait_time)
-            return get_top_crypto_prices(limit, retry_count + 1)
-        
-        return None
-        
-    except requests.exceptions.RequestException as e:
+        if data is None and len(pages) > 1:
+            with _market_pages_lock:
+                cached = market_pages.get((vs_currency, page))
+            if cached and time.monotonic() - cached["fetched_at"] < SNAPSHOT_STALE_TTL:
+                log_info("Using cached markets page (API failed)", page=page, vs_currency=vs_currency)
+                data = cached["data"]
+        if data is None:
+            # Later pages cannot be placed without this one
+            for pending in futures:
+                pending.cancel()
+            break
+        merged.extend(data)
+    
+    if failed:
         api_fail_count += 1
-        print(f"[WARNING] API request error: {type(e).__name__} (attempt {retry_count + 1}/{MAX_API_RETRIES})")
-        
-        if retry_count < MAX_API_RETRIES:
-            time.sleep(2)
-            return get_top_crypto_prices(limit, retry_count + 1)
-        
+    elif merged:
+        api_fail_count = 0
+    if not merged:
         return None
-        
+    if len(pages) == 1:
+        return merged
+    
+    # Pages fetched (or cached) at different moments can overlap where coins swapped ranks
+    seen = set()
+    unique = []
+    for crypto in merged:
+        if crypto.get("id") not in seen:
+            seen.add(crypto.get("id"))
+            unique.append(crypto)
+    unique.sort(key=lambda crypto: crypto.get("market_cap_rank") or math.inf)
+    return unique[:limit]
+
+def fetch_exchange_rates():
+    """Fetch CoinGecko's exchange-rate table as {code: (units per USD, symbol)}; None on failure"""
+    def fetch():
+        response = http_get(COINGECKO_EXCHANGE_RATES_API)
+        raise_for_retryable_status(response)
+        rates = response.json().get("rates", {})
+        usd = rates.get("usd", {}).get("value")
+        if not usd:
+            raise RetryableError("no USD rate in exchange_rates response")
+        # Rates are quoted against BTC; rebase them on USD
+        return {code: (rate["value"] / usd, rate.get("unit", code.upper()))
+                for code, rate in rates.items() if rate.get("value")}
+    
+    try:
+        return call_with_retry(fetch, coingecko_breaker, description="CoinGecko exchange rates")
+    except CircuitOpenError as e:
+        log_warning("Circuit open, skipping exchange rate fetch", error=str(e))
+    except (RetryableError, requests.exceptions.RequestException) as e:
+        log_warning("API request error", error=f"{type(e).__name__}: {e}")
     except Exception as e:
-        api_fail_count += 1
-        print(f"[ERROR] Unexpected error fetching crypto prices: {type(e).__name__}: {e}")
-        return None
+        log_error("Unexpected error fetching exchange rates", error=f"{type(e).__name__}: {e}")
+    return None
 
-def get_btc_price(retry_count=0):
+def fetch_btc_price():
     """Fetch BTC price from CoinGecko API with retry logic"""
     global last_successful_price, last_successful_change, api_fail_count
     
+    params = {
+        "ids": "bitcoin",
+        "vs_currencies": "usd",
+        "include_24hr_change": "true"
+    }
+    
+    def fetch():
+        response = http_get(COINGECKO_API, params=params, timeout=15)
+        raise_for_retryable_status(response)
+        btc_data = response.json().get("bitcoin", {})
+        price = btc_data.get("usd", 0)
+        if price and price > 0:
+            return price, btc_data.get("usd_24h_change", 0)
+        raise RetryableError("no bitcoin price in response")
+    
     try:
-        params = {
-            "ids": "bitcoin",
-            "vs_currencies": "usd",
-            "include_24hr_change": "true"
-        }
-        response = requests.get(COINGECKO_API, params=params, timeout=15)
-        data = response.json()
-        
-        if "bitcoin" in data:
-            btc_data = data["bitcoin"]
-            price = btc_data.get("usd", 0)
-            change_24h = btc_data.get("usd_24h_change", 0)
-            
-            if price and price > 0:
-                last_successful_price = price
-                last_successful_change = change_24h
-                api_fail_count = 0
-                return price, change_24h
-        
-        if retry_count < MAX_API_RETRIES:
-            time.sleep(2)
-            return get_btc_price(retry_count + 1)
-        
-        if last_successful_price:
-            print(f"[INFO] Using cached price (API failed)")
-            return last_successful_price, last_successful_change
-        
-        return None, None
-        
-    except requests.exceptions.Timeout:
-        api_fail_count += 1
-        print(f"[WARNING] API timeout (attempt {retry_count + 1}/{MAX_API_RETRIES})")
-        
-        if retry_count < MAX_API_RETRIES:
-            wait_time = (retry_count + 1) * 2
-            time.sleep(wait_time)
-            return get_btc_price(retry_count + 1)
-        
-        if last_successful_price:
-            print(f"[INFO] Using cached price (API timeout)")
-            return last_successful_price, last_successful_change
-        
-        return None, None
-        
-    except requests.exceptions.RequestException as e:
+        price, change_24h = call_with_retry(fetch, coingecko_breaker, description="CoinGecko simple price")
+        last_successful_price = price
+        last_successful_change = change_24h
+        api_fail_count = 0
+        return price, change_24h
+    except CircuitOpenError as e:
+        log_warning("Circuit open, skipping BTC price fetch", error=str(e))
+    except (RetryableError, requests.exceptions.RequestException) as e:
         api_fail_count += 1
-        print(f"[WARNING] API request error: {type(e).__name__} (attempt {retry_count + 1}/{MAX_API_RETRIES})")
-        
-        if retry_count < MAX_API_RETRIES:
-            time.sleep(2)
-            return get_btc_price(retry_count + 1)
-        
-        if last_successful_price:
-            print(f"[INFO] Using cached price (API error)")
-            return last_successful_price, last_successful_change
-        
-        return None, None
-        
+        log_warning("API request error", error=f"{type(e).__name__}: {e}")
     except Exception as e:
         api_fail_count += 1
-        print(f"[ERROR] Unexpected error fetching BTC price: {type(e).__name__}: {e}")
-        
-        if last_successful_price:
-            print(f"[INFO] Using cached price (error occurred)")
-            return last_successful_price, last_successful_change
-        
-        return None, None
+        log_error("Unexpected error fetching BTC price", error=f"{type(e).__name__}: {e}")
+    
+    if last_successful_price:
+        log_info("Using cached price (API failed)", price=last_successful_price)
+        return last_successful_price, last_successful_change
+    
+    return None, None
 
-def send_message_to_user(user_id, message, parse_mode="HTML"):
-    """Send message to a specific user"""
-    try:
-        url = f"{TELEGRAM_API}/sendMessage"
-        payload = {
-            "chat_id": user_id,
-            "text": message,
-            "parse_mode": parse_mode
-        }
-        response = requests.post(url, json=payload, timeout=10)
-        result = response.json()
-        return result.get("ok", False)
-    except Exception as e:
-        print(f"[ERROR] Error sending message to user: {e}")
-        return False
+# ============================================================================
+# Market Data Providers
+# ============================================================================
 
-def split_message(message, max_length=4000):
-    """Split message into chunks if it exceeds Telegram's limit (4096 chars)"""
-    if len(message) <= max_length:
-        return [message]
+def fetch_coincap_markets(limit=25, vs_currency="usd"):
+    """Top coins from CoinCap, normalised to the CoinGecko markets shape (USD only)"""
+    def fetch():
+        response = http_get(COINCAP_API, params={"limit": min(limit, 2000)})
+        raise_for_retryable_status(response)
+        assets = response.json().get("data") or []
+        if not assets:
+            raise RetryableError("empty CoinCap response")
+        return assets
     
-    messages = []
-    lines = message.split('\n')
-    current_message = ""
+    def number(value):
+        return float(value) if value is not None else None
     
-    for line in lines:
-        # Check if adding this line would exceed limit
-        test_message = current_message + line + '\n' if current_message else line + '\n'
-        
-        if len(test_message) > max_length:
-            # If current message has content, save it
-            if current_message:
-                messages.append(current_message.strip())
-                current_message = ""
+    try:
+        assets = call_with_retry(fetch, coincap_breaker, max_retries=1, description="CoinCap assets")
+    except CircuitOpenError:
+        return None
+    except Exception as e:
+        log_warning("API request error", provider="coincap", error=f"{type(e).__name__}: {e}")
+        return None
+    return [{
+        "id": asset["id"],
+        "symbol": asset.get("symbol", "").lower(),
+        "name": asset.get("name", "Unknown"),
+        "current_price": number(asset.get("priceUsd")) or 0,
+        "market_cap": number(asset.get("marketCapUsd")),
+        "market_cap_rank": int(asset["rank"]) if asset.get("rank") else None,
+        "total_volume": number(asset.get("volumeUsd24Hr")),
+        "price_change_percentage_24h": number(asset.get("changePercent24Hr")),
+    } for asset in assets[:limit]]
+
+def fetch_coinpaprika_markets(limit=25, vs_currency="usd"):
+    """Top coins from CoinPaprika, normalised to the CoinGecko markets shape (USD only)"""
+    def fetch():
+        response = http_get(COINPAPRIKA_API, params={"quotes": "USD"})
+        raise_for_retryable_status(response)
+        tickers = response.json()
+        if not isinstance(tickers, list) or not tickers:
+            raise RetryableError("empty CoinPaprika response")
+        return tickers
+    
+    try:
+        tickers = call_with_retry(fetch, coinpaprika_breaker, max_retries=1, description="CoinPaprika tickers")
+    except CircuitOpenError:
+        return None
+    except Exception as e:
+        log_warning("API request error", provider="coinpaprika", error=f"{type(e).__name__}: {e}")
+        return None
+    
+    ranked = sorted((ticker for ticker in tickers if ticker.get("rank")), key=lambda ticker: ticker["rank"])
+    data = []
+    for ticker in ranked[:limit]:
+        quote = ticker.get("quotes", {}).get("USD", {})
+        data.append({
+            # "btc-bitcoin" -> "bitcoin", which matches the CoinGecko id for most coins
+            "id": ticker["id"].split("-", 1)[-1],
+            "symbol": ticker.get("symbol", "").lower(),
+            "name": ticker.get("name", "Unknown"),
+            "current_price": quote.get("price") or 0,
+            "market_cap": quote.get("market_cap"),
+            "market_cap_rank": ticker["rank"],
+            "total_volume": quote.get("volume_24h"),
+            "price_change_percentage_24h": quote.get("percent_change_24h"),
+        })
+    return data
+
+class MarketProvider:
+    """A markets source plus the latency samples its hedge delay is derived from"""
+    
+    def __init__(self, name, fetch_markets, currencies=None):
+        self.name = name
+        self.fetch_markets = fetch_markets  # (limit, vs_currency) -> markets list or None
+        self.currencies = currencies  # None = any currency
+        self.latencies = collections.deque(maxlen=PROVIDER_LATENCY_SAMPLES)
+        self.lock = threading.Lock()
+    
+    def supports(self, vs_currency):
+        return self.currencies is None or vs_currency in self.currencies
+    
+    def fetch(self, limit, vs_currency):
+        started = time.monotonic()
+        data = self.fetch_markets(limit, vs_currency)
+        if data:
+            with self.lock:
+                self.latencies.append(time.monotonic() - started)
+        return data
+    
+    def hedge_delay(self):
+        """p95 of recent successful fetches; a fixed delay until there are enough samples"""
+        with self.lock:
+            samples = sorted(self.latencies)
+        if len(samples) < 20:
+            return HEDGE_DEFAULT_DELAY
+        return max(HEDGE_MIN_DELAY, samples[int(0.95 * (len(samples) - 1))])
+
+market_providers = {
+    "coingecko": MarketProvider("coingecko", get_top_crypto_prices),
+    "coincap": MarketProvider("coincap", fetch_coincap_markets, currencies=("usd",)),
+    "coinpaprika": MarketProvider("coinpaprika", fetch_coinpaprika_markets, currencies=("usd",)),
+}
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+
+# Fallback providers and the price stream use their own coin ids ("binance-coin" for
+# CoinGecko's "binancecoin"); they are matched to CoinGecko ids by symbol and rank
+_coin_ids_lock = threading.Lock()
+coingecko_coins = {}  # CoinGecko id -> (symbol, rank), from CoinGecko answers
+_coingecko_symbols = {}  # symbol -> [(rank, CoinGecko id)]
+provider_coins = {}  # (provider, provider id) -> (symbol, rank), from fallback answers
+_coin_id_matches = {}  # (provider, provider id) -> CoinGecko id or None, cleared when either table changes
+
+def remember_coins(provider, data):
+    """Learn the symbols and ranks of a markets answer"""
+    with _coin_ids_lock:
+        for crypto in data:
+            coin = (crypto.get("symbol", "").lower(), crypto.get("market_cap_rank") or math.inf)
+            if provider == "coingecko":
+                if coingecko_coins.get(crypto["id"]) != coin:
+                    coingecko_coins[crypto["id"]] = coin
+                    _coingecko_symbols.clear()
+            else:
+                provider_coins[(provider, crypto["id"])] = coin
+        if not _coingecko_symbols:
+            for coin_id, (symbol, rank) in coingecko_coins.items():
+                _coingecko_symbols.setdefault(symbol, []).append((rank, coin_id))
+        _coin_id_matches.clear()
+
+def coingecko_id(provider, coin_id):
+    """CoinGecko id of a provider's coin: same symbol, nearest rank; None if there is no match"""
+    if provider == "coingecko":
+        return coin_id
+    key = (provider, coin_id)
+    with _coin_ids_lock:
+        if key in _coin_id_matches:
+            return _coin_id_matches[key]
+        match = None
+        coin = provider_coins.get(key)
+        if coin is not None:
+            candidates = _coingecko_symbols.get(coin[0])
+            if candidates:
+                match = min(candidates, key=lambda candidate: abs(candidate[0] - coin[1]))[1]
+        elif coin_id in coingecko_coins:
+            match = coin_id
+        _coin_id_matches[key] = match
+    return match
+
+def to_coingecko_ids(provider, data):
+    """A fallback markets answer with CoinGecko ids wherever a coin can be matched"""
+    remember_coins(provider, data)
+    if provider == "coingecko":
+        return data
+    mapped = []
+    for crypto in data:
+        coin_id = coingecko_id(provider, crypto["id"])
+        mapped.append(dict(crypto, id=coin_id) if coin_id and coin_id != crypto["id"] else crypto)
+    return mapped
+
+def tracked_coins(crypto_data):
+    """The entries of a snapshot known by their CoinGecko id (history and alerts are keyed on those)"""
+    return [crypto for crypto in crypto_data if crypto.get("id") in coingecko_coins]
+
+def fetch_markets_hedged(limit=25, vs_currency="usd"):
+    """Ask the providers in MARKET_PROVIDERS order and return the first answer
+    
+    The next provider is started as soon as the current one fails, or once
+    it has taken longer than its p95 latency; slower requests are left to
+    finish in the background and their answers are ignored.
+    """
+    providers = [market_providers[name] for name in MARKET_PROVIDERS
+                 if name in market_providers and market_providers[name].supports(vs_currency)]
+    pending = {}  # future -> provider
+    next_index = 0
+    while True:
+        if next_index < len(providers):
+            provider = providers[next_index]
+            reason = "primary" if next_index == 0 else ("hedge" if pending else "failover")
+            inc_counter("bot_market_requests_total", (("provider", provider.name), ("reason", reason)))
+            pending[_hedge_executor.submit(provider.fetch, limit, vs_currency)] = provider
+            next_index += 1
+            timeout = provider.hedge_delay() if next_index < len(providers) else None
+        elif not pending:
+            return None
+        else:
+            timeout = None
+    
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            provider = pending.pop(future)
+            try:
+                data = future.result()
+            except Exception as e:
+                log_error("Unexpected error fetching market data", provider=provider.name, error=f"{type(e).__name__}: {e}")
+                data = None
+            if data:
+                inc_counter("bot_market_wins_total", (("provider", provider.name),))
+                if provider is not providers[0]:
+                    log_info("Market data served by fallback provider", provider=provider.name)
+                return to_coingecko_ids(provider.name, data)
+
+# ============================================================================
+# Market Data Snapshot Cache
+# ============================================================================
+
+market_snapshots = {}  # (vs_currency, limit) -> {"data": [...], "fetched_at": monotonic time}
+_snapshot_lock = threading.Lock()
+_snapshot_refreshes = {}  # (vs_currency, limit) -> Future of the fetch in flight
+
+def find_market_snapshot(vs_currency, limit):
+    """Return the freshest cached snapshot covering at least `limit` coins"""
+    best = None
+    with _snapshot_lock:
+        for (currency, cached_limit), entry in market_snapshots.items():
+            if currency != vs_currency or cached_limit < limit:
+                continue
+            if best is None or entry["fetched_at"] > best["fetched_at"]:
+                best = entry
+    return best
+
+def refresh_market_snapshot(vs_currency="usd", limit=25):
+    """Fetch a snapshot into the cache; concurrent callers share one request"""
+    key = (vs_currency, limit)
+    with _snapshot_lock:
+        future = _snapshot_refreshes.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _snapshot_refreshes[key] = future
+    
+    if not owner:
+        return future.result()
+    
+    data = None
+    try:
+        data = fetch_markets_hedged(limit, vs_currency)
+        if data:
+            fetched_at = time.monotonic()
+            with _snapshot_lock:
+                # A bigger snapshot makes older, smaller ones redundant
+                for cached_key in list(market_snapshots):
+                    if cached_key[0] == vs_currency and cached_key[1] < limit:
+                        del market_snapshots[cached_key]
+                market_snapshots[key] = {"data": data, "fetched_at": fetched_at}
+            save_market_snapshot(key, data, fetched_at)
+            if vs_currency == "usd":
+                # Coins a fallback provider could not match to a CoinGecko id are left out
+                tracked = tracked_coins(data)
+                if price_history:
+                    price_history.record(tracked[:price_history.max_coins])
+                # Fresher stream ticks win, so the two sources cannot flip an alert back and forth
+                check_price_alerts({crypto["id"]: crypto["current_price"]
+                                    for crypto in apply_live_prices(tracked) if crypto.get("current_price")})
+    finally:
+        with _snapshot_lock:
+            del _snapshot_refreshes[key]
+        future.set_result(data)
+    return data
+
+def refresh_market_snapshot_in_background(vs_currency, limit):
+    """Start a background refresh unless one is already running for this key"""
+    with _snapshot_lock:
+        if (vs_currency, limit) in _snapshot_refreshes:
+            return
+    threading.Thread(target=refresh_market_snapshot, args=(vs_currency, limit),
+                     name="snapshot-refresh", daemon=True).start()
+
+def get_market_snapshot(vs_currency="usd", limit=25, allow_stale=True):
+    """Get top coins from the snapshot cache (TTL + stale-while-revalidate)"""
+    entry = find_market_snapshot(vs_currency, limit)
+    if entry:
+        age = time.monotonic() - entry["fetched_at"]
+        if age < SNAPSHOT_TTL:
+            return entry["data"][:limit]
+        if allow_stale and age < SNAPSHOT_STALE_TTL:
+            refresh_market_snapshot_in_background(vs_currency, limit)
+            return entry["data"][:limit]
+    
+    data = refresh_market_snapshot(vs_currency, limit)
+    if data:
+        return data[:limit]
+    if entry and allow_stale:
+        log_info("Using cached market data (API failed)", vs_currency=vs_currency, limit=limit)
+        return entry["data"][:limit]
+    return None
+
+def find_coin(crypto_data, coin_id):
+    """Find a coin in a markets snapshot by its CoinGecko id"""
+    for crypto in crypto_data or []:
+        if crypto.get("id") == coin_id:
+            return crypto
+    return None
+
+def find_coin_by_symbol(crypto_data, symbol):
+    """Highest-ranked coin in a markets snapshot whose ticker symbol (or id) matches"""
+    symbol = symbol.lower()
+    for crypto in crypto_data or []:
+        if crypto.get("symbol", "").lower() == symbol or crypto.get("id") == symbol:
+            return crypto
+    return None
+
+def get_btc_price():
+    """Get BTC price and 24h change, served from the shared market snapshot"""
+    global last_successful_price, last_successful_change
+    
+    btc = find_coin(get_market_snapshot("usd", crypto_count), "bitcoin")
+    if btc:
+        btc = apply_live_prices([btc])[0]
+    if btc and btc.get("current_price"):
+        last_successful_price = btc["current_price"]
+        last_successful_change = btc.get("price_change_percentage_24h", 0)
+        return last_successful_price, last_successful_change
+    
+    # Bitcoin missing from the snapshot - ask the simple price endpoint
+    return fetch_btc_price()
+
+# ============================================================================
+# Exchange Rates
+# ============================================================================
+
+fx_table = {}  # {"rates": {code: (units per USD, symbol)}, "fetched_at": monotonic time}
+_fx_lock = threading.Lock()
+_fx_refresh = None  # Future of the fetch in flight
+_fx_failures = 0  # Consecutive failed fetches
+_fx_retry_at = 0.0  # Monotonic time before which a failed fetch is not retried
+_fx_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fx")
+# Money-valued fields of a markets entry; percentages and ranks need no conversion
+CONVERTED_FIELDS = ("current_price", "market_cap", "total_volume", "high_24h", "low_24h", "price_change_24h")
+
+def refresh_fx_rates():
+    """Fetch the exchange-rate table; after a failure the next attempt backs off"""
+    global _fx_refresh, _fx_failures, _fx_retry_at
+    rates = fetch_exchange_rates()
+    with _fx_lock:
+        _fx_refresh = None
+        if rates:
+            fx_table.update({"rates": rates, "fetched_at": time.monotonic()})
+            _fx_failures = 0
+        else:
+            _fx_failures += 1
+            _fx_retry_at = time.monotonic() + min(FX_RETRY_MAX_DELAY, FX_RETRY_BASE_DELAY * 2 ** (_fx_failures - 1))
+    if rates:
+        save_fx_table(rates, fx_table["fetched_at"])
+    return rates
+
+def get_fx_rates(wait=False):
+    """Cached exchange rates; an old or missing table is refetched in the background
+    
+    Posting never waits for the fetch. With wait=True a caller that finds no
+    table at all (a command) waits for the fetch in flight instead.
+    """
+    global _fx_refresh
+    with _fx_lock:
+        now = time.monotonic()
+        rates = fx_table.get("rates")
+        if (not fx_table or now - fx_table["fetched_at"] >= FX_TTL) and _fx_refresh is None and now >= _fx_retry_at:
+            _fx_refresh = _fx_executor.submit(refresh_fx_rates)
+        refresh = _fx_refresh
+    if rates is None and wait and refresh is not None:
+        return refresh.result()
+    return rates
+
+def get_fx_rate(currency, wait=False):
+    """(units per USD, symbol) for a currency code, or None if unknown"""
+    if currency == "usd":
+        return 1.0, "$"
+    rate = (get_fx_rates(wait) or {}).get(currency)
+    return tuple(rate) if rate else None
+
+def currency_symbol(currency):
+    """Display symbol from the cached table (no fetch)"""
+    if currency == "usd":
+        return "$"
+    rate = fx_table.get("rates", {}).get(currency)
+    return rate[1] if rate else currency.upper() + " "
+
+def convert_market_data(crypto_data, currency):
+    """Copy of a USD markets list priced in another currency; None if the rate is unknown"""
+    if currency == "usd":
+        return crypto_data
+    rate = get_fx_rate(currency)
+    if rate is None:
+        return None
+    factor = rate[0]
+    converted = []
+    for crypto in crypto_data:
+        crypto = dict(crypto)
+        for field in CONVERTED_FIELDS:
+            if crypto.get(field) is not None:
+                crypto[field] *= factor
+        converted.append(crypto)
+    return converted
+
+# ============================================================================
+# Live Price Stream
+# ============================================================================
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+live_prices = {}  # coin id -> (USD price, monotonic time of the tick), fed by price_stream_task
+price_stream_connected = False
+
+def update_live_prices(ticks):
+    """Store a {CoinCap id: price} ticker message; returns its prices by CoinGecko id"""
+    if not isinstance(ticks, dict):
+        return {}
+    now = time.monotonic()
+    prices = {}
+    for stream_id, price in ticks.items():
+        coin_id = coingecko_id("coincap", stream_id)
+        if coin_id is None:
+            continue
+        try:
+            prices[coin_id] = float(price)
+        except (TypeError, ValueError):
+            continue
+        live_prices[coin_id] = (prices[coin_id], now)
+    return prices
+
+def apply_live_prices(crypto_data):
+    """Markets entries with current_price replaced by fresh stream ticks
+    
+    The 24h change is rebased on the new price using the open price implied
+    by the snapshot, so it stays consistent with the price shown.
+    """
+    if not live_prices:
+        return crypto_data
+    now = time.monotonic()
+    updated = []
+    for crypto in crypto_data:
+        tick = live_prices.get(crypto.get("id"))
+        if tick and now - tick[1] < STREAM_MAX_AGE and crypto.get("current_price"):
+            crypto = dict(crypto)
+            change = crypto.get("price_change_percentage_24h")
+            if change is not None and change > -100:
+                open_price = crypto["current_price"] / (1 + change / 100)
+                crypto["price_change_percentage_24h"] = (tick[0] / open_price - 1) * 100
+            crypto["current_price"] = tick[0]
+        updated.append(crypto)
+    return updated
+
+async def websocket_connect(url, timeout=10):
+    """Open a WebSocket (ws:// or wss://) and complete the upgrade handshake"""
+    parts = urlsplit(url)
+    secure = parts.scheme == "wss"
+    port = parts.port or (443 if secure else 80)
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(
+        parts.hostname, port, ssl=ssl.create_default_context() if secure else None), timeout)
+    
+    key = base64.b64encode(os.urandom(16)).decode("ascii")
+    path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+    writer.write((f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nUpgrade: websocket\r\n"
+                  f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode("ascii"))
+    await writer.drain()
+    
+    response = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+    status_line, *header_lines = response.decode("latin-1").split("\r\n")
+    headers = {}
+    for line in header_lines:
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    expected = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode("ascii")).digest()).decode("ascii")
+    if status_line.split()[1:2] != ["101"] or headers.get("sec-websocket-accept") != expected:
+        writer.close()
+        raise ValueError(f"WebSocket handshake failed: {status_line}")
+    return reader, writer
+
+def websocket_frame(opcode, payload=b""):
+    """A masked client frame (clients must mask everything they send)"""
+    mask = os.urandom(4)
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, 0x80 | length)
+    elif length < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 0x80 | 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 0x80 | 127, length)
+    return header + mask + bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+
+async def websocket_messages(reader, writer, idle_timeout):
+    """Yield text messages; answers pings and stops on close or after idle_timeout without data"""
+    fragments = []
+    while True:
+        first, second = await asyncio.wait_for(reader.readexactly(2), idle_timeout)
+        opcode = first & 0x0F
+        length = second & 0x7F
+        if length == 126:
+            (length,) = struct.unpack("!H", await reader.readexactly(2))
+        elif length == 127:
+            (length,) = struct.unpack("!Q", await reader.readexactly(8))
+        if length > STREAM_MAX_MESSAGE:
+            raise ValueError(f"WebSocket frame too large ({length} bytes)")
+        mask = await reader.readexactly(4) if second & 0x80 else None
+        payload = await reader.readexactly(length)
+        if mask:
+            payload = bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+    
+        if opcode == 0x8:  # Close - echo it and stop
+            writer.write(websocket_frame(0x8, payload[:2]))
+            await writer.drain()
+            return
+        if opcode == 0x9:  # Ping
+            writer.write(websocket_frame(0xA, payload))
+            await writer.drain()
+            continue
+        if opcode == 0xA:  # Pong
+            continue
+        fragments.append(payload)
+        if first & 0x80:  # FIN - message complete
+            message = b"".join(fragments)
+            fragments = []
+            yield message.decode("utf-8")
+
+# ============================================================================
+# Price Alerts
+# ============================================================================
+
+price_alerts = {}  # alert id -> {"id", "chat_id", "coin", "symbol", "direction", "threshold", "spec", "armed", "fired_at"}
+_alert_index = {}  # coin id -> {">": [(price, alert id), ...], "<": [...]}, each list sorted by price
+_alert_lock = threading.Lock()
+_next_alert_id = itertools.count(1)
+
+def alert_trigger(alert):
+    """(side, USD price) an alert is waiting for
+    
+    An armed alert waits for its threshold. Once fired it waits on the other
+    side, ALERT_REARM_MARGIN past the threshold, and is armed again there -
+    a price hovering around the threshold fires it only once.
+    """
+    if alert["armed"]:
+        return alert["direction"], alert["threshold"]
+    if alert["direction"] == ">":
+        return "<", alert["threshold"] * (1 - ALERT_REARM_MARGIN)
+    return ">", alert["threshold"] * (1 + ALERT_REARM_MARGIN)
+
+def index_alert(alert):
+    side, price = alert_trigger(alert)
+    sides = _alert_index.setdefault(alert["coin"], {">": [], "<": []})
+    bisect.insort(sides[side], (price, alert["id"]))
+
+def unindex_alert(alert):
+    side, price = alert_trigger(alert)
+    entries = _alert_index.get(alert["coin"], {}).get(side, [])
+    position = bisect.bisect_left(entries, (price, alert["id"]))
+    if position < len(entries) and entries[position] == (price, alert["id"]):
+        del entries[position]
+
+def restore_price_alerts(alerts):
+    """Rebuild the index from saved alerts"""
+    global _next_alert_id
+    with _alert_lock:
+        for alert in alerts:
+            price_alerts[alert["id"]] = alert
+            index_alert(alert)
+        _next_alert_id = itertools.count(max(price_alerts, default=0) + 1)
+
+def chat_price_alerts(chat_id):
+    """A chat's alerts, oldest first"""
+    with _alert_lock:
+        return sorted((dict(alert) for alert in price_alerts.values() if alert["chat_id"] == chat_id),
+                      key=lambda alert: alert["id"])
+
+def add_price_alert(chat_id, coin, symbol, direction, threshold, spec):
+    """Register an alert for chat_id; None when the chat already has ALERT_MAX_PER_CHAT"""
+    with _alert_lock:
+        if sum(1 for alert in price_alerts.values() if alert["chat_id"] == chat_id) >= ALERT_MAX_PER_CHAT:
+            return None
+        alert = {
+            "id": next(_next_alert_id),
+            "chat_id": chat_id,
+            "coin": coin,
+            "symbol": symbol,
+            "direction": direction,
+            "threshold": threshold,
+            "spec": spec,
+            "armed": True,
+            "fired_at": None,
+        }
+        price_alerts[alert["id"]] = alert
+        index_alert(alert)
+    save_price_alerts([alert])
+    return alert
+
+def remove_price_alerts(chat_id, alert_ids=None):
+    """Delete a chat's alerts (all of them when alert_ids is None); returns how many were deleted"""
+    with _alert_lock:
+        removed = [alert for alert in price_alerts.values()
+                   if alert["chat_id"] == chat_id and (alert_ids is None or alert["id"] in alert_ids)]
+        for alert in removed:
+            unindex_alert(alert)
+            del price_alerts[alert["id"]]
+    delete_price_alerts([alert["id"] for alert in removed])
+    return len(removed)
+
+def evaluate_price_alerts(prices):
+    """Move the alerts crossed by {coin id: USD price}; returns (chat id, message) notifications
+    
+    Per coin this is two bisections plus the entries actually crossed, so
+    thousands of alerts cost next to nothing on a tick that crosses none.
+    """
+    now = time.time()
+    notifications = []
+    changed = []
+    with _alert_lock:
+        if not _alert_index:
+            return []
+        for coin, price in prices.items():
+            sides = _alert_index.get(coin)
+            if not sides:
+                continue
+            # ">" waits for the price to reach the threshold from below, "<" from above
+            above, below = sides[">"], sides["<"]
+            crossed_up = bisect.bisect_right(above, (price, math.inf))
+            crossed_down = bisect.bisect_left(below, (price, -math.inf))
+            crossed = above[:crossed_up] + below[crossed_down:]
+            del above[:crossed_up]
+            del below[crossed_down:]
             
-            # If single line is too long, truncate it
-            if len(line) > max_length:
-                # Try to split by words
-                words = line.split()
-                for word in words:
-                    test_word = current_message + word + ' ' if current_message else word + ' '
-                    if len(test_word) > max_length:
-                        if current_message:
-                            messages.append(current_message.strip())
-                            current_message = word + ' '
-                        else:
-                            # Word itself is too long, truncate
-                            messages.append(word[:max_length])
-                            current_message = word[max_length:] + ' '
+            for _, alert_id in crossed:
+                alert = price_alerts[alert_id]
+                if alert["armed"]:
+                    alert["armed"] = False
+                    if alert["fired_at"] and now - alert["fired_at"] < ALERT_COOLDOWN:
+                        inc_counter("bot_alerts_fired_total", (("result", "suppressed"),))
                     else:
-                        current_message = test_word
-            else:
-                current_message = line + '\n'
+                        alert["fired_at"] = now
+                        inc_counter("bot_alerts_fired_total", (("result", "sent"),))
+                        notifications.append((alert["chat_id"], format_alert_message(alert, price)))
+                else:
+                    alert["armed"] = True
+                index_alert(alert)
+                changed.append(dict(alert))
+    save_price_alerts(changed)
+    return notifications
+
+def check_price_alerts(prices):
+    """Evaluate alerts against fresh prices and send the notifications without waiting for them"""
+    for chat_id, message in evaluate_price_alerts(prices):
+        _send_executor.submit(send_message_to_user, chat_id, message)
+
+def format_alert_message(alert, price):
+    direction = "risen above" if alert["direction"] == ">" else "fallen below"
+    spec = f" ({alert['spec']})" if alert["spec"] else ""
+    return f"""🔔 <b>Price Alert #{alert['id']}</b>
+
+{alert['symbol'].upper()} has {direction} <b>{format_coin_price(alert['threshold'])}</b>{spec}
+Now: <b>{format_coin_price(price)}</b>
+
+Delete it with /delalert {alert['id']}"""
+
+# ============================================================================
+# Price History
+# ============================================================================
+
+class PriceHistory:
+    """Fixed-size per-minute price ring for each coin, stored in a memory-mapped file
+    
+    Layout: header, coin table (id + last minute written per row), one uint32
+    minute stamp per ring slot, then a float32 ring of prices per coin row.
+    Slot i of every ring holds the price at minute `minutes[i]` (NaN if missing).
+    """
+    
+    MAGIC = b"PHST"
+    VERSION = 1
+    HEADER = struct.Struct("<4sIII")  # magic, version, capacity, max_coins
+    HEADER_SIZE = 64
+    COIN_ENTRY = struct.Struct("<60sI")  # coin id, last minute written
+    
+    def __init__(self, path=HISTORY_PATH, capacity=HISTORY_MINUTES, max_coins=HISTORY_MAX_COINS):
+        self.path = path
+        self.capacity = capacity
+        self.max_coins = max_coins
+        self.lock = threading.Lock()
+        
+        coins_offset = self.HEADER_SIZE
+        minutes_offset = coins_offset + max_coins * self.COIN_ENTRY.size
+        prices_offset = minutes_offset + capacity * 4
+        size = prices_offset + max_coins * capacity * 4
+        
+        header = self.HEADER.pack(self.MAGIC, self.VERSION, capacity, max_coins)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fresh = os.fstat(fd).st_size != size or os.pread(fd, self.HEADER.size, 0) != header
+            if fresh:
+                # New file or different layout - start an empty history
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        
+        self.view = memoryview(self.mm)
+        self.coin_table = self.view[coins_offset:minutes_offset]
+        self.minutes = self.view[minutes_offset:prices_offset].cast("I")
+        self.prices = self.view[prices_offset:size].cast("f")
+        
+        if fresh:
+            self.mm[:self.HEADER.size] = header
+            nan = struct.pack("<f", math.nan)
+            self.mm[prices_offset:size] = nan * (max_coins * capacity)
+        
+        self.rows = {}  # coin id -> row
+        self.row_minutes = []  # row -> last minute written
+        for row in range(max_coins):
+            raw_id, last_minute = self.COIN_ENTRY.unpack_from(self.coin_table, row * self.COIN_ENTRY.size)
+            coin_id = raw_id.rstrip(b"\0").decode("utf-8", "replace")
+            if coin_id:
+                self.rows[coin_id] = row
+            self.row_minutes.append(last_minute if coin_id else 0)
+    
+    def _assign_row(self, coin_id, minute):
+        """Give coin_id a row, evicting the coin that was updated longest ago if full"""
+        if len(self.rows) < self.max_coins:
+            row = len(self.rows)
         else:
-            current_message = test_message
+            row = min(range(self.max_coins), key=self.row_minutes.__getitem__)
+            if self.row_minutes[row] >= minute:
+                return None  # Every tracked coin is current - keep them
+            for old_id, old_row in list(self.rows.items()):
+                if old_row == row:
+                    del self.rows[old_id]
+            start = row * self.capacity
+            self.prices[start:start + self.capacity] = array.array("f", [math.nan]) * self.capacity
+        self.rows[coin_id] = row
+        return row
     
-    # Add remaining message
-    if current_message:
-        messages.append(current_message.strip())
+    def record(self, crypto_data, timestamp=None):
+        """Store the USD price of every coin in a markets snapshot"""
+        minute = int((timestamp if timestamp is not None else time.time()) // 60)
+        slot = minute % self.capacity
+        with self.lock:
+            if self.minutes[slot] != minute:
+                # Slot still holds a sample from one ring cycle ago - clear it
+                for row in range(self.max_coins):
+                    self.prices[row * self.capacity + slot] = math.nan
+                self.minutes[slot] = minute
+            
+            for crypto in crypto_data:
+                coin_id = crypto.get("id")
+                price = crypto.get("current_price")
+                if not coin_id or price is None:
+                    continue
+                row = self.rows.get(coin_id)
+                if row is None:
+                    row = self._assign_row(coin_id, minute)
+                    if row is None:
+                        continue
+                self.prices[row * self.capacity + slot] = price
+                self.row_minutes[row] = minute
+                self.COIN_ENTRY.pack_into(self.coin_table, row * self.COIN_ENTRY.size,
+                                          coin_id.encode("utf-8")[:60], minute)
     
-    return messages
+    def get_range(self, coin_id, start_time, end_time=None):
+        """Return [(timestamp, price), ...] for coin_id between start_time and end_time"""
+        end_minute = int((end_time if end_time is not None else time.time()) // 60)
+        start_minute = max(int(start_time // 60), end_minute - self.capacity + 1)
+        if start_minute > end_minute:
+            return []
+        
+        with self.lock:
+            row = self.rows.get(coin_id)
+            if row is None:
+                return []
+            base = row * self.capacity
+            # The requested minutes map to at most two contiguous slot ranges
+            first_slot = start_minute % self.capacity
+            count = end_minute - start_minute + 1
+            segments = [(first_slot, min(first_slot + count, self.capacity))]
+            if first_slot + count > self.capacity:
+                segments.append((0, first_slot + count - self.capacity))
+            minutes = []
+            prices = []
+            for lo, hi in segments:
+                minutes.extend(self.minutes[lo:hi].tolist())
+                prices.extend(self.prices[base + lo:base + hi].tolist())
+        
+        return [(minute * 60, price) for minute, price in zip(minutes, prices)
+                if start_minute <= minute <= end_minute and not math.isnan(price)]
+    
+    def moving_average(self, coin_id, minutes):
+        """Average price over the last `minutes` minutes (None without samples)"""
+        samples = self.get_range(coin_id, time.time() - minutes * 60)
+        if not samples:
+            return None
+        return sum(price for _, price in samples) / len(samples)
+    
+    def period_change(self, coin_id, minutes):
+        """Percentage change from the oldest to the newest sample in the last `minutes` minutes"""
+        samples = self.get_range(coin_id, time.time() - minutes * 60)
+        if len(samples) < 2 or not samples[0][1]:
+            return None
+        return (samples[-1][1] - samples[0][1]) / samples[0][1] * 100
+    
+    def close(self):
+        with self.lock:
+            self.coin_table.release()
+            self.minutes.release()
+            self.prices.release()
+            self.view.release()
+            self.mm.flush()
+            self.mm.close()
 
-def send_message_to_channel(message):
-    """Send message to all channels in the list (splits if too long)"""
-    channels = CHANNELS.copy()
+price_history = None  # PriceHistory, opened by run_bot_async
+
+def open_price_history():
+    """Open the price history file (history is optional - errors only disable it)"""
+    global price_history
+    try:
+        price_history = PriceHistory(HISTORY_PATH, HISTORY_MINUTES, HISTORY_MAX_COINS)
+    except (OSError, ValueError) as e:
+        log_warning("Price history disabled", error=str(e))
+        price_history = None
+    return price_history
+
+# ============================================================================
+# Message Sending & Formatting
+# ============================================================================
+
+def telegram_send(method, payload, chat_id):
+    """Call a Telegram send method with rate limiting, retries and the circuit breaker"""
+    url = f"{TELEGRAM_API}/{method}"
     
-    if not channels:
-        print("[ERROR] No channels configured!")
+    def send():
+        wait_for_send_slot(chat_id)
+        response = http_post(url, json=payload)
+        raise_for_retryable_status(response)
+        return response.json()
+    
+    return call_with_retry(send, telegram_breaker, max_retries=TELEGRAM_SEND_RETRIES, description=f"Telegram {method} to {chat_id}")
+
+def send_message_to_user(user_id, message, parse_mode="HTML"):
+    """Send message to a specific user"""
+    try:
+        payload = {
+            "chat_id": user_id,
+            "text": message,
+            "parse_mode": parse_mode
+        }
+        result = telegram_send("sendMessage", payload, user_id)
+        return result.get("ok", False)
+    except Exception as e:
+        log_error("Error sending message to user", chat_id=user_id, error=str(e))
         return False
+
+# Tags, entities, whitespace runs and plain words of an HTML message
+HTML_TOKEN_RE = re.compile(r"<[^>]*>|&#?\w+;|\s+|[^<&\s]+|[<&]")
+HTML_TAG_RE = re.compile(r"<[^>]*>")
+HTML_TAG_NAME_RE = re.compile(r"</?\s*([a-zA-Z][\w-]*)")
+HTML_TAG_PAIR_RE = re.compile(r"<([a-zA-Z][\w-]*)(?:\s[^>]*)?>[^<]*</\1\s*>")
+HTML_EMPTY_PAIR_RE = re.compile(r"<([a-zA-Z][\w-]*)(?:\s[^>]*)?>\s*</\1\s*>")
+
+def html_open_tags(text, open_tags):
+    """The (name, opening tag) stack after text, starting from open_tags"""
+    if not open_tags and text.count("<") == 2 * text.count("</"):
+        return []  # Every tag is closed again (messages are well-formed HTML)
+    open_tags = list(open_tags)
+    # A matched innermost pair leaves the stack as it was; dropping those first
+    # leaves only the few tags that actually open or close across the text
+    count = 1
+    while count and "<" in text:
+        text, count = HTML_TAG_PAIR_RE.subn("", text)
+    for tag in HTML_TAG_RE.findall(text):
+        match = HTML_TAG_NAME_RE.match(tag)
+        if not match or tag.endswith("/>"):
+            continue
+        name = match.group(1).lower()
+        if not tag.startswith("</"):
+            open_tags.append((name, tag))
+        elif open_tags and open_tags[-1][0] == name:
+            open_tags.pop()
+    return open_tags
+
+def closing_tags(open_tags):
+    """The closing tags for an open_tags stack, innermost first"""
+    return "".join(f"</{name}>" for name, _ in reversed(open_tags))
+
+def split_message(message, max_length=4000):
+    """Split message into chunks if it exceeds Telegram's limit (4096 chars)
     
-    # Split message if too long
-    message_parts = split_message(message, max_length=4000)
+    Whole lines (one coin entry each) are packed into chunks; a line longer
+    than a chunk is split between words. Tags still open at a cut are closed
+    at the end of the chunk and reopened at the start of the next, so every
+    chunk is balanced even when a tag pair spans many lines. A chunk only
+    exceeds max_length when the tags open at a cut, with their closing
+    tags, leave no room for any text (deep nesting with a tiny limit).
+    """
+    if len(message) <= max_length:
+        return [message]
     
-    success_count = 0
-    failed_channels = []
+    messages = []
+    pending = []  # Pieces still to place, next one last
+    current = []  # Starts with the tags reopened from the previous chunk
+    current_length = 0
+    open_tags = []  # (name, opening tag) of the tags open at the end of current
+    reserve = 0  # Length of the closing tags for open_tags
+    text_at = None  # Index in current of the first piece with text
+    unchecked = False  # Lines were taken in bulk while tags were open
     
-    for channel in channels:
-        channel_success = True
+    def flush():
+        nonlocal current, current_length, open_tags, reserve, text_at, unchecked
+        body = "".join(current)
+        closing = closing_tags(open_tags)
+        # Balanced tag counts only prove nothing is left open when nothing was
+        # open before; otherwise parse the whole chunk and hand lines back
+        # until its closing tags fit
+        while unchecked:
+            open_tags = html_open_tags(body, [])
+            closing = closing_tags(open_tags)
+            if len(body) + len(closing) <= max_length:
+                break
+            piece = current[-1]
+            cut = piece.rfind("\n", 0, len(piece) - 1) + 1
+            if cut and (len(current) - 1 > text_at or HTML_TAG_RE.sub("", piece[:cut]).strip()):
+                current[-1] = piece[:cut]
+                pending.append(piece[cut:])
+            elif len(current) - 1 > text_at:
+                pending.append(current.pop())
+            else:
+                break
+            body = "".join(current)
+        messages.append(body.strip() + closing)
+        current = [tag for _, tag in open_tags]
+        current_length = sum(map(len, current))
+        reserve = len(closing)
+        text_at = None
+        unchecked = False
+    
+    def place_pending():
+        nonlocal current_length, open_tags, reserve, text_at
+        while pending:
+            piece = pending.pop()
+            if "<" in piece:
+                after = html_open_tags(piece, open_tags)
+                after_reserve = len(closing_tags(after))
+                piece_text = text_at is not None or bool(HTML_TAG_RE.sub("", piece).strip())
+                if not piece_text:
+                    # Tags before the first text: drop the whitespace between
+                    # them and elements that close empty, so they do not take
+                    # the room the text needs
+                    head = "".join(HTML_TAG_RE.findall("".join(current) + piece))
+                    while True:
+                        head, dropped = HTML_EMPTY_PAIR_RE.subn("", head)
+                        if not dropped:
+                            break
+                    current[:] = [head] if head else []
+                    current_length = len(head)
+                    open_tags, reserve = after, after_reserve
+                    continue
+            elif text_at is None and piece.isspace():
+                continue  # No leading whitespace in a chunk
+            else:
+                after, after_reserve, piece_text = open_tags, reserve, True
+            if current_length + len(piece) + after_reserve > max_length:
+                if text_at is not None:
+                    pending.append(piece)
+                    flush()
+                    continue
+                # A line that does not fit an empty chunk is broken into its tokens
+                tokens = HTML_TOKEN_RE.findall(piece)
+                if len(tokens) > 1:
+                    pending.extend(reversed(tokens))
+                    continue
+                if piece_text and not (piece.startswith("&") and piece.endswith(";")):
+                    # A single word longer than a whole chunk has to be cut (an entity never is)
+                    room = max(1, max_length - current_length - after_reserve)
+                    if piece[room:]:
+                        pending.append(piece[room:])
+                    piece = piece[:room]
+            if piece_text and text_at is None:
+                text_at = len(current)
+            current.append(piece)
+            current_length += len(piece)
+            open_tags, reserve = after, after_reserve
+    
+    position = 0
+    while position < len(message):
+        if text_at is not None:
+            # Take every whole line that still fits at once, unless its tags
+            # change what is open at the end
+            room = max_length - current_length - reserve
+            end = len(message) if len(message) - position < room else message.rfind("\n", position, position + room) + 1
+            if end > position and message.count("<", position, end) == 2 * message.count("</", position, end):
+                current.append(message[position:end])
+                current_length += end - position
+                position = end
+                unchecked = unchecked or bool(open_tags)
+                continue
+        end = message.find("\n", position) + 1 or len(message)
+        pending.append(message[position:end])
+        position = end
+        place_pending()
+    while text_at is not None:
+        flush()
+        place_pending()
+    
+    return messages
+
+_send_retry_hints = {}  # channel -> retry_after of its last transient send failure (0 = none given)
+
+def send_parts_to_channel(channel, message_parts, sent_ids=None):
+    """Send message parts to one channel in order; return an error string or None"""
+    for part_idx, message_part in enumerate(message_parts):
+        try:
+            payload = {
+                "chat_id": channel,
+                "text": message_part,
+                "parse_mode": "HTML"
+            }
+            result = telegram_send("sendMessage", payload, channel)
+            
+            if result.get("ok"):
+                msg_id = result["result"].get("message_id", "N/A")
+                if sent_ids is not None:
+                    sent_ids.append(msg_id)
+                log_debug("Message sent", channel=channel, message_id=msg_id, part=part_idx + 1, parts=len(message_parts))
+            else:
+                error_code = result.get("error_code", "Unknown")
+                error_desc = result.get("description", "Unknown error")
+                log_error("Failed to send message", channel=channel, part=part_idx + 1, error_code=error_code, error=error_desc)
+                return f"{channel} ({error_desc})"
+                
+        except Exception as e:
+            log_error("Error sending message", channel=channel, part=part_idx + 1, error=str(e))
+            _send_retry_hints[channel] = getattr(e, "retry_after", None) or 0
+            return f"{channel} (Error: {e})"
+    
+    return None
+
+# Footer lines that change on every render; ignored when comparing posts
+TIMESTAMP_LINE_RE = re.compile(r"^<b>(?:🕐 Updated|⏰ Time):</b>.*$", re.MULTILINE)
+
+def message_fingerprint(message_part):
+    """Hash of a rendered part, ignoring the Updated/Time footer lines"""
+    content = TIMESTAMP_LINE_RE.sub("", message_part)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+def edit_parts_in_channel(channel, message_parts):
+    """Edit this channel's price post in place (posting it first if needed)
+    
+    channel_posts is updated here; the caller saves it once for the whole batch.
+    """
+    fingerprints = [message_fingerprint(part) for part in message_parts]
+    post = channel_posts.get(channel)
+    
+    if post and len(post["message_ids"]) == len(message_parts):
+        if post["fingerprints"] == fingerprints:
+            log_debug("Prices unchanged, skipped edit", channel=channel)
+            return None
+        
         for part_idx, message_part in enumerate(message_parts):
+            if post["fingerprints"][part_idx] == fingerprints[part_idx]:
+                continue
+            msg_id = post["message_ids"][part_idx]
             try:
-                url = f"{TELEGRAM_API}/sendMessage"
                 payload = {
                     "chat_id": channel,
+                    "message_id": msg_id,
                     "text": message_part,
                     "parse_mode": "HTML"
                 }
-                response = requests.post(url, json=payload, timeout=10)
-                result = response.json()
-                
-                if result.get("ok"):
-                    msg_id = result["result"].get("message_id", "N/A")
-                    if len(message_parts) > 1:
-                        print(f"[SUCCESS] Message part {part_idx + 1}/{len(message_parts)} sent to {channel} (ID: {msg_id}) at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-                    else:
-                        print(f"[SUCCESS] Message sent to {channel} (ID: {msg_id}) at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-                    sys.stdout.flush()
-                    # Small delay between parts
-                    if part_idx < len(message_parts) - 1:
-                        time.sleep(0.5)
-                else:
-                    error_code = result.get("error_code", "Unknown")
-                    error_desc = result.get("description", "Unknown error")
-                    print(f"[ERROR] Failed to send part {part_idx + 1} to {channel}: {error_code} - {error_desc}")
-                    sys.stdout.flush()
-                    channel_success = False
-                    failed_channels.append(f"{channel} ({error_desc})")
-                    break
-                    
+                result = telegram_send("editMessageText", payload, channel)
             except Exception as e:
-                print(f"[ERROR] Error sending part {part_idx + 1} to {channel}: {e}")
-                sys.stdout.flush()
-                channel_success = False
-                failed_channels.append(f"{channel} (Error: {e})")
+                log_error("Error editing message", channel=channel, message_id=msg_id, part=part_idx + 1, error=str(e))
+                _send_retry_hints[channel] = getattr(e, "retry_after", None) or 0
+                return f"{channel} (Error: {e})"
+            
+            error_desc = result.get("description", "Unknown error")
+            if result.get("ok") or "message is not modified" in error_desc:
+                post["fingerprints"][part_idx] = fingerprints[part_idx]
+                log_debug("Message edited", channel=channel, message_id=msg_id, part=part_idx + 1)
+            else:
+                # Message deleted or too old to edit - post a fresh one below
+                log_warning("Cannot edit message, posting a new one", channel=channel, message_id=msg_id, error=error_desc)
                 break
-        
-        if channel_success:
-            success_count += 1
+        else:
+            return None
+    
+    # No post to edit yet (or its part count changed) - send a new one and remember it
+    sent_ids = []
+    error = send_parts_to_channel(channel, message_parts, sent_ids)
+    if error is None:
+        with _channel_posts_lock:
+            channel_posts[channel] = {"message_ids": sent_ids, "fingerprints": fingerprints}
+    return error
+
+def deliver_parts(channel, message_parts, edit=False):
+    """Deliver one channel's message; returns (channel, error or None, parts sent, retry_after)
+    
+    retry_after is None when Telegram refused the message itself, so a retry
+    cannot help; otherwise it is the delay Telegram asked for (0 = none).
+    """
+    _send_retry_hints.pop(channel, None)
+    sent_ids = []
+    if edit:
+        error = edit_parts_in_channel(channel, message_parts)
+    else:
+        error = send_parts_to_channel(channel, message_parts, sent_ids)
+    return channel, error, len(sent_ids), _send_retry_hints.pop(channel, None)
+
+def deliver_parts_to_channels(deliveries, edit=False):
+    """Deliver (message, channels) pairs concurrently; returns deliver_parts results
+    
+    A message is either text or an already split list of parts.
+    """
+    futures = []
+    for message, targets in deliveries:
+        if not targets:
+            continue
+        # Split message if too long; parts within a channel stay in order
+        message_parts = message if isinstance(message, list) else split_message(message, max_length=4000)
+        for channel in targets:
+            futures.append(_send_executor.submit(deliver_parts, channel, message_parts, edit))
+    results = [future.result() for future in futures]
+    if edit:
+        # One write for the batch rather than one per channel
+        save_channel_posts()
+    return results
+
+def dispatch_deliveries(deliveries, edit=False):
+    """Deliver through the delivery workers when they are running, otherwise from this process"""
+    if delivery_workers is not None:
+        try:
+            return delivery_workers.deliver(deliveries, edit)
+        except ValueError as e:
+            log_error("Post does not fit the shared snapshot, delivering in-process", error=str(e))
+    return deliver_parts_to_channels(deliveries, edit)
+
+def send_messages_to_channels(deliveries, edit=False, kind=None):
+    """Send each (message, channels) pair; channels=None means every channel in the list
+    
+    All channels are served concurrently, by the delivery workers when they
+    are running. With edit=True each channel's previous post is edited in
+    place instead. Messages are journaled in the outbox first: channels that
+    fail, or still wait for an earlier message, get it from outbox_task.
+    A price post (kind "top" or "btc") replaces an undelivered one of the
+    same kind.
+    """
+    deliveries = [(message, CHANNELS.copy() if targets is None else list(targets)) for message, targets in deliveries]
+    message_count = sum(1 for _, targets in deliveries if targets)
+    if not message_count:
+        log_error("No channels configured!")
+        return False
+    
+    row_ids, queued = outbox_enqueue(deliveries, edit, kind)
+    direct = [(message, [channel for channel in targets if channel not in queued]) for message, targets in deliveries]
+    results = []
+    try:
+        results = dispatch_deliveries(direct, edit)
+    finally:
+        outbox_settle(row_ids, results)
+    
+    for channel, error, _, _ in results:
+        inc_counter("bot_channel_sends_total", (("channel", channel), ("result", "failure" if error else "success")))
+    failed_channels = [error for _, error, _, _ in results if error]
+    retrying = len(queued) + sum(1 for channel, error, _, retry_after in results
+                                 if error and retry_after is not None and channel in row_ids)
+    success_count = len(results) - len(failed_channels)
     
     # Summary
     if success_count > 0:
-        if len(message_parts) > 1:
-            print(f"[INFO] Successfully sent {len(message_parts)} message part(s) to {success_count}/{len(channels)} channel(s)")
-        else:
-            print(f"[INFO] Successfully sent to {success_count}/{len(channels)} channel(s)")
+        log_info("Message delivered", messages=message_count, channels_ok=success_count,
+                 channels=len(results) + len(queued), outbox=retrying)
         if failed_channels:
-            print(f"[WARNING] Failed channels: {', '.join(failed_channels)}")
-        sys.stdout.flush()
+            log_warning("Failed channels", failed=failed_channels)
+        return True
+    elif retrying:
+        # Nothing went out yet, but the outbox has it - no need to render or fetch again
+        log_warning("Delivery deferred to the outbox", channels=retrying, failed=failed_channels)
         return True
     else:
-        print(f"[ERROR] Failed to send to all channels!")
-        sys.stdout.flush()
+        log_error("Failed to send to all channels!", channels=len(results))
         return False
 
-def format_top_crypto_message(crypto_data, coin_count=25):
+def send_message_to_channel(message, edit=False, kind=None):
+    """Send message to all channels in the list (splits if too long)"""
+    return send_messages_to_channels([(message, None)], edit, kind)
+
+def format_coin_price(price, symbol="$"):
+    """$67,234.56 / $0.1234 / $0.00001234 depending on magnitude"""
+    if price >= 1:
+        return f"{symbol}{price:,.2f}"
+    elif price >= 0.01:
+        return f"{symbol}{price:.4f}"
+    return f"{symbol}{price:.8f}"
+
+def format_coin_change(change_24h):
+    """(emoji, text) for a 24h change percentage"""
+    if change_24h:
+        if change_24h > 0:
+            return "🟢", f"+{change_24h:.2f}%"
+        return "🔴", f"{change_24h:.2f}%"
+    return "⚪", "N/A"
+
+def format_top_crypto_message(crypto_data, coin_count=25, currency="usd"):
     """Format top cryptocurrencies price message (returns list if needs splitting)"""
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     current_time_display = datetime.now().strftime("%I:%M %p")
@@ -374,7 +2388,7 @@ def format_top_crypto_message(crypto_data, coin_count=25):
     # More compact format to fit more coins
     header = f"""
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-<b>📊 TOP {coin_count} CRYPTOCURRENCY PRICES</b>
+<b>📊 TOP {coin_count} CRYPTOCURRENCY PRICES{f' ({currency.upper()})' if currency != 'usd' else ''}</b>
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 """
@@ -389,6 +2403,7 @@ def format_top_crypto_message(crypto_data, coin_count=25):
 """
     
     # Build coin entries
+    currency_sign = currency_symbol(currency)
     coin_entries = []
     for idx, crypto in enumerate(crypto_data[:coin_count], 1):
         symbol = crypto.get("symbol", "").upper()
@@ -397,25 +2412,8 @@ def format_top_crypto_message(crypto_data, coin_count=25):
         change_24h = crypto.get("price_change_percentage_24h", 0)
         market_cap_rank = crypto.get("market_cap_rank", idx)
         
-        # Format price
-        if price >= 1:
-            price_str = f"${price:,.2f}"
-        elif price >= 0.01:
-            price_str = f"${price:.4f}"
-        else:
-            price_str = f"${price:.8f}"
-        
-        # Format change
-        if change_24h:
-            if change_24h > 0:
-                change_emoji = "🟢"
-                change_str = f"+{change_24h:.2f}%"
-            else:
-                change_emoji = "🔴"
-                change_str = f"{change_24h:.2f}%"
-        else:
-            change_emoji = "⚪"
-            change_str = "N/A"
+        price_str = format_coin_price(price, currency_sign)
+        change_emoji, change_str = format_coin_change(change_24h)
         
         # Format rank - more compact
         rank_str = f"#{market_cap_rank}" if market_cap_rank else f"#{idx}"
@@ -429,6 +2427,26 @@ def format_top_crypto_message(crypto_data, coin_count=25):
     
     return full_message.strip()
 
+def format_compact_crypto_message(crypto_data, coin_count=25, currency="usd"):
+    """Short top-N list: one symbol, price and change per line"""
+    if not crypto_data:
+        return None
+    
+    currency_sign = currency_symbol(currency)
+    lines = [f"<b>📊 Top {coin_count} Crypto ({currency.upper()})</b>", ""]
+    for crypto in crypto_data[:coin_count]:
+        change_emoji, change_str = format_coin_change(crypto.get("price_change_percentage_24h", 0))
+        lines.append(f"<b>{crypto.get('symbol', '').upper()}</b> <code>{format_coin_price(crypto.get('current_price', 0), currency_sign)}</code> {change_emoji} {change_str}")
+    lines.append("")
+    lines.append(f"<b>🕐 Updated:</b> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    return "\n".join(lines)
+
+# Templates a channel can choose with /channelset
+MESSAGE_TEMPLATES = {
+    "full": format_top_crypto_message,
+    "compact": format_compact_crypto_message,
+}
+
 def format_price_message(price, change_24h):
     """Format the price message with emoji and formatting"""
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -471,52 +2489,121 @@ def format_price_message(price, change_24h):
 """
     return message.strip()
 
+def check_channel_access(channel):
+    """True if getChat (cached) finds the channel"""
+    try:
+        chat, error = get_chat(channel)
+    except Exception as e:
+        log_error("Error testing channel access", channel=channel, error=str(e))
+        return False
+    if chat is None:
+        log_error("Bot cannot access channel", channel=channel, error=error)
+        return False
+    log_debug("Bot can access channel", channel=channel)
+    return True
+
 def test_bot_access():
-    """Test if bot can access all channels"""
+    """Test if bot can access all channels, CHAT_CHECK_CONCURRENCY at a time"""
     channels = CHANNELS.copy()
     
     if not channels:
-        print("[WARNING] No channels configured!")
+        log_warning("No channels configured!")
         return False
     
-    accessible = 0
-    for channel in channels:
-        try:
-            url = f"{TELEGRAM_API}/getChat"
-            payload = {"chat_id": channel}
-            response = requests.post(url, json=payload, timeout=10)
-            result = response.json()
-            
-            if result.get("ok"):
-                print(f"[OK] Bot can access channel: {channel}")
-                accessible += 1
-            else:
-                print(f"[ERROR] Bot cannot access channel {channel}: {result.get('description')}")
-        except Exception as e:
-            print(f"[ERROR] Error testing access to {channel}: {e}")
-    
-    sys.stdout.flush()
+    accessible = sum(_chat_info_executor.map(check_channel_access, channels))
+    log_info("Channel access checked", accessible=accessible, channels=len(channels))
     return accessible > 0
 
-def get_updates():
-    """Get updates from Telegram bot"""
+def get_updates(timeout=1):
+    """Get updates from Telegram bot (long-polls for up to timeout seconds, None on error)"""
     global last_update_id
+    started = time.monotonic()
+    outcome = "error"
     try:
         url = f"{TELEGRAM_API}/getUpdates"
         payload = {
             "offset": last_update_id + 1,
-            "timeout": 1
+            "timeout": timeout
         }
-        response = requests.post(url, json=payload, timeout=5)
+        response = http_post(url, json=payload, timeout=timeout + 5)
         result = response.json()
         if result.get("ok"):
             updates = result.get("result", [])
             for update in updates:
                 last_update_id = max(last_update_id, update.get("update_id", 0))
+            outcome = "updates" if updates else "empty"
             return updates
-        return []
+        if result.get("error_code") == 409:
+            # A webhook from an earlier run is still registered and blocks getUpdates
+            log_warning("Webhook still registered, deleting it to resume polling", error=result.get("description"))
+            delete_webhook()
+        return None
     except Exception as e:
-        return []
+        return None
+    finally:
+        observe_histogram("bot_getupdates_round_trip_seconds", (("result", outcome),), time.monotonic() - started)
+
+# ============================================================================
+# Command Router
+# ============================================================================
+
+ALERT_LEVEL_RE = re.compile(r"^(\S+?)\s*([<>])\s*\$?([\d,]*\.?\d+)$")
+ALERT_PERCENT_RE = re.compile(r"^(\S+)\s+([+-]\d*\.?\d+)\s*%$")
+
+class Command:
+    """A registered command: its handler, declared arguments and who may use it"""
+    
+    def __init__(self, name, handler, args=(), rest=None, public=False, usage=None, mutates=False):
+        self.name = name
+        self.handler = handler  # handler(chat_id, message, **arguments) -> reply text or None
+        self.args = args  # (name, parse, default) per word after the command; parse raises ValueError
+        self.rest = rest  # (name, parse) applied to the whole text after the command, if set
+        self.public = public  # Anyone may use it; all other commands are admin-only
+        self.usage = usage  # Reply sent when an argument does not parse
+        self.mutates = mutates  # Changes the bot settings, so it runs under _settings_lock
+    
+    def parse(self, words, text):
+        """Handler keyword arguments from the split command text; ValueError if malformed"""
+        arguments = {}
+        for index, (name, parse, default) in enumerate(self.args, start=1):
+            arguments[name] = parse(words[index]) if index < len(words) else default
+        if self.rest:
+            name, parse = self.rest
+            remainder = text.split(None, 1)
+            arguments[name] = parse(remainder[1].strip() if len(remainder) > 1 else "")
+        return arguments
+
+COMMANDS = {}  # "/name" -> Command
+_settings_lock = threading.Lock()  # Commands that change the settings run one at a time
+_reply_lock = threading.Lock()
+_reply_cache = {}  # "/name" -> rendered reply for commands whose answer only depends on the settings
+_reply_generation = 0  # Bumped on every settings change so a reply rendered from old settings is not kept
+
+def bot_command(name, args=(), rest=None, public=False, usage=None, mutates=False):
+    """Register the decorated function as the handler of name"""
+    def register(handler):
+        COMMANDS[name] = Command(name, handler, args, rest, public, usage, mutates)
+        return handler
+    return register
+
+def cached_reply(name, render):
+    """The reply rendered by render(), re-rendered only after the settings change"""
+    with _reply_lock:
+        if name in _reply_cache:
+            return _reply_cache[name]
+        generation = _reply_generation
+    reply = render()
+    with _reply_lock:
+        if generation == _reply_generation:
+            _reply_cache[name] = reply
+    return reply
+
+def invalidate_replies():
+    """Drop the cached replies; called whenever the settings are saved"""
+    global _reply_generation
+    with _reply_lock:
+        _reply_cache.clear()
+        _reply_generation += 1
 
 def is_admin(user_id):
     """Check if user is admin"""
@@ -525,41 +2612,102 @@ def is_admin(user_id):
         return True
     return user_id in ADMIN_USER_IDS
 
+def parse_alert(args):
+    """(symbol, direction, value, is_percent) from "BTC > 70000" or "ETH -5%"; ValueError if malformed"""
+    match = ALERT_LEVEL_RE.match(args)
+    if match:
+        return match.group(1), match.group(2), float(match.group(3).replace(",", "")), False
+    match = ALERT_PERCENT_RE.match(args)
+    if match and float(match.group(2)) != 0:
+        percent = float(match.group(2))
+        return match.group(1), ">" if percent > 0 else "<", percent, True
+    raise ValueError(f"bad alert: {args}")
+
+def parse_alert_ids(args):
+    """Alert ids from "3", "3 5" or "#3"; None for "all"; ValueError if malformed"""
+    if args.lower() == "all":
+        return None
+    alert_ids = {int(part.lstrip("#")) for part in args.split()}
+    if not alert_ids:
+        raise ValueError("no alert ids")
+    return alert_ids
+
+def format_alert_line(alert):
+    state = "armed" if alert["armed"] else "fired, re-arms once the price moves back"
+    spec = f" ({alert['spec']})" if alert["spec"] else ""
+    return f"#{alert['id']} {alert['symbol'].upper()} {alert['direction']} {format_coin_price(alert['threshold'])}{spec} - {state}"
+
+def parse_interval(value):
+    """Seconds from "30s", "5m" or a bare number of minutes; ValueError if malformed"""
+    value = value.lower()
+    if value.endswith('s'):
+        return int(value[:-1])
+    if value.endswith('m'):
+        return int(value[:-1]) * 60
+    return int(value) * 60
+
+def parse_interval_unit(value):
+    """(amount, "s" or "m") from "30s", "5m" or a bare number of minutes; ValueError if malformed"""
+    value = value.lower()
+    if value.endswith('s'):
+        return int(value[:-1]), "s"
+    if value.endswith('m'):
+        return int(value[:-1]), "m"
+    return int(value), "m"
+
+def parse_btc_interval(value):
+    """Seconds like parse_interval, or 0 for off"""
+    return 0 if value.lower() == "off" else parse_interval(value)
+
 def handle_command(update):
-    """Handle bot commands"""
-    global bot_running, post_interval, crypto_count
-    
-    if "message" not in update:
-        return
-    
-    message = update["message"]
-    if "text" not in message:
+    """Parse a command once and hand it to its registered handler"""
+    message = update.get("message")
+    if not message or "text" not in message:
         return
     
     text = message["text"]
     chat_id = message["chat"]["id"]
-    user_id = message["from"]["id"]
-    username = message["from"].get("username", "Unknown")
     
     # Check if it's a command
     if not text.startswith("/"):
         return
     
-    command = text.split()[0].lower()
+    words = text.split()
+    name = words[0].lower()
+    command = COMMANDS.get(name)
     
     # Check admin access
-    if not is_admin(user_id):
+    if not (command and command.public) and not is_admin(message["from"]["id"]):
         send_message_to_user(chat_id, "❌ You are not authorized to use admin commands.")
         return
+    if command is None:
+        send_message_to_user(chat_id, f"❌ Unknown command: {name}\nUse /help to see available commands.")
+        return
     
-    # Handle commands
-    if command == "/start":
-        channels_list = "\n".join([f"  • {ch}" for ch in CHANNELS]) if CHANNELS else "  No channels"
-        minutes = post_interval // 60
-        seconds = post_interval % 60
-        interval_display = f"{minutes} min {seconds} sec" if seconds > 0 else f"{minutes} minute(s)"
-        
-        help_text = f"""
+    try:
+        arguments = command.parse(words, text)
+    except ValueError:
+        send_message_to_user(chat_id, command.usage)
+        return
+    
+    # The lock only covers the settings change; the reply is sent after it is released
+    started = time.monotonic()
+    if command.mutates:
+        with _settings_lock:
+            reply = command.handler(chat_id, message, **arguments)
+    else:
+        reply = command.handler(chat_id, message, **arguments)
+    if reply:
+        send_message_to_user(chat_id, reply)
+    observe_histogram("bot_command_duration_seconds", (("command", name),), time.monotonic() - started)
+
+def render_start_reply():
+    channels_list = "\n".join([f"  • {ch}" for ch in CHANNELS]) if CHANNELS else "  No channels"
+    minutes = post_interval // 60
+    seconds = post_interval % 60
+    interval_display = f"{minutes} min {seconds} sec" if seconds > 0 else f"{minutes} minute(s)"
+    
+    return f"""
 🤖 <b>BTC PRICE BOT - ADMIN PANEL</b>
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
@@ -574,14 +2722,26 @@ def handle_command(update):
 
 <b>Price & Testing:</b>
 /price - Get current BTC price
+/price bdt - BTC price in another currency
 /test - Send test message to all channels
 
+<b>Price Alerts:</b>
+/alert BTC > 70000 - Notify me when BTC rises above $70,000
+/alert ETH -5% - Notify me when ETH falls 5% from now
+/alerts - List your alerts
+/delalert 3 - Delete alert #3 (/delalert all deletes all)
+
 <b>Channel Management:</b>
 /addchannel @name - Add a channel
   Example: /addchannel @cryptopricebd1
 /removechannel @name - Remove a channel
   Example: /removechannel @cryptopricebd1
 /channels - List all channels
+/channelset @name coins 10 - Per-channel coin count
+/channelset @name interval 5m - Per-channel interval
+/channelset @name template compact - Per-channel template (full, compact)
+/channelset @name currency bdt - Per-channel currency (usd, bdt, eur, ...)
+/channelset @name reset - Back to the global settings
 
 <b>Settings:</b>
 /interval 5m - Set posting interval (minutes)
@@ -591,8 +2751,12 @@ def handle_command(update):
 /interval - Show current interval
 /coins 25 - Set number of coins to post
   Example: /coins 25 (post top 25 coins)
-  Range: 1-100 coins
+  Range: 1-{MAX_COIN_COUNT} coins
 /coins - Show current coin count
+/btcinterval 15m - Also post a BTC price card every 15 minutes
+/btcinterval off - Stop the BTC price card
+/editmode on - Edit one message per channel instead of posting new ones
+/editmode off - Post a new message every time
 
 <b>Information:</b>
 /info - Get bot information
@@ -605,6 +2769,8 @@ def handle_command(update):
 
 Posting Interval: {interval_display} ({post_interval} seconds)
 Coin Count: {crypto_count} coins
+BTC Price Post: {f'{btc_post_interval} seconds' if btc_post_interval else 'Off'}
+Posting Mode: {'Edit in place ✏️' if edit_in_place else 'New message 📨'}
 Bot Status: {'Running ✅' if bot_running else 'Stopped ⏸️'}
 Channels ({len(CHANNELS)}):
 {channels_list}
@@ -617,17 +2783,17 @@ Channels ({len(CHANNELS)}):
 • Bot posts to all channels simultaneously
 • Minimum interval: 10 seconds
 • Maximum interval: 24 hours
+• Posts line up with interval boundaries (5m posts at :00, :05, ...)
 
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 """
-        send_message_to_user(chat_id, help_text)
-        
-    elif command == "/help":
-        minutes = post_interval // 60
-        seconds = post_interval % 60
-        interval_display = f"{minutes} min {seconds} sec" if seconds > 0 else f"{minutes} minute(s)"
-        
-        help_text = f"""
+
+def render_help_reply():
+    minutes = post_interval // 60
+    seconds = post_interval % 60
+    interval_display = f"{minutes} min {seconds} sec" if seconds > 0 else f"{minutes} minute(s)"
+    
+    return f"""
 📋 <b>BTC PRICE BOT - COMMAND LIST</b>
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
@@ -640,27 +2806,43 @@ Channels ({len(CHANNELS)}):
 
 <b>💰 Price & Testing:</b>
 /price - Get current BTC price
+/price bdt - BTC price in BDT (or usd, eur, ...)
 /test - Send test message to all channels
 
+<b>🔔 Price Alerts:</b>
+/alert BTC > 70000 - Alert above a price (USD)
+/alert BTC < 60000 - Alert below a price (USD)
+/alert ETH -5% - Alert on a 5% move from now
+/alerts - List your alerts
+/delalert 3 - Delete an alert
+
 <b>📢 Channel Management:</b>
 /addchannel @name - Add a channel
   Example: /addchannel @cryptopricebd1
 /removechannel @name - Remove a channel
   Example: /removechannel @cryptopricebd1
 /channels - List all channels
+/channelset @name - Per-channel coins, interval, template and currency
 
 <b>⏱️ Interval Settings:</b>
 /interval 5m - Set to 5 minutes
 /interval 30s - Set to 30 seconds
 /interval 90s - Set to 90 seconds
 /interval - Show current interval
+/btcinterval 15m - BTC price card every 15 minutes
+/btcinterval off - Turn the BTC price card off
 
 <b>🪙 Coin Settings:</b>
-/coins 25 - Set number of coins (1-100)
+/coins 25 - Set number of coins (1-{MAX_COIN_COUNT})
 /coins 10 - Post top 10 coins
 /coins 50 - Post top 50 coins
 /coins - Show current count
 
+<b>✏️ Posting Mode:</b>
+/editmode on - Keep one message per channel up to date
+/editmode off - Post a new message every time
+/editmode - Show current mode
+
 <b>ℹ️ Information:</b>
 /info - Bot information
 /getmyid - Get your User ID
@@ -670,72 +2852,184 @@ Channels ({len(CHANNELS)}):
 
 <b>Current Interval:</b> {interval_display} ({post_interval}s)
 <b>Coin Count:</b> {crypto_count} coins
+<b>Posting Mode:</b> {'Edit in place' if edit_in_place else 'New message'}
 <b>Channels:</b> {len(CHANNELS)} channel(s)
 <b>Bot Status:</b> {'Running ✅' if bot_running else 'Stopped ⏸️'}
 
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 """
-        send_message_to_user(chat_id, help_text)
-        
-    elif command == "/status":
-        bot_info = get_bot_info()
-        channel_info = get_channel_info()
-        member_status = get_bot_member_status()
-        
-        status_text = "📊 <b>Bot Status</b>\n\n"
-        
-        if bot_info:
-            status_text += f"Bot: @{bot_info.get('username', 'Unknown')}\n"
-            status_text += f"Name: {bot_info.get('first_name', 'Unknown')}\n\n"
-        
-        channels_list = ", ".join(CHANNELS) if CHANNELS else "No channels"
-        status_text += f"Channels ({len(CHANNELS)}): {channels_list}\n\n"
-        
-        if member_status:
-            status = member_status.get("status", "unknown")
-            status_text += f"Bot Status: {status}\n"
-            if status == "administrator":
-                can_post = member_status.get("can_post_messages", False)
-                status_text += f"Can Post: {'Yes ✅' if can_post else 'No ❌'}\n"
-        
-        status_text += f"\nBot Running: {'Yes ✅' if bot_running else 'No ⏸️'}"
-        minutes = post_interval // 60
-        seconds = post_interval % 60
-        if seconds > 0:
-            status_text += f"\nPosting Interval: {minutes} min {seconds} sec ({post_interval}s)"
-        else:
-            status_text += f"\nPosting Interval: {minutes} minute(s) ({post_interval}s)"
-        status_text += f"\nCoin Count: {crypto_count} coins"
-        send_message_to_user(chat_id, status_text)
-        
-    elif command == "/price":
-        price, change_24h = get_btc_price()
-        if price:
-            if change_24h:
-                if change_24h > 0:
-                    emoji = "📈"
-                    change_text = f"+{change_24h:.2f}%"
-                else:
-                    emoji = "📉"
-                    change_text = f"{change_24h:.2f}%"
+
+def render_current_reply():
+    channels_list = "\n".join([f"• {ch}" for ch in CHANNELS]) if CHANNELS else "No channels"
+    minutes = post_interval // 60
+    seconds = post_interval % 60
+    interval_display = f"{minutes} min {seconds} sec" if seconds > 0 else f"{minutes} minute(s)"
+    return f"""
+⚙️ <b>Current Bot Settings</b>
+
+Posting Interval: {interval_display} ({post_interval} seconds)
+Coin Count: {crypto_count} coins
+BTC Price Post: {f'{btc_post_interval} seconds' if btc_post_interval else 'Off'}
+Posting Mode: {'Edit in place ✏️' if edit_in_place else 'New message 📨'}
+Bot Status: {'Running ✅' if bot_running else 'Stopped ⏸️'}
+Channels ({len(CHANNELS)}):
+{channels_list}
+
+<b>Commands:</b>
+/interval 5m - Set interval to 5 minutes
+/interval 30s - Set interval to 30 seconds
+/coins 25 - Set coin count (1-{MAX_COIN_COUNT})
+/editmode on - Edit one message per channel
+/addchannel @name - Add channel
+/removechannel @name - Remove channel
+/channels - List all channels
+/stop - Stop posting
+/startpost - Resume posting
+"""
+
+@bot_command("/start")
+def start_command(chat_id, message):
+    return cached_reply("/start", render_start_reply)
+
+@bot_command("/help")
+def help_command(chat_id, message):
+    return cached_reply("/help", render_help_reply)
+
+@bot_command("/current")
+def current_command(chat_id, message):
+    return cached_reply("/current", render_current_reply)
+
+@bot_command("/status")
+def status_command(chat_id, message):
+    bot_info = get_bot_info()
+    channel_info = get_channel_info()
+    member_status = get_bot_member_status()
+    
+    status_text = "📊 <b>Bot Status</b>\n\n"
+    
+    if bot_info:
+        status_text += f"Bot: @{bot_info.get('username', 'Unknown')}\n"
+        status_text += f"Name: {bot_info.get('first_name', 'Unknown')}\n\n"
+    
+    channels_list = ", ".join(CHANNELS) if CHANNELS else "No channels"
+    status_text += f"Channels ({len(CHANNELS)}): {channels_list}\n\n"
+    
+    if member_status:
+        status = member_status.get("status", "unknown")
+        status_text += f"Bot Status: {status}\n"
+        if status == "administrator":
+            can_post = member_status.get("can_post_messages", False)
+            status_text += f"Can Post: {'Yes ✅' if can_post else 'No ❌'}\n"
+    
+    status_text += f"\nBot Running: {'Yes ✅' if bot_running else 'No ⏸️'}"
+    minutes = post_interval // 60
+    seconds = post_interval % 60
+    if seconds > 0:
+        status_text += f"\nPosting Interval: {minutes} min {seconds} sec ({post_interval}s)"
+    else:
+        status_text += f"\nPosting Interval: {minutes} minute(s) ({post_interval}s)"
+    status_text += f"\nCoin Count: {crypto_count} coins"
+    status_text += "\n\n<b>Circuit Breakers:</b>"
+    for breaker in (coingecko_breaker, coincap_breaker, coinpaprika_breaker, telegram_breaker):
+        status_text += f"\n{breaker.name}: {breaker.describe()}"
+    status_text += f"\nPrice Alerts: {len(price_alerts)}"
+    status_text += f"\nOutbox: {outbox_pending_count()} pending"
+    if delivery_workers is not None:
+        status_text += f"\nDelivery Workers: {delivery_workers.describe()}"
+    if STREAM_URL:
+        status_text += f"\nPrice Stream: {'connected ✅' if price_stream_connected else 'disconnected ❌'} ({len(live_prices)} coins)"
+    status_text += "\n\n<b>Market Providers:</b>"
+    for name in MARKET_PROVIDERS:
+        status_text += f"\n{name}: hedge after {market_providers[name].hedge_delay():.2f}s"
+    http_summary = format_http_stats()
+    if http_summary:
+        status_text += f"\n\n<b>API Latency:</b>\n{http_summary}"
+    return status_text
+
+@bot_command("/price", args=(("currency", str, "usd"),))
+def price_command(chat_id, message, currency):
+    # /price or /price bdt - USD price converted with the cached exchange rates
+    rate = get_fx_rate(currency.lower(), wait=True)
+    price, change_24h = get_btc_price() if rate else (None, None)
+    if rate is None:
+        return f"❌ Unknown currency: {currency}\nExamples: /price, /price bdt, /price eur"
+    elif price:
+        if change_24h:
+            if change_24h > 0:
+                emoji = "📈"
+                change_text = f"+{change_24h:.2f}%"
             else:
-                emoji = "➡️"
-                change_text = "N/A"
-            
-            price_text = f"""
+                emoji = "📉"
+                change_text = f"{change_24h:.2f}%"
+        else:
+            emoji = "➡️"
+            change_text = "N/A"
+    
+        price_text = f"""
 💰 <b>Current BTC Price</b>
 
-Price: <b>${price:,.2f}</b>
+Price: <b>{rate[1]}{price * rate[0]:,.2f}</b>
 24h Change: {change_text} {emoji}
 
 Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 """
-            send_message_to_user(chat_id, price_text)
-        else:
-            send_message_to_user(chat_id, "❌ Could not fetch BTC price")
-            
-    elif command == "/test":
-        test_message = f"""
+        return price_text
+    else:
+        return "❌ Could not fetch BTC price"
+
+@bot_command("/alert", rest=("alert", parse_alert), public=True, usage=(
+    "<b>Usage:</b>\n/alert BTC > 70000 - when BTC rises above $70,000\n"
+    "/alert BTC < 60000 - when BTC falls below $60,000\n"
+    "/alert ETH -5% - when ETH falls 5% from the current price\n"
+    "/alert ETH +10% - when ETH rises 10% from the current price"))
+def alert_command(chat_id, message, alert):
+    # /alert BTC > 70000 | /alert BTC < 60000 | /alert ETH -5% (USD prices)
+    symbol, direction, value, is_percent = alert
+    crypto = find_coin_by_symbol(get_market_snapshot("usd", crypto_count), symbol)
+    if crypto is None:
+        return f"❌ {symbol.upper()} is not among the top {crypto_count} coins the bot tracks"
+    price = apply_live_prices([crypto])[0].get("current_price")
+    if is_percent:
+        if not price:
+            return f"❌ No current price for {symbol.upper()}, try again later"
+        threshold = price * (1 + value / 100)
+        spec = f"{value:+g}% from {format_coin_price(price)}"
+    else:
+        threshold = value
+        spec = ""
+    if threshold <= 0:
+        return "❌ The alert price must be above zero"
+    
+    alert = add_price_alert(chat_id, crypto["id"], crypto.get("symbol", symbol), direction, threshold, spec)
+    if alert is None:
+        return f"❌ You already have {ALERT_MAX_PER_CHAT} alerts. Delete some with /delalert"
+    now_text = f"\nNow: {format_coin_price(price)}" if price else ""
+    return f"✅ Alert #{alert['id']} set\n\n{format_alert_line(alert)}{now_text}"
+
+@bot_command("/alerts", public=True)
+def alerts_command(chat_id, message):
+    alerts = chat_price_alerts(chat_id)
+    if alerts:
+        alerts_list = "\n".join(format_alert_line(alert) for alert in alerts)
+        return f"🔔 <b>Your Alerts ({len(alerts)}):</b>\n{alerts_list}\n\n/delalert 3 - Delete alert #3\n/delalert all - Delete all"
+    else:
+        return "🔔 You have no alerts.\n\nExamples:\n/alert BTC > 70000\n/alert ETH -5%"
+
+@bot_command("/delalert", rest=("alert_ids", parse_alert_ids), public=True, usage=(
+    "<b>Usage:</b>\n/delalert 3 - Delete alert #3\n/delalert all - Delete all your alerts\n/alerts - List your alerts"))
+def delalert_command(chat_id, message, alert_ids):
+    # /delalert 3 | /delalert 3 5 | /delalert all
+    count = remove_price_alerts(chat_id, alert_ids)
+    if alert_ids is None:
+        return f"✅ Deleted {count} alert(s)"
+    elif count:
+        return f"✅ Deleted alert(s): {', '.join(f'#{alert_id}' for alert_id in sorted(alert_ids))}"
+    else:
+        return "❌ No such alert. Use /alerts to list yours"
+
+@bot_command("/test")
+def test_command(chat_id, message):
+    test_message = f"""
 🧪 <b>Test Message</b>
 
 This is a test message from BTC Price Bot Admin Panel.
@@ -744,192 +3038,250 @@ This is a test message from BTC Price Bot Admin Panel.
 
 If you see this message, the bot is working correctly!
 """
-        if send_message_to_channel(test_message.strip()):
-            send_message_to_user(chat_id, "✅ Test message sent to channel!")
+    if send_message_to_channel(test_message.strip()):
+        return "✅ Test message sent to channel!"
+    else:
+        return "❌ Failed to send test message"
+
+@bot_command("/stop", mutates=True)
+def stop_command(chat_id, message):
+    global bot_running
+    bot_running = False
+    save_bot_settings()
+    return "⏸️ Price posting stopped. Bot is still running. Use /startpost to resume."
+
+@bot_command("/startpost", mutates=True)
+def startpost_command(chat_id, message):
+    global bot_running
+    bot_running = True
+    save_bot_settings()
+    return f"▶️ Price posting resumed!\nInterval: {post_interval // 60} minute(s)"
+
+@bot_command("/interval", args=(("interval", parse_interval_unit, None),), usage=(
+    "❌ Invalid interval format.\n\nExamples:\n/interval 5 - 5 minutes\n/interval 5m - 5 minutes\n"
+    "/interval 30s - 30 seconds\n/interval 90s - 90 seconds"), mutates=True)
+def interval_command(chat_id, message, interval):
+    # /interval 5 or /interval 5m (5 minutes), /interval 30s (30 seconds)
+    global post_interval
+    if interval is None:
+        # Show current interval in both minutes and seconds
+        minutes = post_interval // 60
+        seconds = post_interval % 60
+        if seconds > 0:
+            interval_display = f"{minutes} minute(s) {seconds} second(s) ({post_interval} seconds)"
         else:
-            send_message_to_user(chat_id, "❌ Failed to send test message")
-            
-    elif command == "/stop":
-        bot_running = False
-        send_message_to_user(chat_id, "⏸️ Price posting stopped. Bot is still running. Use /startpost to resume.")
-        
-    elif command == "/startpost":
-        bot_running = True
-        send_message_to_user(chat_id, f"▶️ Price posting resumed!\nInterval: {post_interval // 60} minute(s)")
-        
-    elif command == "/interval":
-        # Get interval from command: /interval 5 (for 5 minutes) or /interval 30s (for 30 seconds)
-        parts = text.split()
-        if len(parts) > 1:
-            try:
-                interval_str = parts[1].lower()
-                
-                # Check if it's seconds (ends with 's')
-                if interval_str.endswith('s'):
-                    seconds = int(interval_str[:-1])
-                    if seconds < 10:
-                        send_message_to_user(chat_id, "❌ Interval must be at least 10 seconds")
-                    elif seconds > 86400:  # Max 24 hours
-                        send_message_to_user(chat_id, "❌ Interval cannot be more than 86400 seconds (24 hours)")
-                    else:
-                        post_interval = seconds
-                        if seconds < 60:
-                            send_message_to_user(chat_id, f"✅ Posting interval set to {seconds} second(s)\nBot will post every {seconds} second(s)")
-                        else:
-                            minutes = seconds // 60
-                            remaining_seconds = seconds % 60
-                            if remaining_seconds > 0:
-                                send_message_to_user(chat_id, f"✅ Posting interval set to {minutes} minute(s) {remaining_seconds} second(s) ({seconds} seconds)\nBot will post every {seconds} second(s)")
-                            else:
-                                send_message_to_user(chat_id, f"✅ Posting interval set to {minutes} minute(s) ({seconds} seconds)\nBot will post every {minutes} minute(s)")
-                # Check if it's minutes (ends with 'm' or just a number)
-                elif interval_str.endswith('m'):
-                    minutes = int(interval_str[:-1])
-                    if minutes < 1:
-                        send_message_to_user(chat_id, "❌ Interval must be at least 1 minute")
-                    elif minutes > 1440:  # Max 24 hours
-                        send_message_to_user(chat_id, "❌ Interval cannot be more than 1440 minutes (24 hours)")
-                    else:
-                        post_interval = minutes * 60
-                        send_message_to_user(chat_id, f"✅ Posting interval set to {minutes} minute(s)\nBot will post every {minutes} minute(s)")
-                # Default: treat as minutes if just a number
-                else:
-                    minutes = int(interval_str)
-                    if minutes < 1:
-                        send_message_to_user(chat_id, "❌ Interval must be at least 1 minute")
-                    elif minutes > 1440:  # Max 24 hours
-                        send_message_to_user(chat_id, "❌ Interval cannot be more than 1440 minutes (24 hours)")
-                    else:
-                        post_interval = minutes * 60
-                        send_message_to_user(chat_id, f"✅ Posting interval set to {minutes} minute(s)\nBot will post every {minutes} minute(s)")
-            except ValueError:
-                send_message_to_user(chat_id, "❌ Invalid interval format.\n\nExamples:\n/interval 5 - 5 minutes\n/interval 5m - 5 minutes\n/interval 30s - 30 seconds\n/interval 90s - 90 seconds")
+            interval_display = f"{minutes} minute(s) ({post_interval} seconds)"
+    
+        return f"📊 <b>Current Interval:</b> {interval_display}\n\n<b>To change:</b>\n/interval 5 - 5 minutes\n/interval 5m - 5 minutes\n/interval 30s - 30 seconds\n/interval 90s - 90 seconds"
+    
+    amount, unit = interval
+    if unit == "s":
+        seconds = amount
+        if seconds < 10:
+            return "❌ Interval must be at least 10 seconds"
+        elif seconds > 86400:  # Max 24 hours
+            return "❌ Interval cannot be more than 86400 seconds (24 hours)"
         else:
-            # Show current interval in both minutes and seconds
-            minutes = post_interval // 60
-            seconds = post_interval % 60
-            if seconds > 0:
-                interval_display = f"{minutes} minute(s) {seconds} second(s) ({post_interval} seconds)"
+            post_interval = seconds
+            save_bot_settings()
+            reschedule_posts()
+            if seconds < 60:
+                return f"✅ Posting interval set to {seconds} second(s)\nBot will post every {seconds} second(s)"
             else:
-                interval_display = f"{minutes} minute(s) ({post_interval} seconds)"
-            
-            send_message_to_user(chat_id, f"📊 <b>Current Interval:</b> {interval_display}\n\n<b>To change:</b>\n/interval 5 - 5 minutes\n/interval 5m - 5 minutes\n/interval 30s - 30 seconds\n/interval 90s - 90 seconds")
-            
-    elif command == "/coins":
-        # Get coin count from command: /coins 25
-        parts = text.split()
-        if len(parts) > 1:
-            try:
-                count = int(parts[1])
-                if count < 1:
-                    send_message_to_user(chat_id, "❌ Coin count must be at least 1")
-                elif count > 100:
-                    send_message_to_user(chat_id, "❌ Coin count cannot be more than 100")
+                minutes = seconds // 60
+                remaining_seconds = seconds % 60
+                if remaining_seconds > 0:
+                    return f"✅ Posting interval set to {minutes} minute(s) {remaining_seconds} second(s) ({seconds} seconds)\nBot will post every {seconds} second(s)"
                 else:
-                    crypto_count = count
-                    send_message_to_user(chat_id, f"✅ Coin count set to {count}\nBot will now post top {count} cryptocurrency prices")
-            except ValueError:
-                send_message_to_user(chat_id, "❌ Invalid number format.\n\nExamples:\n/coins 25 - Post top 25 coins\n/coins 10 - Post top 10 coins\n/coins 50 - Post top 50 coins")
+                    return f"✅ Posting interval set to {minutes} minute(s) ({seconds} seconds)\nBot will post every {minutes} minute(s)"
+    else:
+        minutes = amount
+        if minutes < 1:
+            return "❌ Interval must be at least 1 minute"
+        elif minutes > 1440:  # Max 24 hours
+            return "❌ Interval cannot be more than 1440 minutes (24 hours)"
         else:
-            send_message_to_user(chat_id, f"📊 <b>Current Coin Count:</b> {crypto_count} coins\n\n<b>To change:</b>\n/coins 10 - Post top 10 coins\n/coins 25 - Post top 25 coins\n/coins 50 - Post top 50 coins\n\n<b>Range:</b> 1-100 coins")
-            
-    elif command == "/addchannel":
-        # Add channel: /addchannel @channelname
-        parts = text.split()
-        if len(parts) > 1:
-            new_channel = parts[1].strip()
-            
-            # Validate channel format
-            if not (new_channel.startswith("@") or new_channel.startswith("-")):
-                send_message_to_user(chat_id, "❌ Invalid channel format.\n\nUse: /addchannel @channelname\nExample: /addchannel @cryptopricebd1")
-                return
-            
-            import telegram_btc_bot as bot_module
-            channels = bot_module.CHANNELS.copy()
-            
-            # Check if already exists
-            if new_channel in channels:
-                send_message_to_user(chat_id, f"⚠️ Channel {new_channel} is already in the list!")
-                return
-            
-            # Test if bot can access the channel
-            try:
-                url = f"{TELEGRAM_API}/getChat"
-                payload = {"chat_id": new_channel}
-                response = requests.post(url, json=payload, timeout=10)
-                result = response.json()
-                
-                if result.get("ok"):
-                    # Add channel
-                    bot_module.CHANNELS.append(new_channel)
-                    channel_info = result["result"]
-                    channel_title = channel_info.get("title", "Unknown")
-                    
-                    channels_list = "\n".join([f"• {ch}" for ch in bot_module.CHANNELS])
-                    send_message_to_user(chat_id, f"✅ Channel added successfully!\n\n<b>New Channel:</b> {new_channel}\n<b>Title:</b> {channel_title}\n\n<b>All Channels ({len(bot_module.CHANNELS)}):</b>\n{channels_list}")
-                else:
-                    error_desc = result.get("description", "Unknown error")
-                    send_message_to_user(chat_id, f"❌ Cannot access channel: {error_desc}\n\nPlease make sure:\n1. Bot is added to the channel\n2. Bot is an administrator\n3. Channel username is correct")
-            except Exception as e:
-                send_message_to_user(chat_id, f"❌ Error adding channel: {e}\n\nPlease check the channel username and try again.")
+            post_interval = minutes * 60
+            save_bot_settings()
+            reschedule_posts()
+            return f"✅ Posting interval set to {minutes} minute(s)\nBot will post every {minutes} minute(s)"
+
+@bot_command("/btcinterval", args=(("seconds", parse_btc_interval, None),), usage=(
+    "❌ Invalid interval format.\n\nExamples:\n/btcinterval 15m - every 15 minutes\n"
+    "/btcinterval 30s - every 30 seconds\n/btcinterval off - turn off"), mutates=True)
+def btcinterval_command(chat_id, message, seconds):
+    # Standalone BTC price post: /btcinterval 15m | /btcinterval 30s | /btcinterval off
+    global btc_post_interval
+    if seconds is None:
+        current = f"{btc_post_interval} seconds" if btc_post_interval else "Off"
+        return f"📊 <b>BTC Price Post:</b> {current}\n\n<b>To change:</b>\n/btcinterval 15m - every 15 minutes\n/btcinterval 30s - every 30 seconds\n/btcinterval off - turn off"
+    elif seconds and seconds < 10:
+        return "❌ Interval must be at least 10 seconds"
+    elif seconds > 86400:
+        return "❌ Interval cannot be more than 86400 seconds (24 hours)"
+    else:
+        btc_post_interval = seconds
+        save_bot_settings()
+        reschedule_posts()
+        if seconds:
+            return f"✅ BTC price post interval set to {seconds} seconds\nPosts line up with {seconds}s boundaries"
         else:
-            import telegram_btc_bot as bot_module
-            channels_list = "\n".join([f"• {ch}" for ch in bot_module.CHANNELS]) if bot_module.CHANNELS else "No channels"
-            send_message_to_user(chat_id, f"📊 <b>Current Channels ({len(bot_module.CHANNELS)}):</b>\n{channels_list}\n\n<b>To add:</b>\n/addchannel @channelname\nExample: /addchannel @cryptopricebd1")
-            
-    elif command == "/removechannel":
-        # Remove channel: /removechannel @channelname
-        parts = text.split()
-        if len(parts) > 1:
-            channel_to_remove = parts[1].strip()
-            
-            import telegram_btc_bot as bot_module
-            if channel_to_remove in bot_module.CHANNELS:
-                bot_module.CHANNELS.remove(channel_to_remove)
-                channels_list = "\n".join([f"• {ch}" for ch in bot_module.CHANNELS]) if bot_module.CHANNELS else "No channels"
-                send_message_to_user(chat_id, f"✅ Channel removed!\n\n<b>Remaining Channels ({len(bot_module.CHANNELS)}):</b>\n{channels_list}")
+            return "✅ BTC price post turned off"
+
+CHANNELSET_USAGE = ("<b>Usage:</b>\n/channelset @name - Show a channel's settings\n/channelset @name coins 10\n"
+                    "/channelset @name interval 5m\n/channelset @name template compact\n/channelset @name currency bdt\n"
+                    "/channelset @name reset\n\n"
+                    f"<b>Templates:</b> {', '.join(MESSAGE_TEMPLATES)}")
+
+@bot_command("/channelset", args=(("channel", str, None), ("key", str.lower, None), ("value", str, None)), mutates=True)
+def channelset_command(chat_id, message, channel, key, value):
+    # Per-channel overrides: /channelset @name coins 10 | interval 5m | template compact | reset
+    if channel is None:
+        return CHANNELSET_USAGE
+    if channel not in CHANNELS:
+        return f"❌ Channel {channel} not found in the list!"
+    
+    if key == "reset" and value is None:
+        channel_settings.pop(channel, None)
+        save_bot_settings()
+        reschedule_posts()
+        return f"✅ {channel} now uses the global settings"
+    if value is not None:
+        overrides = dict(channel_settings.get(channel, {}))
+        try:
+            if key == "coins":
+                overrides["coins"] = int(value)
+                if not 1 <= overrides["coins"] <= MAX_COIN_COUNT:
+                    return f"❌ Coin count must be between 1 and {MAX_COIN_COUNT}"
+            elif key == "interval":
+                overrides["interval"] = parse_interval(value)
+                if not 10 <= overrides["interval"] <= 86400:
+                    return "❌ Interval must be between 10 seconds and 24 hours"
+            elif key == "template" and value.lower() in MESSAGE_TEMPLATES:
+                overrides["template"] = value.lower()
+            elif key == "currency":
+                if get_fx_rate(value.lower(), wait=True) is None:
+                    return f"❌ Unknown currency: {value}\nExamples: usd, bdt, eur, inr"
+                overrides["currency"] = value.lower()
             else:
-                send_message_to_user(chat_id, f"❌ Channel {channel_to_remove} not found in the list!")
+                return f"❌ Unknown setting.\n\n{CHANNELSET_USAGE}"
+        except ValueError:
+            return f"❌ Invalid value: {value}\n\n{CHANNELSET_USAGE}"
+        channel_settings[channel] = overrides
+        save_bot_settings()
+        reschedule_posts()
+    elif key is not None:
+        return CHANNELSET_USAGE
+    
+    coins, interval, template, currency = channel_plan(channel)
+    overridden = channel_settings.get(channel, {})
+    settings_text = "\n".join(
+        f"{label}: {value}{'' if key in overridden else ' (global)'}"
+        for key, label, value in (("coins", "Coin Count", f"{coins} coins"),
+                                  ("interval", "Posting Interval", f"{interval} seconds"),
+                                  ("template", "Template", template),
+                                  ("currency", "Currency", currency.upper())))
+    return f"📊 <b>Settings for {channel}:</b>\n\n{settings_text}"
+
+@bot_command("/coins", args=(("count", int, None),), usage=(
+    "❌ Invalid number format.\n\nExamples:\n/coins 25 - Post top 25 coins\n"
+    "/coins 10 - Post top 10 coins\n/coins 50 - Post top 50 coins"), mutates=True)
+def coins_command(chat_id, message, count):
+    # Get coin count from command: /coins 25
+    global crypto_count
+    if count is None:
+        return f"📊 <b>Current Coin Count:</b> {crypto_count} coins\n\n<b>To change:</b>\n/coins 10 - Post top 10 coins\n/coins 25 - Post top 25 coins\n/coins 50 - Post top 50 coins\n\n<b>Range:</b> 1-{MAX_COIN_COUNT} coins"
+    elif count < 1:
+        return "❌ Coin count must be at least 1"
+    elif count > MAX_COIN_COUNT:
+        return f"❌ Coin count cannot be more than {MAX_COIN_COUNT}"
+    else:
+        crypto_count = count
+        save_bot_settings()
+        return f"✅ Coin count set to {count}\nBot will now post top {count} cryptocurrency prices"
+
+@bot_command("/editmode", args=(("mode", str.lower, None),), mutates=True)
+def editmode_command(chat_id, message, mode):
+    # Toggle edit-in-place posting: /editmode on | /editmode off
+    global edit_in_place
+    if mode in ("on", "off"):
+        edit_in_place = mode == "on"
+        save_bot_settings()
+        if edit_in_place:
+            return "✅ Edit mode enabled\nBot will keep one price message per channel up to date"
         else:
-            import telegram_btc_bot as bot_module
-            channels_list = "\n".join([f"• {ch}" for ch in bot_module.CHANNELS]) if bot_module.CHANNELS else "No channels"
-            send_message_to_user(chat_id, f"📊 <b>Current Channels ({len(bot_module.CHANNELS)}):</b>\n{channels_list}\n\n<b>To remove:</b>\n/removechannel @channelname")
-            
-    elif command == "/channels":
-        # List all channels
-        channels_list = "\n".join([f"• {ch}" for ch in CHANNELS]) if CHANNELS else "No channels configured"
-        send_message_to_user(chat_id, f"📊 <b>All Channels ({len(CHANNELS)}):</b>\n{channels_list}\n\n<b>Commands:</b>\n/addchannel @name - Add channel\n/removechannel @name - Remove channel")
-            
-    elif command == "/current":
+            return "✅ Edit mode disabled\nBot will post a new price message every time"
+    else:
+        mode = "Edit in place ✏️" if edit_in_place else "New message 📨"
+        return f"📊 <b>Current Posting Mode:</b> {mode}\n\n<b>To change:</b>\n/editmode on - Edit one message per channel\n/editmode off - Post a new message every time"
+
+@bot_command("/addchannel", args=(("new_channel", str, None),), mutates=True)
+def addchannel_command(chat_id, message, new_channel):
+    # Add channel: /addchannel @channelname
+    if new_channel is None:
         channels_list = "\n".join([f"• {ch}" for ch in CHANNELS]) if CHANNELS else "No channels"
-        minutes = post_interval // 60
-        seconds = post_interval % 60
-        interval_display = f"{minutes} min {seconds} sec" if seconds > 0 else f"{minutes} minute(s)"
-        status_text = f"""
-⚙️ <b>Current Bot Settings</b>
+        return f"📊 <b>Current Channels ({len(CHANNELS)}):</b>\n{channels_list}\n\n<b>To add:</b>\n/addchannel @channelname\nExample: /addchannel @cryptopricebd1"
+    
+    # Validate channel format
+    if not (new_channel.startswith("@") or new_channel.startswith("-")):
+        return "❌ Invalid channel format.\n\nUse: /addchannel @channelname\nExample: /addchannel @cryptopricebd1"
+    
+    # Check if already exists
+    if new_channel in CHANNELS:
+        return f"⚠️ Channel {new_channel} is already in the list!"
+    
+    # Test if bot can access the channel
+    try:
+        channel_info, error_desc = get_chat(new_channel)
+    
+        if channel_info:
+            # Add channel
+            CHANNELS.append(new_channel)
+            save_bot_settings()
+            reschedule_posts()
+            rebalance_delivery_shards()
+            channel_title = channel_info.get("title", "Unknown")
+    
+            channels_list = "\n".join([f"• {ch}" for ch in CHANNELS])
+            return f"✅ Channel added successfully!\n\n<b>New Channel:</b> {new_channel}\n<b>Title:</b> {channel_title}\n\n<b>All Channels ({len(CHANNELS)}):</b>\n{channels_list}"
+        else:
+            return f"❌ Cannot access channel: {error_desc}\n\nPlease make sure:\n1. Bot is added to the channel\n2. Bot is an administrator\n3. Channel username is correct"
+    except Exception as e:
+        return f"❌ Error adding channel: {e}\n\nPlease check the channel username and try again."
 
-Posting Interval: {interval_display} ({post_interval} seconds)
-Coin Count: {crypto_count} coins
-Bot Status: {'Running ✅' if bot_running else 'Stopped ⏸️'}
-Channels ({len(CHANNELS)}):
-{channels_list}
+@bot_command("/removechannel", args=(("channel_to_remove", str, None),), mutates=True)
+def removechannel_command(chat_id, message, channel_to_remove):
+    # Remove channel: /removechannel @channelname
+    if channel_to_remove is None:
+        channels_list = "\n".join([f"• {ch}" for ch in CHANNELS]) if CHANNELS else "No channels"
+        return f"📊 <b>Current Channels ({len(CHANNELS)}):</b>\n{channels_list}\n\n<b>To remove:</b>\n/removechannel @channelname"
+    elif channel_to_remove in CHANNELS:
+        CHANNELS.remove(channel_to_remove)
+        channel_settings.pop(channel_to_remove, None)
+        save_bot_settings()
+        reschedule_posts()
+        rebalance_delivery_shards()
+        outbox_discard_channel(channel_to_remove)
+        with _channel_posts_lock:
+            removed_post = channel_posts.pop(channel_to_remove, None)
+        if removed_post:
+            save_channel_posts()
+        channels_list = "\n".join([f"• {ch}" for ch in CHANNELS]) if CHANNELS else "No channels"
+        return f"✅ Channel removed!\n\n<b>Remaining Channels ({len(CHANNELS)}):</b>\n{channels_list}"
+    else:
+        return f"❌ Channel {channel_to_remove} not found in the list!"
 
-<b>Commands:</b>
-/interval 5m - Set interval to 5 minutes
-/interval 30s - Set interval to 30 seconds
-/coins 25 - Set coin count (1-100)
-/addchannel @name - Add channel
-/removechannel @name - Remove channel
-/channels - List all channels
-/stop - Stop posting
-/startpost - Resume posting
-"""
-        send_message_to_user(chat_id, status_text)
-        
-    elif command == "/info":
-        bot_info = get_bot_info()
-        if bot_info:
-            info_text = f"""
+@bot_command("/channels")
+def channels_command(chat_id, message):
+    # List all channels
+    channels_list = "\n".join([f"• {ch}" for ch in CHANNELS]) if CHANNELS else "No channels configured"
+    return f"📊 <b>All Channels ({len(CHANNELS)}):</b>\n{channels_list}\n\n<b>Commands:</b>\n/addchannel @name - Add channel\n/removechannel @name - Remove channel"
+
+@bot_command("/info")
+def info_command(chat_id, message):
+    bot_info = get_bot_info()
+    if bot_info:
+        info_text = f"""
 🤖 <b>Bot Information</b>
 
 Name: {bot_info.get('first_name', 'Unknown')}
@@ -938,12 +3290,15 @@ ID: {bot_info.get('id', 'Unknown')}
 Can Join Groups: {'Yes' if bot_info.get('can_join_groups', False) else 'No'}
 Can Read All Group Messages: {'Yes' if bot_info.get('can_read_all_group_messages', False) else 'No'}
 """
-            send_message_to_user(chat_id, info_text)
-        else:
-            send_message_to_user(chat_id, "❌ Could not get bot information")
-            
-    elif command == "/getmyid":
-        user_info = f"""
+        return info_text
+    else:
+        return "❌ Could not get bot information"
+
+@bot_command("/getmyid")
+def getmyid_command(chat_id, message):
+    user_id = message["from"]["id"]
+    username = message["from"].get("username", "Unknown")
+    user_info = f"""
 🆔 <b>Your User Information</b>
 
 User ID: <code>{user_id}</code>
@@ -957,119 +3312,952 @@ First Name: {message['from'].get('first_name', 'Unknown')}
 4. Change to: ADMIN_USER_IDS = [{user_id}]
 5. Restart the bot
 """
-        send_message_to_user(chat_id, user_info)
-    else:
-        send_message_to_user(chat_id, f"❌ Unknown command: {command}\nUse /help to see available commands.")
+    return user_info
 
-def run_bot():
-    """Main function to run the bot"""
-    global bot_running, last_update_id, post_interval, api_fail_count
-    
-    # Force immediate output
-    print("", flush=True)
-    print("=" * 50, flush=True)
-    print("BTC Price Bot Starting...", flush=True)
-    print("=" * 50, flush=True)
-    print("", flush=True)
-    
-    print(f"Channels: {len(CHANNELS)} channel(s)")
-    for ch in CHANNELS:
-        print(f"  • {ch}")
-    minutes = post_interval // 60
-    seconds = post_interval % 60
-    if seconds > 0:
-        print(f"Posting interval: {minutes} min {seconds} sec ({post_interval} seconds)")
-    else:
-        print(f"Posting interval: {minutes} minute(s) ({post_interval} seconds)")
-    print(f"Coin count: {crypto_count} coins")
-    if ADMIN_USER_IDS:
-        print(f"Admin Users: {len(ADMIN_USER_IDS)}")
-    else:
-        print("⚠️  WARNING: No admin users configured. All users can control the bot!")
-    print()
-    sys.stdout.flush()
-    
-    # Test bot access first
-    print("Testing bot access to channel...")
-    sys.stdout.flush()
-    if not test_bot_access():
-        print()
-        print("WARNING: Bot may not have access to the channel!")
-        print("Please ensure:")
-        print("1. Bot is added to channel as administrator")
-        print("2. Bot has 'Post Messages' permission enabled")
-        print("3. Check all channels are correct")
-        print()
-        print("Continuing anyway...")
-        print()
-    else:
-        print()
-    sys.stdout.flush()
+# ============================================================================
+# Outbox
+# ============================================================================
+
+_outbox_lock = threading.Lock()
+_outbox_in_flight = set()  # Channels with a delivery under way; newer messages to them wait in the outbox
+
+def purge_outbox_messages(message_ids):
+    """Delete those of message_ids no outbox row refers to any more (inside the caller's transaction)"""
+    if message_ids:
+        _state_db.execute(
+            "DELETE FROM outbox_messages WHERE id IN (SELECT value FROM json_each(?)) "
+            "AND NOT EXISTS (SELECT 1 FROM outbox WHERE outbox.message_id = outbox_messages.id)",
+            (json.dumps(list(message_ids)),))
+
+def outbox_enqueue(deliveries, edit=False, kind=None):
+    """Journal (message, channels) pairs before they are sent
     
-    print("Bot is running. Waiting for first post...")
-    print("Admin commands are enabled. Message the bot to control it.")
-    print("Press Ctrl+C to stop the bot.")
-    print("-" * 50)
-    print()
-    print("[INFO] API retry logic enabled (max 3 retries)")
-    print("[INFO] Cached price will be used if API fails")
-    print()
-    sys.stdout.flush()
+    Returns ({channel: row id} for the channels to send to now, channels
+    left to the outbox because an earlier message to them is pending).
+    """
+    if _state_db is None:
+        return {}, set()
+    now = time.time()
+    with _outbox_lock, _state_lock:
+        try:
+            with _state_db:
+                superseded = 0
+                if kind:
+                    # A newer price post of the same kind makes the pending one stale
+                    targets = [(channel, kind) for _, channels in deliveries for channel in channels]
+                    stale = {message_id for (message_id,) in _state_db.execute(
+                        "SELECT DISTINCT message_id FROM outbox WHERE kind = ? AND channel IN (SELECT value FROM json_each(?))",
+                        (kind, json.dumps([channel for channel, _ in targets])))}
+                    superseded = _state_db.executemany("DELETE FROM outbox WHERE channel = ? AND kind = ?", targets).rowcount
+                    purge_outbox_messages(stale)
+                pending = {channel for (channel,) in _state_db.execute("SELECT DISTINCT channel FROM outbox")}
+                last_id = _state_db.execute("SELECT COALESCE(MAX(id), 0) FROM outbox").fetchone()[0]
+                for message, targets in deliveries:
+                    if not targets:
+                        continue
+                    message_id = _state_db.execute("INSERT INTO outbox_messages (payload) VALUES (?)",
+                                                   (json.dumps({"message": message, "edit": edit}),)).lastrowid
+                    _state_db.executemany(
+                        "INSERT INTO outbox (channel, message_id, kind, next_attempt, expires_at) VALUES (?, ?, ?, ?, ?)",
+                        [(channel, message_id, kind, now, now + OUTBOX_MAX_AGE) for channel in targets])
+                row_ids = dict(_state_db.execute("SELECT channel, id FROM outbox WHERE id > ?", (last_id,)))
+        except sqlite3.Error as e:
+            log_error("Error saving outbox", error=str(e))
+            return {}, set()
+        queued = (pending | _outbox_in_flight) & row_ids.keys()
+        row_ids = {channel: row_id for channel, row_id in row_ids.items() if channel not in queued}
+        _outbox_in_flight.update(row_ids)
+    if superseded:
+        inc_counter("bot_outbox_total", (("result", "superseded"),), superseded)
+    return row_ids, queued
+
+def outbox_settle(row_ids, results):
+    """Drop delivered rows, schedule retries for failed ones and release their channels"""
+    if not row_ids:
+        return
+    now = time.time()
+    finished = []
+    retries = []
+    rejected = 0
+    for channel, error, parts_sent, retry_after in results:
+        row_id = row_ids.get(channel)
+        if row_id is None:
+            continue
+        if error is None or retry_after is None:
+            finished.append((row_id,))
+            rejected += error is not None
+        else:
+            retries.append((parts_sent, now, retry_after, OUTBOX_MAX_DELAY, OUTBOX_BASE_DELAY, row_id))
     
-    # Initialize last_update_id
-    updates = get_updates()
+    with _outbox_lock, _state_lock:
+        _outbox_in_flight.difference_update(row_ids)
+        try:
+            with _state_db:
+                delivered = {message_id for (message_id,) in _state_db.execute(
+                    "SELECT DISTINCT message_id FROM outbox WHERE id IN (SELECT value FROM json_each(?))",
+                    (json.dumps([row_id for (row_id,) in finished]),))}
+                _state_db.executemany("DELETE FROM outbox WHERE id = ?", finished)
+                purge_outbox_messages(delivered)
+                # Exponential back-off, or Telegram's retry_after when that is longer
+                _state_db.executemany(
+                    "UPDATE outbox SET parts_sent = parts_sent + ?, attempts = attempts + 1, "
+                    "next_attempt = ? + MAX(?, MIN(?, ? * (1 << MIN(attempts, 16)))) WHERE id = ?", retries)
+        except sqlite3.Error as e:
+            log_error("Error saving outbox", error=str(e))
+    if retries:
+        inc_counter("bot_outbox_total", (("result", "retry"),), len(retries))
+    if rejected:
+        inc_counter("bot_outbox_total", (("result", "rejected"),), rejected)
+
+def retry_outbox():
+    """Redeliver the due outbox rows, oldest first per channel; returns how many were delivered"""
+    if _state_db is None:
+        return 0
+    now = time.time()
+    with _outbox_lock, _state_lock:
+        try:
+            with _state_db:
+                expired = _state_db.execute("DELETE FROM outbox WHERE expires_at <= ?", (now,)).rowcount
+                if expired:
+                    _state_db.execute("DELETE FROM outbox_messages WHERE id NOT IN (SELECT message_id FROM outbox)")
+            # Only the oldest row of each channel is eligible, which keeps every chat in order
+            rows = _state_db.execute(
+                "SELECT outbox.id, channel, message_id, parts_sent, payload FROM outbox "
+                "JOIN outbox_messages ON outbox_messages.id = message_id "
+                "WHERE outbox.id IN (SELECT MIN(id) FROM outbox GROUP BY channel) AND next_attempt <= ?",
+                (now,)).fetchall()
+        except sqlite3.Error as e:
+            log_error("Error reading outbox", error=str(e))
+            return 0
+        rows = [row for row in rows if row[1] not in _outbox_in_flight]
+        _outbox_in_flight.update(row[1] for row in rows)
+    if expired:
+        inc_counter("bot_outbox_total", (("result", "expired"),), expired)
+        log_warning("Dropped stale outbox messages", count=expired)
+    if not rows:
+        return 0
     
-    last_price_post = 0
+    # Channels waiting for the same message (and part) go out together
+    posts = {}
+    groups = {}  # (edit, message id, parts sent) -> channels
+    for _, channel, message_id, parts_sent, payload in rows:
+        if message_id not in posts:
+            posts[message_id] = json.loads(payload)
+        groups.setdefault((posts[message_id]["edit"], message_id, parts_sent), []).append(channel)
+    row_ids = {channel: row_id for row_id, channel, _, _, _ in rows}
+    results = []
+    try:
+        for edit in (False, True):
+            deliveries = []
+            for (group_edit, message_id, parts_sent), channels in groups.items():
+                if group_edit != edit:
+                    continue
+                message = posts[message_id]["message"]
+                if parts_sent:
+                    message = split_message(message, max_length=4000)[parts_sent:]
+                deliveries.append((message, channels))
+            if deliveries:
+                results += dispatch_deliveries(deliveries, edit)
+    finally:
+        outbox_settle(row_ids, results)
     
-    while True:
+    delivered = sum(1 for _, error, _, _ in results if error is None)
+    for channel, error, _, _ in results:
+        inc_counter("bot_channel_sends_total", (("channel", channel), ("result", "failure" if error else "success")))
+    if delivered:
+        inc_counter("bot_outbox_total", (("result", "retried"),), delivered)
+    log_info("Outbox retried", channels_ok=delivered, channels=len(results))
+    return delivered
+
+def outbox_discard_channel(channel):
+    """Drop everything still queued for a channel that was removed"""
+    if _state_db is None:
+        return
+    with _outbox_lock, _state_lock:
         try:
-            current_time = time.time()
-            
-            # Check for commands
-            updates = get_updates()
-            for update in updates:
-                handle_command(update)
+            with _state_db:
+                message_ids = {message_id for (message_id,) in _state_db.execute(
+                    "SELECT DISTINCT message_id FROM outbox WHERE channel = ?", (channel,))}
+                _state_db.execute("DELETE FROM outbox WHERE channel = ?", (channel,))
+                purge_outbox_messages(message_ids)
+        except sqlite3.Error as e:
+            log_error("Error saving outbox", error=str(e))
+
+def outbox_pending_count():
+    if _state_db is None:
+        return 0
+    with _state_lock:
+        return _state_db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+# ============================================================================
+# Delivery Workers
+# ============================================================================
+
+# Settings a worker needs. Spawned workers re-import this file, so values changed at runtime are passed along
+WORKER_CONFIG_KEYS = (
+    "TELEGRAM_API", "TELEGRAM_GLOBAL_RATE", "TELEGRAM_CHANNEL_RATE", "TELEGRAM_PRIVATE_CHAT_RATE",
+    "TELEGRAM_CHAT_BURST", "SEND_CONCURRENCY", "TELEGRAM_SEND_RETRIES", "RETRY_BASE_DELAY", "RETRY_MAX_DELAY",
+    "BREAKER_FAILURE_THRESHOLD", "BREAKER_RESET_TIMEOUT", "HTTP_POOL_SIZES", "HTTP_DEFAULT_POOL_SIZE",
+    "HTTP_TIMEOUTS", "HTTP_DEFAULT_TIMEOUT", "LOG_LEVEL", "LOG_FORMAT", "LOG_FILE", "LOG_FLUSH_INTERVAL",
+)
+SNAPSHOT_HEADER = struct.Struct("!QQ")  # Sequence number (odd while a write is in progress), payload length
+delivery_workers = None  # DeliveryWorkers, started by run_bot_async when WORKER_PROCESSES is set
+
+def write_shared_snapshot(buffer, payload):
+    """Publish payload in the shared block under a seqlock; returns its (even) sequence number"""
+    if SNAPSHOT_HEADER.size + len(payload) > len(buffer):
+        raise ValueError(f"snapshot of {len(payload)} bytes exceeds SHARED_SNAPSHOT_SIZE")
+    sequence = SNAPSHOT_HEADER.unpack_from(buffer)[0]
+    SNAPSHOT_HEADER.pack_into(buffer, 0, sequence + 1, 0)
+    buffer[SNAPSHOT_HEADER.size:SNAPSHOT_HEADER.size + len(payload)] = payload
+    SNAPSHOT_HEADER.pack_into(buffer, 0, sequence + 2, len(payload))
+    return sequence + 2
+
+def read_shared_snapshot(buffer, sequence):
+    """The payload published as `sequence`; None once a newer one is being written over it"""
+    current, length = SNAPSHOT_HEADER.unpack_from(buffer)
+    if current != sequence:
+        return None
+    payload = bytes(buffer[SNAPSHOT_HEADER.size:SNAPSHOT_HEADER.size + length])
+    # A changed sequence means the copy may be torn
+    return payload if SNAPSHOT_HEADER.unpack_from(buffer)[0] == sequence else None
+
+def assign_shards(channels, current, worker_count):
+    """Channel -> worker index map, keeping current assignments where possible
+    
+    Channels only move off workers holding more than their share, and new
+    channels fill the smallest shards, so every shard ends up within one
+    channel of the others.
+    """
+    shards = {index: [] for index in range(worker_count)}
+    unassigned = []
+    for channel in channels:
+        owner = current.get(channel)
+        if owner in shards:
+            shards[owner].append(channel)
+        else:
+            unassigned.append(channel)
+    
+    # The largest shards get the remainder, so the fewest channels move
+    ranked = sorted(shards, key=lambda index: -len(shards[index]))
+    quota = {index: len(channels) // worker_count + (rank < len(channels) % worker_count)
+             for rank, index in enumerate(ranked)}
+    for index, owned in shards.items():
+        unassigned.extend(owned[quota[index]:])
+        del owned[quota[index]:]
+    for index, owned in shards.items():
+        while len(owned) < quota[index]:
+            owned.append(unassigned.pop())
+    return {channel: index for index, owned in shards.items() for channel in owned}
+
+def delivery_worker_main(index, config, snapshot_name, connection):
+    """Worker process: deliver each published post to the channels of this worker's shard"""
+    global global_send_bucket, telegram_breaker, _send_executor
+    globals().update(config)
+    global_send_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+    telegram_breaker = CircuitBreaker("Telegram", BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+    _send_executor = ThreadPoolExecutor(max_workers=SEND_CONCURRENCY, thread_name_prefix="send")
+    setup_logging()
+    snapshot = shared_memory.SharedMemory(name=snapshot_name)
+    shard = set()
+    try:
+        while True:
+            command, *args = connection.recv()
+            if command == "stop":
+                break
+            if command == "shard":
+                # Edit-in-place state travels with the channels
+                channels, posts = args
+                shard = set(channels)
+                channel_posts.clear()
+                channel_posts.update(posts)
+            elif command == "post":
+                sequence = args[0]
+                payload = read_shared_snapshot(snapshot.buf, sequence)
+                if payload is None:
+                    connection.send((sequence, [], {}))
+                    continue
+                post = json.loads(payload)
+                deliveries = [(message, [channel for channel in channels if channel in shard])
+                              for message, channels in post["deliveries"]]
+                results = deliver_parts_to_channels(deliveries, post["edit"])
+                posts = {channel: channel_posts[channel] for channel, *_ in results if channel in channel_posts}
+                connection.send((sequence, results, posts))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        snapshot.close()
+        shutdown_logging()
+
+class DeliveryWorkers:
+    """Worker processes that each deliver to their own shard of CHANNELS
+    
+    This process stays the coordinator: it fetches and renders once per
+    tick, writes the rendered post to a shared-memory block and only sends
+    the workers its sequence number.
+    """
+    
+    def __init__(self, count, snapshot_size=SHARED_SNAPSHOT_SIZE):
+        self.count = count
+        self.context = multiprocessing.get_context("spawn")
+        self.snapshot = shared_memory.SharedMemory(create=True, size=snapshot_size)
+        SNAPSHOT_HEADER.pack_into(self.snapshot.buf, 0, 0, 0)
+        self.processes = [None] * count
+        self.connections = [None] * count
+        self.assigned = [None] * count  # Channels last sent to each worker
+        self.shards = {}  # channel -> worker index
+        self.rebalance_pending = False
+        self.lock = threading.Lock()
+    
+    def start_worker(self, index):
+        config = {key: globals()[key] for key in WORKER_CONFIG_KEYS}
+        # The bot-wide send rate is split between the workers
+        config["TELEGRAM_GLOBAL_RATE"] = TELEGRAM_GLOBAL_RATE / self.count
+        connection, child_connection = self.context.Pipe()
+        process = self.context.Process(target=delivery_worker_main, name=f"delivery-{index}", daemon=True,
+                                       args=(index, config, self.snapshot.name, child_connection))
+        process.start()
+        child_connection.close()
+        self.processes[index] = process
+        self.connections[index] = connection
+        self.assigned[index] = None  # The new process needs its shard
+    
+    def start(self):
+        for index in range(self.count):
+            self.start_worker(index)
+        with self.lock:
+            self.rebalance_locked()
+        log_info("Delivery workers started", workers=self.count, channels=len(self.shards))
+    
+    def stop(self):
+        for connection in self.connections:
+            try:
+                connection.send(("stop",))
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.snapshot.close()
+        self.snapshot.unlink()
+    
+    def rebalance(self):
+        """Reassign shards after channels were added or removed; deferred while a post is going out"""
+        if self.lock.acquire(blocking=False):
+            try:
+                self.rebalance_locked()
+            finally:
+                self.lock.release()
+        else:
+            self.rebalance_pending = True
+    
+    def rebalance_locked(self):
+        self.rebalance_pending = False
+        self.shards = assign_shards(CHANNELS.copy(), self.shards, self.count)
+        for index in range(self.count):
+            channels = sorted(channel for channel, owner in self.shards.items() if owner == index)
+            if channels != self.assigned[index]:
+                with _channel_posts_lock:
+                    posts = {channel: channel_posts[channel] for channel in channels if channel in channel_posts}
+                self.connections[index].send(("shard", channels, posts))
+                self.assigned[index] = channels
+    
+    def deliver(self, deliveries, edit=False):
+        """Publish (message, channels) pairs and wait for the workers; returns deliver_parts results"""
+        with self.lock:
+            for index, process in enumerate(self.processes):
+                if not process.is_alive():
+                    log_error("Delivery worker died, restarting it", worker=index, exitcode=process.exitcode)
+                    self.start_worker(index)
+            channels = {channel for _, targets in deliveries for channel in targets}
+            if self.rebalance_pending or not channels <= self.shards.keys() or None in self.assigned:
+                self.rebalance_locked()
             
-            # Post price if bot is running and interval has passed
-            if bot_running and (current_time - last_price_post) >= post_interval:
-                # Get top crypto prices (number set by admin)
-                crypto_data = get_top_crypto_prices(limit=crypto_count)
-                
-                if crypto_data:
-                    # Format and send message
-                    message = format_top_crypto_message(crypto_data, coin_count=crypto_count)
-                    if message and send_message_to_channel(message):
-                        last_price_post = current_time
-                        print(f"[SUCCESS] Top {crypto_count} crypto prices posted at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-                        sys.stdout.flush()
-                    else:
-                        print(f"[WARNING] Failed to send message at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-                        sys.stdout.flush()
-                else:
-                    print(f"[WARNING] Failed to fetch crypto prices at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-                    sys.stdout.flush()
-                    # Wait a bit before next attempt to avoid API spam
-                    if api_fail_count > 0:
-                        wait_time = min(api_fail_count * 5, 30)  # Max 30 seconds
-                        print(f"[INFO] Waiting {wait_time} seconds before next API attempt...")
-                        sys.stdout.flush()
-                        time.sleep(wait_time)
+            payload = json.dumps({"edit": edit, "deliveries": deliveries}).encode("utf-8")
+            sequence = write_shared_snapshot(self.snapshot.buf, payload)
+            waiting = {}  # connection -> worker index
+            for index in {self.shards[channel] for channel in channels if channel in self.shards}:
+                self.connections[index].send(("post", sequence))
+                waiting[self.connections[index]] = index
             
-            # Small sleep to avoid high CPU usage
-            time.sleep(1)
+            results = []
+            deadline = time.monotonic() + WORKER_DELIVERY_TIMEOUT
+            while waiting:
+                ready = multiprocessing.connection.wait(list(waiting), max(0.0, deadline - time.monotonic()))
+                if not ready:
+                    log_error("Delivery workers timed out", workers=sorted(waiting.values()))
+                    break
+                for connection in ready:
+                    try:
+                        reply_sequence, worker_results, posts = connection.recv()
+                    except EOFError:
+                        log_error("Delivery worker exited during a post", worker=waiting.pop(connection))
+                        continue
+                    if reply_sequence != sequence:
+                        continue  # Late answer to a post that timed out
+                    del waiting[connection]
+                    results.extend(worker_results)
+                    with _channel_posts_lock:
+                        channel_posts.update(posts)
+        
+        delivered = {result[0] for result in results}
+        results.extend((channel, f"{channel} (Error: no answer from its delivery worker)", 0, 0)
+                       for channel in channels - delivered)
+        if edit:
+            save_channel_posts()
+        return results
+    
+    def describe(self):
+        sizes = [len(channels or ()) for channels in self.assigned]
+        alive = sum(1 for process in self.processes if process.is_alive())
+        return f"{alive}/{self.count} running, shards of {'/'.join(str(size) for size in sizes)} channels"
+
+def rebalance_delivery_shards():
+    """Hand changed CHANNELS to the delivery workers; safe to call from any thread"""
+    if delivery_workers is not None:
+        delivery_workers.rebalance()
+
+# ============================================================================
+# Webhook
+# ============================================================================
+
+_webhook_lock = threading.Lock()
+
+def set_webhook(url, secret_token, drop_pending_updates=False):
+    """Register url as the bot's webhook; True on success"""
+    payload = {
+        "url": url,
+        "secret_token": secret_token,
+        "max_connections": 1,  # One update at a time keeps update_ids in order
+        "drop_pending_updates": drop_pending_updates,
+    }
+    try:
+        result = http_post(f"{TELEGRAM_API}/setWebhook", json=payload).json()
+    except Exception as e:
+        log_error("Error setting webhook", error=str(e))
+        return False
+    if not result.get("ok"):
+        log_error("Telegram rejected webhook", url=url, error=result.get("description"))
+        return False
+    return True
+
+def delete_webhook():
+    """Remove the webhook so getUpdates works again (pending updates are kept)"""
+    try:
+        return http_post(f"{TELEGRAM_API}/deleteWebhook", json={"drop_pending_updates": False}).json().get("ok", False)
+    except Exception as e:
+        log_error("Error deleting webhook", error=str(e))
+        return False
+
+def accept_webhook_update(update):
+    """Journal a pushed update; False if it was already received (Telegram redelivers on errors)"""
+    global last_update_id
+    with _webhook_lock:
+        if update["update_id"] <= last_update_id:
+            return False
+        last_update_id = update["update_id"]
+        record_updates([update])
+    return True
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """Receives updates POSTed by Telegram and hands them to the command worker"""
+    
+    def do_POST(self):
+        if self.path.split("?")[0] != self.server.webhook_path:
+            self.send_error(404)
+            return
+        token = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token.encode("utf-8"), self.server.secret_token.encode("utf-8")):
+            inc_counter("bot_webhook_requests_total", (("result", "forbidden"),))
+            self.send_error(403)
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if not 0 < length <= WEBHOOK_MAX_BODY:
+                raise ValueError(f"bad Content-Length {length}")
+            update = json.loads(self.rfile.read(length))
+            if not isinstance(update, dict) or not isinstance(update.get("update_id"), int):
+                raise ValueError("not an update")
+        except ValueError as e:
+            inc_counter("bot_webhook_requests_total", (("result", "invalid"),))
+            self.send_error(400, str(e))
+            return
+    
+        # Journal before answering: Telegram only stops redelivering once it gets a 200
+        if accept_webhook_update(update):
+            inc_counter("bot_webhook_requests_total", (("result", "accepted"),))
+            self.server.loop.call_soon_threadsafe(self.server.update_queue.put_nowait, update)
+        else:
+            inc_counter("bot_webhook_requests_total", (("result", "duplicate"),))
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+    
+    def log_message(self, format, *args):
+        pass
+
+def start_webhook_server(loop, update_queue, drop_pending_updates=False):
+    """Start the webhook listener and register it with Telegram; returns the server or None"""
+    secret_token = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    try:
+        server = ThreadingHTTPServer((WEBHOOK_HOST, WEBHOOK_PORT), WebhookHandler)
+    except OSError as e:
+        log_error("Cannot start webhook listener", host=WEBHOOK_HOST, port=WEBHOOK_PORT, error=str(e))
+        return None
+    server.daemon_threads = True
+    server.webhook_path = urlsplit(WEBHOOK_URL).path or "/"
+    server.secret_token = secret_token
+    server.loop = loop
+    server.update_queue = update_queue
+    threading.Thread(target=server.serve_forever, name="webhook", daemon=True).start()
+    
+    if not set_webhook(WEBHOOK_URL, secret_token, drop_pending_updates):
+        server.shutdown()
+        server.server_close()
+        return None
+    log_info("Webhook registered", url=WEBHOOK_URL, listen=f"{WEBHOOK_HOST}:{server.server_port}")
+    return server
+
+# ============================================================================
+# Bot Runtime
+# ============================================================================
+
+async def price_stream_task():
+    """Keep live_prices current from the WebSocket ticker, reconnecting with backoff"""
+    global price_stream_connected
+    attempt = 0
+    while True:
+        try:
+            reader, writer = await websocket_connect(STREAM_URL)
+            log_info("Price stream connected", url=STREAM_URL)
+            # The ticker only sends CoinCap ids; learn their symbols to match them to CoinGecko ids
+            assets = await asyncio.to_thread(fetch_coincap_markets, MAX_COIN_COUNT)
+            if assets:
+                remember_coins("coincap", assets)
+            price_stream_connected = True
+            try:
+                async for message in websocket_messages(reader, writer, STREAM_IDLE_TIMEOUT):
+                    prices = update_live_prices(json.loads(message))
+                    if prices:
+                        # A crossed alert is saved to the state DB, which must not block the event loop
+                        await asyncio.to_thread(check_price_alerts, prices)
+                    attempt = 0
+            finally:
+                price_stream_connected = False
+                writer.close()
+            log_warning("Price stream closed by server")
+        except asyncio.CancelledError:
+            raise
+        except (OSError, EOFError, asyncio.TimeoutError, ValueError) as e:
+            log_warning("Price stream error", error=f"{type(e).__name__}: {e}")
+        except Exception as e:
+            log_error("Unexpected error in price stream", error=f"{type(e).__name__}: {e}")
+        
+        # Exponential back-off with jitter, reset once messages flow again
+        delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1.0)
+        attempt += 1
+        inc_counter("bot_price_stream_reconnects_total")
+        await asyncio.sleep(delay)
+
+async def check_channels_task():
+    """Verify channel access alongside the first posts instead of before them"""
+    log_info("Testing bot access to channels")
+    try:
+        accessible = await asyncio.to_thread(test_bot_access)
+    except Exception as e:
+        log_error("Unexpected error while testing channel access", error=str(e))
+        return
+    if not accessible:
+        log_warning("Bot may not have access to the channel! Ensure the bot is a channel administrator "
+                    "with 'Post Messages' permission and that all channels are correct. Continuing anyway...")
+
+async def poll_updates_task():
+    """Long-poll Telegram for updates and queue them for the command worker"""
+    while True:
+        try:
+            updates = await asyncio.to_thread(get_updates, POLL_TIMEOUT)
+            if updates is None:
+                # Request failed - back off instead of spinning on getUpdates
+                await asyncio.sleep(1)
+                continue
+            await asyncio.to_thread(record_updates, updates)
+            for update in updates:
+                await command_queue.put(update)
             
-        except KeyboardInterrupt:
-            print()
-            print()
-            print("=" * 50)
-            print("Bot stopped by user")
-            print("=" * 50)
-            sys.stdout.flush()
-            break
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log_error("Unexpected error while polling updates", error=str(e))
+            await asyncio.sleep(5)  # Wait before retrying
+
+def update_chat_id(update):
+    """Chat an update belongs to; None for updates without a message"""
+    return update.get("message", {}).get("chat", {}).get("id")
+
+async def command_worker():
+    """Handle queued commands: different chats concurrently, each chat's commands in order"""
+    backlogs = {}  # chat id -> deque of updates, the first one being handled
+    drains = set()
+    slots = asyncio.Semaphore(COMMAND_CONCURRENCY)
+    
+    async def drain(chat_id):
+        backlog = backlogs[chat_id]
+        while backlog:
+            update = backlog[0]
+            async with slots:
+                try:
+                    await asyncio.to_thread(handle_command, update)
+                except Exception as e:
+                    log_error("Unexpected error while handling command", chat_id=chat_id, error=str(e))
+            await asyncio.to_thread(mark_update_handled, update)
+            backlog.popleft()
+            command_queue.task_done()
+        del backlogs[chat_id]
+    
+    try:
+        while True:
+            update = await command_queue.get()
+            chat_id = update_chat_id(update)
+            if chat_id in backlogs:
+                backlogs[chat_id].append(update)
+                continue
+            backlogs[chat_id] = collections.deque([update])
+            task = asyncio.create_task(drain(chat_id), name=f"commands_{chat_id}")
+            drains.add(task)
+            task.add_done_callback(drains.discard)
+    finally:
+        for task in drains:
+            task.cancel()
+
+async def deliver_to_channels(message, edit=False, channels=None, kind=None):
+    """Queue a message for the delivery task and wait until it has been sent"""
+    return await deliver_many_to_channels([(message, channels)], edit, kind)
+
+async def deliver_many_to_channels(deliveries, edit=False, kind=None):
+    """Queue (message, channels) pairs to go out together, concurrently"""
+    done = asyncio.get_running_loop().create_future()
+    await outbound_queue.put((deliveries, edit, kind, done))
+    return await done
+
+async def delivery_task():
+    """Send queued messages to all channels, one message at a time"""
+    while True:
+        deliveries, edit, kind, done = await outbound_queue.get()
+        try:
+            result = await asyncio.to_thread(send_messages_to_channels, deliveries, edit, kind)
         except Exception as e:
-            print(f"[ERROR] Unexpected error: {e}")
-            sys.stdout.flush()
-            time.sleep(5)  # Wait before retrying
+            log_error("Unexpected error while delivering message", error=str(e))
+            result = False
+        if not done.done():
+            done.set_result(result)
+        outbound_queue.task_done()
+
+async def outbox_task():
+    """Retry failed channel deliveries from the outbox without refetching or re-rendering"""
+    while True:
+        try:
+            delivered = await asyncio.to_thread(retry_outbox)
+        except Exception as e:
+            log_error("Unexpected error while retrying the outbox", error=str(e))
+            delivered = 0
+        if not delivered:
+            await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+
+def channel_plan(channel):
+    """Effective (coin count, interval, template, currency) of a channel"""
+    overrides = channel_settings.get(channel, {})
+    return (overrides.get("coins", crypto_count), overrides.get("interval", post_interval),
+            overrides.get("template", "full"), overrides.get("currency", "usd"))
+
+def channel_intervals():
+    """The distinct posting intervals of the channels"""
+    return {channel_plan(channel)[1] for channel in CHANNELS.copy()}
+
+async def post_top_prices(slot, interval):
+    """Post the top-N list to the channels posting every interval seconds; False if it should be retried"""
+    # Channels sharing coin count, template and currency share one render
+    due = {}
+    for channel in CHANNELS.copy():
+        coins, channel_interval, template, currency = channel_plan(channel)
+        if channel_interval == interval:
+            due.setdefault((coins, template, currency), []).append(channel)
+    if not due:
+        return True
+    
+    # One USD markets call for the largest list, sliced per channel. While the
+    # stream is live, prices come from it and the snapshot only supplies ranking
+    limit = max(coins for coins, _, _ in due)
+    crypto_data = await asyncio.to_thread(get_market_snapshot, "usd", limit, price_stream_connected)
+    if crypto_data:
+        crypto_data = apply_live_prices(crypto_data)
+    
+    if not bot_running:
+        # /stop arrived while prices were being fetched
+        return True
+    if not crypto_data:
+        inc_counter("bot_posts_total", (("job", "top"), ("result", "fetch_failed")))
+        log_warning("Failed to fetch crypto prices")
+        return False
+    
+    # Other currencies are converted locally, once per currency per tick
+    converted = {"usd": crypto_data}
+    for currency in {currency for _, _, currency in due} - {"usd"}:
+        converted[currency] = await asyncio.to_thread(convert_market_data, crypto_data, currency)
+    
+    deliveries = []
+    for (coins, template, currency), channels in due.items():
+        if converted[currency] is None:
+            log_warning("No exchange rate, posting USD prices", currency=currency, channels=len(channels))
+            currency = "usd"
+        formatter = MESSAGE_TEMPLATES.get(template, format_top_crypto_message)
+        message = formatter(converted[currency][:coins], coin_count=coins, currency=currency)
+        if message:
+            deliveries.append((message, channels))
+    if deliveries and await deliver_many_to_channels(deliveries, edit=edit_in_place, kind="top"):
+        inc_counter("bot_posts_total", (("job", "top"), ("result", "success")))
+        log_info("Crypto prices posted", coin_count=limit, renders=len(deliveries))
+        return True
+    inc_counter("bot_posts_total", (("job", "top"), ("result", "send_failed")))
+    log_warning("Failed to send price post")
+    return False
+
+async def post_btc_price(slot):
+    """Post the single BTC price card; False if it should be retried"""
+    price, change_24h = await asyncio.to_thread(get_btc_price)
+    
+    if not bot_running:
+        return True
+    if not price:
+        inc_counter("bot_posts_total", (("job", "btc"), ("result", "fetch_failed")))
+        log_warning("Failed to fetch BTC price")
+        return False
+    
+    # Always a new message: edit-in-place tracks one post per channel, the top list
+    if await deliver_to_channels(format_price_message(price, change_24h), kind="btc"):
+        inc_counter("bot_posts_total", (("job", "btc"), ("result", "success")))
+        log_info("BTC price posted", price=price)
+        return True
+    inc_counter("bot_posts_total", (("job", "btc"), ("result", "send_failed")))
+    log_warning("Failed to send BTC price post")
+    return False
+
+class PostJob:
+    """A recurring post with its own interval setting"""
+    
+    def __init__(self, name, get_interval, post):
+        self.name = name
+        self.get_interval = get_interval  # Returns the interval in seconds, 0 when disabled
+        self.post = post  # Coroutine function of the slot, returning False when the post should be retried
+        self.interval = 0  # Interval the current slot was computed with
+        self.slot = None  # Wall-clock boundary the job is waiting for or running
+        self.retrying = False
+
+def top_post_job(interval):
+    """Top-list job for the channels posting every interval seconds; disabled once none do"""
+    return PostJob(f"top_{interval}", lambda: interval if interval in channel_intervals() else 0,
+                   lambda slot: post_top_prices(slot, interval))
+
+post_jobs = [
+    PostJob("btc", lambda: btc_post_interval, post_btc_price),
+]
+top_jobs = {}  # interval -> PostJob, one per distinct channel interval, kept by scheduler_task
+_schedule_loop = None
+_schedule_changed = None  # asyncio.Event that wakes the scheduler
+
+def align_to_interval(wall_time, interval):
+    """First local-time boundary of interval at or after wall_time (60 -> every :00, 3600 -> on the hour)"""
+    offset = datetime.fromtimestamp(wall_time).astimezone().utcoffset().total_seconds()
+    return math.ceil((wall_time + offset) / interval - 1e-6) * interval - offset
+
+def reschedule_posts():
+    """Make the scheduler pick up changed intervals; safe to call from any thread"""
+    if _schedule_loop is not None:
+        _schedule_loop.call_soon_threadsafe(_schedule_changed.set)
+
+async def run_post_job(job):
+    """Run one slot of a job; returns whether the post went out"""
+    if not job.retrying:
+        observe_histogram("bot_post_schedule_lag_seconds", (("job", job.name),), time.time() - job.slot)
+    if not bot_running:
+        return True
+    try:
+        return await job.post(job.slot)
+    except Exception as e:
+        log_error("Unexpected error in post job", job=job.name, error=str(e))
+        return False
+
+async def scheduler_task():
+    """Run post jobs on their interval boundaries from a heap of monotonic deadlines"""
+    global _schedule_loop, _schedule_changed
+    _schedule_loop = asyncio.get_running_loop()
+    _schedule_changed = asyncio.Event()
+    heap = []  # (monotonic deadline, sequence, job)
+    sequence = itertools.count()
+    running = {}  # job -> task
+    
+    def schedule(job, slot, run_at=None):
+        # Wall-clock targets are converted once; the wait itself runs on the monotonic clock
+        job.slot = slot
+        deadline = time.monotonic() + ((run_at or slot) - time.time())
+        heapq.heappush(heap, (deadline, next(sequence), job))
+    
+    def unschedule(job):
+        heap[:] = [entry for entry in heap if entry[2] is not job]
+        heapq.heapify(heap)
+    
+    try:
+        while True:
+            _schedule_changed.clear()
+            now = time.time()
+    
+            # Finished jobs move on to their next boundary (or retry the missed one)
+            for job, task in list(running.items()):
+                if not task.done():
+                    continue
+                del running[job]
+                interval = job.get_interval()
+                if not interval or interval != job.interval:
+                    job.interval = 0  # Re-aligned below
+                    continue
+                retry_at = now + min(max(api_fail_count, 1) * 5, 30)
+                job.retrying = not task.result() and retry_at < job.slot + interval
+                if job.retrying:
+                    schedule(job, job.slot, retry_at)
+                else:
+                    # Skip boundaries that passed while the job ran
+                    schedule(job, align_to_interval(max(job.slot + interval, now), interval))
+    
+            # One top-list job per distinct channel interval, so each runs only on its own boundaries
+            for interval, job in list(top_jobs.items()):
+                if job not in running and not job.get_interval():
+                    unschedule(job)
+                    del top_jobs[interval]
+            for interval in channel_intervals() - top_jobs.keys():
+                top_jobs[interval] = top_post_job(interval)
+    
+            # Jobs whose interval was changed, enabled or disabled
+            for job in post_jobs + list(top_jobs.values()):
+                interval = job.get_interval()
+                if job in running or interval == job.interval:
+                    continue
+                unschedule(job)
+                job.interval = interval
+                job.retrying = False
+                if interval:
+                    schedule(job, align_to_interval(now, interval))
+                    log_info("Post job scheduled", job=job.name, interval=interval,
+                             first_post=datetime.fromtimestamp(job.slot).strftime("%Y-%m-%d %H:%M:%S"))
+    
+            # Start every job that is due, then sleep until the next deadline or a change
+            while heap and heap[0][0] <= time.monotonic():
+                _, _, job = heapq.heappop(heap)
+                task = asyncio.create_task(run_post_job(job), name=f"post_{job.name}")
+                task.add_done_callback(lambda task: _schedule_changed.set())
+                running[job] = task
+            timeout = max(0.0, heap[0][0] - time.monotonic()) if heap else None
+            try:
+                await asyncio.wait_for(_schedule_changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        for task in running.values():
+            task.cancel()
+        for job in post_jobs:
+            job.interval = 0
+        top_jobs.clear()
+        _schedule_loop = None
+
+async def run_bot_async():
+    """Run the bot: update polling or webhook, post scheduler and delivery as separate tasks"""
+    global outbound_queue, command_queue, delivery_workers, price_history
+    
+    setup_logging()
+    
+    # Restore settings, update offset and caches from the last run
+    open_state_db(STATE_DB_PATH)
+    offset_restored = load_bot_state()
+    if any(channel_plan(channel)[3] != "usd" for channel in CHANNELS):
+        get_fx_rates()  # Start the exchange-rate fetch now so the first posts are converted
+    open_price_history()
+    start_metrics_server()
+    
+    log_info("BTC Price Bot starting", channels=CHANNELS, post_interval=post_interval, coin_count=crypto_count,
+             posting_mode="edit in place" if edit_in_place else "new message", admin_users=len(ADMIN_USER_IDS))
+    if not ADMIN_USER_IDS:
+        log_warning("No admin users configured. All users can control the bot!")
+    
+    log_info("Bot is running. Admin commands are enabled. Press Ctrl+C to stop the bot.",
+             max_api_retries=MAX_API_RETRIES, cached_price_fallback=True)
+    
+    outbound_queue = asyncio.Queue()
+    command_queue = asyncio.Queue()
+    
+    if WORKER_PROCESSES:
+        # Coordinator/worker mode: this process fetches and renders, the workers deliver
+        delivery_workers = DeliveryWorkers(WORKER_PROCESSES)
+        await asyncio.to_thread(delivery_workers.start)
+    
+    if offset_restored:
+        # Resume exactly where the last run stopped
+        pending_updates = load_pending_updates()
+        log_info("Resuming at saved update offset", offset=last_update_id + 1, pending_commands=len(pending_updates))
+        for update in pending_updates:
+            command_queue.put_nowait(update)
+    
+    # Webhook mode when configured; polling if it is off or cannot be registered
+    webhook_server = None
+    if WEBHOOK_URL:
+        # On a first run Telegram drops the commands sent while the bot was offline
+        webhook_server = await asyncio.to_thread(start_webhook_server, asyncio.get_running_loop(),
+                                                 command_queue, not offset_restored)
+        if webhook_server is None:
+            log_warning("Webhook unavailable, falling back to getUpdates polling")
+    if webhook_server is None and not offset_restored:
+        # First run - skip commands sent while the bot was offline
+        await asyncio.to_thread(get_updates)
+        save_settings({"last_update_id": last_update_id})
+    
+    tasks = [
+        asyncio.create_task(command_worker(), name="commands"),
+        asyncio.create_task(scheduler_task(), name="scheduler"),
+        asyncio.create_task(delivery_task(), name="delivery"),
+        asyncio.create_task(outbox_task(), name="outbox"),
+        asyncio.create_task(check_channels_task(), name="check_channels"),
+    ]
+    if webhook_server is None:
+        tasks.append(asyncio.create_task(poll_updates_task(), name="poll_updates"))
+    if STREAM_URL:
+        tasks.append(asyncio.create_task(price_stream_task(), name="price_stream"))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # The webhook stays registered so Telegram queues commands while the bot is down
+        if webhook_server is not None:
+            webhook_server.shutdown()
+            webhook_server.server_close()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if delivery_workers is not None:
+            await asyncio.to_thread(delivery_workers.stop)
+            delivery_workers = None
+        if price_history is not None:
+            history, price_history = price_history, None
+            history.close()
+        shutdown_logging()
+
+def run_bot():
+    """Main function to run the bot"""
+    try:
+        asyncio.run(run_bot_async())
+    except KeyboardInterrupt:
+        print()
+        print()
+        print("=" * 50)
+        print("Bot stopped by user")
+        print("=" * 50)
+        sys.stdout.flush()
 
 # ============================================================================
 # Main Entry Point
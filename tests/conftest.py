@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telegram_btc_bot as bot  # noqa: E402
+
+
+@pytest.fixture
+def state_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "_state_db", None)
+    monkeypatch.setattr(bot, "CHANNELS", ["@one", "@two"])
+    db = bot.open_state_db(str(tmp_path / "state.db"))
+    yield db
+    db.close()
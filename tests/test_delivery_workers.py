@@ -0,0 +1,132 @@
+import json
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import telegram_btc_bot as bot
+
+
+class FakeTelegram:
+    """sendMessage / editMessageText stand-in that records every call"""
+
+    def __init__(self):
+        self.calls = []  # (method, chat_id)
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                params = json.loads(self.rfile.read(length)) if length else {}
+                method = self.path.rsplit("/", 1)[-1]
+                with fake.lock:
+                    fake.calls.append((method, params.get("chat_id")))
+                    message_id = params.get("message_id", len(fake.calls))
+                data = json.dumps({"ok": True, "result": {"message_id": message_id}}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/botTEST"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def sends(self, method="sendMessage"):
+        with self.lock:
+            return Counter(chat_id for called, chat_id in self.calls if called == method)
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def telegram(monkeypatch):
+    fake = FakeTelegram()
+    monkeypatch.setattr(bot, "TELEGRAM_API", fake.url)
+    yield fake
+    fake.close()
+
+
+@pytest.fixture
+def workers(state_db, telegram, monkeypatch):
+    monkeypatch.setattr(bot, "CHANNELS", [f"@channel_{index}" for index in range(4)])
+    monkeypatch.setattr(bot, "channel_posts", {})
+    monkeypatch.setattr(bot, "save_channel_posts", lambda: None)
+    pool = bot.DeliveryWorkers(2)
+    pool.start()
+    monkeypatch.setattr(bot, "delivery_workers", pool)
+    yield pool
+    pool.stop()
+
+
+def test_post_through_workers_is_sent_exactly_once(workers, telegram, state_db):
+    assert bot.send_messages_to_channels([("<b>BTC</b> $1", None)], kind="top")
+    state_db.execute("UPDATE outbox SET next_attempt = 0")
+    assert bot.retry_outbox() == 0
+
+    assert telegram.sends() == Counter({channel: 1 for channel in bot.CHANNELS})
+    assert all(process.is_alive() for process in workers.processes)
+    assert state_db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0] == 0
+
+
+def test_workers_round_trip_posts_and_edit_state(workers, telegram):
+    channels = list(bot.CHANNELS)
+    assert sorted(workers.shards) == sorted(channels)
+    assert sorted(len(assigned) for assigned in workers.assigned) == [2, 2]
+
+    # The post travels through shared memory; results and channel_posts come back
+    results = workers.deliver([("<b>BTC</b> $1", channels)], edit=True)
+    assert sorted(channel for channel, *_ in results) == sorted(channels)
+    assert all(error is None for _, error, _, _ in results)
+    assert sorted(bot.channel_posts) == sorted(channels)
+    assert telegram.sends() == Counter({channel: 1 for channel in channels})
+
+    # A moved channel takes its edit-in-place state along to its new worker
+    bot.CHANNELS.remove(channels[0])
+    bot.CHANNELS.append("@channel_new")
+    workers.rebalance()
+    assert sorted(workers.shards) == sorted(bot.CHANNELS)
+    results = workers.deliver([("<b>BTC</b> $2", list(bot.CHANNELS))], edit=True)
+    assert all(error is None for _, error, _, _ in results)
+    assert telegram.sends("editMessageText") == Counter({channel: 1 for channel in channels[1:]})
+    assert telegram.sends()["@channel_new"] == 1
+
+
+def shard_sizes(shards, worker_count):
+    return sorted(Counter(shards.values())[index] for index in range(worker_count))
+
+
+def test_assign_shards_balances_new_channels():
+    channels = [f"@c{index}" for index in range(7)]
+    shards = bot.assign_shards(channels, {}, 3)
+    assert sorted(shards) == channels
+    assert shard_sizes(shards, 3) == [2, 2, 3]
+
+
+def test_assign_shards_keeps_channels_in_place_when_rebalancing():
+    channels = [f"@c{index}" for index in range(6)]
+    shards = bot.assign_shards(channels, {}, 3)
+
+    # Added channels fill the smallest shards; nothing already placed moves
+    grown = bot.assign_shards(channels + ["@c6", "@c7", "@c8"], shards, 3)
+    assert all(grown[channel] == shards[channel] for channel in channels)
+    assert shard_sizes(grown, 3) == [3, 3, 3]
+
+    # Removing a whole shard's channels moves only as many as needed to even out
+    emptied = [channel for channel in grown if grown[channel] == 0]
+    remaining = [channel for channel in grown if channel not in emptied]
+    shrunk = bot.assign_shards(remaining, grown, 3)
+    assert sorted(shrunk) == sorted(remaining)
+    assert shard_sizes(shrunk, 3) == [2, 2, 2]
+    assert sum(shrunk[channel] != grown[channel] for channel in remaining) == 2
@@ -0,0 +1,40 @@
+import telegram_btc_bot as bot
+
+
+def deliver_all(error=None, retry_after=None):
+    def dispatch(deliveries, edit=False):
+        return [(channel, error, 0 if error else 1, retry_after) for _, channels in deliveries for channel in channels]
+    return dispatch
+
+
+def table_sizes(db):
+    return tuple(db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ("outbox", "outbox_messages"))
+
+
+def test_delivered_messages_leave_nothing_behind(state_db, monkeypatch):
+    monkeypatch.setattr(bot, "dispatch_deliveries", deliver_all())
+    for index in range(5):
+        assert bot.send_messages_to_channels([(f"post {index}", None)], kind="top")
+        assert bot.send_messages_to_channels([(f"note {index}", None)])
+    assert table_sizes(state_db) == (0, 0)
+
+
+def test_superseded_and_retried_messages_are_purged(state_db, monkeypatch):
+    monkeypatch.setattr(bot, "dispatch_deliveries", deliver_all("timeout", retry_after=0))
+    assert bot.send_messages_to_channels([("post 1", None)], kind="top")
+    assert bot.send_messages_to_channels([("post 2", None)], kind="top")
+    assert table_sizes(state_db) == (2, 1)
+
+    state_db.execute("UPDATE outbox SET next_attempt = 0")
+    monkeypatch.setattr(bot, "dispatch_deliveries", deliver_all())
+    assert bot.retry_outbox() == 2
+    assert table_sizes(state_db) == (0, 0)
+
+
+def test_removed_channel_is_dropped_from_the_outbox(state_db, monkeypatch):
+    monkeypatch.setattr(bot, "dispatch_deliveries", deliver_all("timeout", retry_after=0))
+    assert bot.send_messages_to_channels([("post", ["@one"])], kind="top")
+    assert table_sizes(state_db) == (1, 1)
+
+    bot.outbox_discard_channel("@one")
+    assert table_sizes(state_db) == (0, 0)
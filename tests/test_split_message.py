@@ -0,0 +1,71 @@
+import re
+
+import telegram_btc_bot as bot
+
+
+def assert_balanced(part):
+    stack = []
+    for tag in re.findall(r"<[^>]*>", part):
+        name = re.match(r"</?\s*([a-zA-Z][\w-]*)", tag).group(1).lower()
+        if tag.startswith("</"):
+            assert stack and stack[-1] == name, part
+            stack.pop()
+        else:
+            stack.append(name)
+    assert not stack, part
+
+
+def test_tag_spanning_lines_is_closed_and_reopened():
+    lines = [f"{i}. <i>Coin {i}</i>: $1,234.56" for i in range(1, 21)]
+    message = "<b>" + "\n".join(lines) + "</b>"
+    parts = bot.split_message(message, max_length=100)
+    assert len(parts) > 1
+    for part in parts:
+        assert len(part) <= 100
+        assert part.startswith("<b>") and part.endswith("</b>")
+        assert_balanced(part)
+    text = "\n".join(re.sub(r"<[^>]*>", "", part) for part in parts)
+    assert text == re.sub(r"<[^>]*>", "", message)
+
+
+def test_long_line_is_split_between_words():
+    message = "<b>" + " ".join(f"word{i}" for i in range(60)) + "</b>"
+    parts = bot.split_message(message, max_length=50)
+    assert len(parts) > 1
+    for part in parts:
+        assert len(part) <= 50
+        assert_balanced(part)
+    words = " ".join(re.sub(r"<[^>]*>", "", part) for part in parts).split()
+    assert words == [f"word{i}" for i in range(60)]
+
+
+def test_overlong_word_is_cut():
+    parts = bot.split_message("<code>" + "x" * 120 + "</code>", max_length=40)
+    for part in parts:
+        assert len(part) <= 40
+        assert_balanced(part)
+    assert "".join(re.sub(r"<[^>]*>", "", part) for part in parts) == "x" * 120
+
+
+def test_short_message_is_unchanged():
+    assert bot.split_message("<b>BTC</b>\n$1") == ["<b>BTC</b>\n$1"]
+
+
+def test_tag_opened_mid_chunk_is_closed_at_the_cut():
+    lines = [f"line {i} with some padding text" for i in range(12)]
+    message = "header\n<i>" + "\n".join(lines) + "</i>\nfooter"
+    parts = bot.split_message(message, max_length=80)
+    for part in parts:
+        assert len(part) <= 80
+        assert_balanced(part)
+    assert parts[-1].endswith("footer")
+
+
+def test_nested_tags_at_a_small_limit_stay_within_it():
+    message = " <code>&amp;\n<code>\n\n</code><b><code><i><i></i></i>&amp;\n</code>" + "x" * 50 + "</b></code>"
+    parts = bot.split_message(message, 44)
+    for part in parts:
+        assert len(part) <= 44
+        assert_balanced(part)
+    strip = lambda text: "".join(bot.HTML_TAG_RE.sub("", text).split())
+    assert strip("".join(parts)) == strip(message)